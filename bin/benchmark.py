@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run the benchmarks of IAL-build, on synthetic repositories and packs.
+"""
+import os
+import argparse
+import sys
+
+# Automatically set the python path
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(repo_path, 'src'))
+
+from ial_build.benchmarks import main, SCALES
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark IAL-build on synthetic IAL repositories and packs.')
+    parser.add_argument('-s', '--scales',
+                        nargs='+',
+                        choices=sorted(SCALES.keys()),
+                        help="Scales of the synthetic material (defaults to: small).",
+                        default=['small'])
+    parser.add_argument('-n', '--repeat',
+                        type=int,
+                        help="Number of runs of each operation (defaults to: 3).",
+                        default=3)
+    parser.add_argument('-w', '--workdir',
+                        help="Directory in which to generate the material (defaults to a temporary one).",
+                        default=None)
+    parser.add_argument('-o', '--output',
+                        help="File in which to save results, as JSON.",
+                        default=None)
+    parser.add_argument('-r', '--reference',
+                        help="Reference results (JSON) to compare to; exit with error in case of regressions.",
+                        default=None)
+    parser.add_argument('-t', '--tolerance',
+                        type=float,
+                        help="Relative slowdown tolerated vs. reference (defaults to: 0.25).",
+                        default=0.25)
+    parser.add_argument('--keep',
+                        action='store_true',
+                        help="Keep the temporary working directory.",
+                        default=False)
+    args = parser.parse_args()
+
+    regressions = main(scales=args.scales,
+                       repeat=args.repeat,
+                       workdir=args.workdir,
+                       output=args.output,
+                       reference=args.reference,
+                       tolerance=args.tolerance,
+                       keep=args.keep)
+    if len(regressions) > 0:
+        sys.exit(1)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Publish the executables built in a pack into the shared artifact store,
+or fetch them from it into a pack with the same provenance.
+"""
+import os
+import argparse
+import sys
+
+# Automatically set the python path
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(repo_path, 'src'))
+
+from ial_build.pygmkpack import Pack
+from ial_build.artifacts import ArtifactStore
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish the executables of a pack into the shared artifact ' +
+                                                 'store, or fetch them from it.')
+    parser.add_argument('action',
+                        choices=['publish', 'fetch'],
+                        help="Publish executables built in the pack, or fetch them into the pack.")
+    parser.add_argument('packname',
+                        help="Name of the pack.")
+    parser.add_argument('programs',
+                        help="Programs, e.g. 'MASTERODB,BATOR'.")
+    parser.add_argument('-H', '--homepack',
+                        help="Home of packs (defaults to $HOMEPACK).",
+                        default=None)
+    parser.add_argument('-s', '--store',
+                        help="Directory of the artifact store (defaults to $IAL_BUILD_ARTIFACT_STORE).",
+                        default=None)
+    args = parser.parse_args()
+
+    pack = Pack(args.packname, preexisting=True, homepack=args.homepack)
+    store = ArtifactStore(args.store)
+    missing = []
+    for program in [p.strip() for p in args.programs.split(',') if p.strip() != '']:
+        if args.action == 'publish':
+            if store.publish(pack, program) is None:
+                print("{} not built in pack".format(program))
+                missing.append(program)
+        elif store.fetch(pack, program) is None:
+            missing.append(program)
+    if missing:
+        sys.exit(1)
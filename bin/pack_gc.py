@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Garbage collect packs of a HOMEPACK, according to retention policies.
+"""
+import os
+import argparse
+import sys
+
+# Automatically set the python path
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(repo_path, 'src'))
+
+from ial_build.pack_gc import gc
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Garbage collect packs of a HOMEPACK, according to retention policies. ' +
+                                                 'Dry run unless --delete.')
+    parser.add_argument('-H', '--homepack',
+                        help="Home of packs (defaults to $HOMEPACK).",
+                        default=None)
+    parser.add_argument('-n', '--keep_last',
+                        type=int,
+                        help="Number of most recently active packs to keep per branch (defaults to: 3).",
+                        default=3)
+    parser.add_argument('-d', '--keep_binaries_days',
+                        type=float,
+                        help="Keep packs with binaries younger than that, in days (defaults to: 14).",
+                        default=14.)
+    parser.add_argument('-l', '--logs_older_than_days',
+                        type=float,
+                        help="Also remove log files older than that (days) in kept packs.",
+                        default=None)
+    parser.add_argument('-t', '--threads',
+                        type=int,
+                        help="Number of packs scanned/deleted concurrently (defaults to: 8).",
+                        default=8)
+    parser.add_argument('--delete',
+                        action='store_true',
+                        help="Actually delete (dry run otherwise).",
+                        default=False)
+    args = parser.parse_args()
+
+    gc(homepack=args.homepack,
+       keep_last=args.keep_last,
+       keep_binaries_days=args.keep_binaries_days,
+       logs_older_than_days=args.logs_older_than_days,
+       dryrun=not args.delete,
+       threads=args.threads)
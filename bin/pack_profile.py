@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Report the per compilation unit timings of the compilation of a pack:
+slowest units, parallelism over time and idle phases; or the trends across
+the compilations of the pack.
+"""
+import os
+import argparse
+import sys
+
+# Automatically set the python path
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(repo_path, 'src'))
+
+from ial_build.pygmkpack import Pack
+from ial_build.profiling import history_report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the per compilation unit timings of the compilation ' +
+                                                 'of a pack (compiled with logs, i.e. silently).')
+    parser.add_argument('packname',
+                        help="Name of the pack.")
+    parser.add_argument('-H', '--homepack',
+                        help="Home of packs (defaults to $HOMEPACK).",
+                        default=None)
+    parser.add_argument('-l', '--log',
+                        help="Compilation log to be profiled (defaults to the latest one in the pack).",
+                        default=None)
+    parser.add_argument('-n', '--number',
+                        type=int,
+                        help="Number of slowest units to report (defaults to: 20).",
+                        default=20)
+    parser.add_argument('--history',
+                        action='store_true',
+                        help="Report the trends across the compilations of the pack instead.",
+                        default=False)
+    args = parser.parse_args()
+
+    pack = Pack(args.packname, preexisting=True, homepack=args.homepack)
+    if args.history:
+        history_report(pack.compile_profile_history(), n=args.number)
+    else:
+        profile = pack.compile_profile(log=args.log)
+        if profile is None:
+            print("No timing available for this compilation.")
+        else:
+            profile.report(n=args.number)
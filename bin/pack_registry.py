@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Query or rebuild the registry of packs of a HOMEPACK.
+"""
+import os
+import argparse
+import sys
+import time
+
+# Automatically set the python path
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(repo_path, 'src'))
+
+from ial_build.registry import PackRegistry
+
+
+def main(action,
+         homepack=None,
+         packname=None,
+         **criteria):
+    registry = PackRegistry(homepack)
+    if action == 'rebuild':
+        found = registry.rebuild()
+        print("Registry rebuilt: {} packs in {}".format(len(found), registry.filepath))
+    elif action == 'show':
+        record = registry.get(packname)
+        if record is None:
+            print("Pack not registered: {}".format(packname))
+        else:
+            for k in sorted(record.keys()):
+                print("{:20}: {}".format(k, record[k]))
+    elif action == 'list':
+        criteria = {k:v for k, v in criteria.items() if v is not None}
+        for record in registry.find(**criteria):
+            built = '-' if record['built'] is None else time.strftime('%Y-%m-%d %H:%M',
+                                                                       time.localtime(record['built']))
+            print("{:50} {:30} {:8} {:16}".format(record['packname'],
+                                                  str(record['source_ref']),
+                                                  str(record['build_status']),
+                                                  built))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query or rebuild the registry of packs of a HOMEPACK.')
+    parser.add_argument('action',
+                        choices=['list', 'show', 'rebuild'],
+                        help="list packs (matching criteria), show a pack record, or rebuild the registry from disk.")
+    parser.add_argument('packname',
+                        nargs='?',
+                        help="Pack name (for 'show').",
+                        default=None)
+    parser.add_argument('-H', '--homepack',
+                        help="Home of packs (defaults to $HOMEPACK).",
+                        default=None)
+    parser.add_argument('--ref',
+                        dest='source_ref',
+                        help="Packs populated from this git ref (or bundle arpifs version).",
+                        default=None)
+    parser.add_argument('--commit',
+                        dest='source_commit',
+                        help="Packs populated from this commit.",
+                        default=None)
+    parser.add_argument('-l', '--label',
+                        help="Packs with this compiler label.",
+                        default=None)
+    parser.add_argument('-o', '--flag',
+                        help="Packs with this compiler flag.",
+                        default=None)
+    parser.add_argument('-s', '--status',
+                        dest='build_status',
+                        choices=['OK', 'failed'],
+                        help="Packs which latest build has this status.",
+                        default=None)
+    args = parser.parse_args()
+    if args.action == 'show' and args.packname is None:
+        parser.error("'show' requires a packname")
+
+    main(args.action,
+         homepack=args.homepack,
+         packname=args.packname,
+         source_ref=args.source_ref,
+         source_commit=args.source_commit,
+         label=args.label,
+         flag=args.flag,
+         build_status=args.build_status)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watch a Git worktree and synchronise its modifications into an incremental pack,
+optionally compiling it after each batch of modifications.
+"""
+import os
+import argparse
+import sys
+
+# Automatically set the python path
+repo_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(repo_path, 'src'))
+
+from ial_build.pygmkpack import Pack
+from ial_build.watch import watch
+from ial_build.config import DEFAULT_IA4H_REPO
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch a Git worktree and synchronise its modifications ' +
+                                                 'into an incremental pack (populated beforehand, e.g. by git2pack.py).')
+    parser.add_argument('packname',
+                        help="Name of the incremental pack.")
+    parser.add_argument('-r', '--repository',
+                        help="Location of the Git worktree (defaults to: {}).".format(DEFAULT_IA4H_REPO),
+                        default=DEFAULT_IA4H_REPO)
+    parser.add_argument('-H', '--homepack',
+                        help="Home of packs (defaults to $HOMEPACK).",
+                        default=None)
+    parser.add_argument('-p', '--programs',
+                        help="Programs to be rebuilt after each batch of modifications, e.g. 'MASTERODB,BATOR'; " +
+                             "'' to compile sources only. No build if not provided.",
+                        default=None)
+    parser.add_argument('-d', '--debounce',
+                        type=float,
+                        help="Modifications are applied once the worktree has been quiet for that delay, " +
+                             "in seconds (defaults to: 2).",
+                        default=2.)
+    parser.add_argument('--polling',
+                        action='store_true',
+                        help="Poll the worktree instead of using inotify.",
+                        default=False)
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help="Build output on stdout rather than in log files.",
+                        default=False)
+    args = parser.parse_args()
+
+    programs = None
+    if args.programs is not None:
+        programs = [p.strip() for p in args.programs.split(',') if p.strip() != '']
+    pack = Pack(args.packname, preexisting=True, homepack=args.homepack)
+    watch(pack, args.repository,
+          programs=programs,
+          debounce=args.debounce,
+          polling=args.polling,
+          silent=not args.verbose)
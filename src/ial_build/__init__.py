@@ -4,8 +4,6 @@
 # This software is governed by the CeCILL-C license under French law.
 # http://www.cecill.info
 
-from __future__ import print_function, absolute_import, unicode_literals, division
-
 """
 IAL (IFS-ARPEGE & LAM:ALADIN-AROME-ALARO-HARMONIE) source code management.
 """
@@ -1,18 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from __future__ import print_function, absolute_import, unicode_literals, division
 """
 Building executables algorithms.
 """
-import six
 import json
 import os
 import copy
 import shutil
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .repositories import IALview
 from .pygmkpack import (Pack, PackError, GmkpackTool,
                         USUAL_BINARIES)
+from .bundle import (bundle_download, bundle_projects, bundle_resolve,
+                     BundleSplitDownloader, LOCKFILE_BASENAME,
+                     bundle_hash, bundle_lock, bundle_lock_checkout,
+                     bundle_lock_info, bundle_lock_read, bundle_lock_write)
+from .config import (BUNDLE_MIRROR_STORE, PACK_REGISTRY, OBJECT_CACHE_DIR, HUB_CACHE_DIR,
+                     ARTIFACT_STORE_DIR)
+from .registry import (PackRegistry, registry_update, genesis_key_fields,
+                       touched_files_hash, build_key)
+from .instrumentation import instrumented, span, set_output
+from .compile_monitor import CompileMonitor
+from .objcache import ObjectCache
+from .hubcache import HubCache
+from .artifacts import ArtifactStore
+from .resources import build_slot
 
 # TODO: handle multiple repositories/projects to pack
 
@@ -67,9 +82,11 @@ def bundle_guess_packname(bundle,
                           compiler_flag=None,
                           abspath=False,
                           homepack=None,
-                          to_bin=False):
+                          to_bin=False,
+                          bundle_cache_dir=None):
     """
     Guess pack name from a number of arguments.
+    The bundle is only read (and resolved against cache), nothing is downloaded.
     
     :param bundle: bundle file (yaml)
     :param compiler_label: gmkpack compiler label
@@ -78,14 +95,14 @@ def bundle_guess_packname(bundle,
     :param abspath: True if the absolute path to pack is requested (instead of basename)
     :param homepack: home of pack
     :param to_bin: True if the path to binaries subdirectory is requested
+    :param bundle_cache_dir: cache directory in which to look for repositories
     """
     if homepack is None:
         homepack = GmkpackTool.get_homepack()
     cache_dir, bundle_info = bundle2cache(bundle,
                                           src_dir=bundle_cache_dir,
-                                          update=update_git_repositories,
-                                          threads=bundle_download_threads,
                                           dryrun=True)
+    git_ref = bundle_info['arpifs']['version']
     if packtype == 'main':
         ref_split = IALview.split_ref(bundle_info['arpifs']['version'])
         args = GmkpackTool.args_for_main_commandline(ref_split['release'],
@@ -107,6 +124,48 @@ def bundle_guess_packname(bundle,
     return os.path.join(*path_elements)
 
 
+def _ask_confirmation():
+    """Ask for confirmation to go on, and exit if not given."""
+    ok = input("Confirm ? [y/n] ")
+    if ok == 'n':
+        print("Confirmation cancelled: exit.")
+        exit()
+    elif ok != 'y':
+        print("Please answer by 'y' or 'n'. Exit.")
+        exit()
+
+
+def _incremental_ancestor_info(view, start_ref=None):
+    """
+    Initial branch {'b', 'v'} of incremental packs populated from **view**,
+    with the increment starting from **start_ref**
+    (if None, from the latest official tagged ancestor).
+    """
+    if start_ref is None:
+        return view.latest_official_branch_from_main_release
+    ref_split = view.split_ref(start_ref)
+    return {'b':ref_split['radical'],
+            'v':ref_split['version']}
+
+
+def _new_incremental_pack(packname, compiler_label, compiler_flag, initial_release, ancestor_info,
+                          homepack=None, rootpack=None, silent=False, remove_ics_=True):
+    """Create a new incremental pack, on top of **initial_release** and **ancestor_info**."""
+    pack = GmkpackTool.new_incremental_pack(packname,
+                                            compiler_label,
+                                            initial_release,
+                                            initial_branch=ancestor_info.get('b', None),
+                                            initial_branch_version=ancestor_info.get('v', None),
+                                            compiler_flag=compiler_flag,
+                                            homepack=homepack,
+                                            rootpack=rootpack,
+                                            silent=silent)
+    if remove_ics_:
+        pack.ics_remove('')  # for it to be re-generated at compile time, with proper options
+    return pack
+
+
+@instrumented
 def IAL_gitref_to_incrpack(repository,
                            git_ref,
                            compiler_label,
@@ -120,7 +179,9 @@ def IAL_gitref_to_incrpack(repository,
                            silent=False,
                            ask_confirmation=False,
                            remove_ics_=True,
-                           fetch=False):
+                           fetch=False,
+                           reuse_equivalent_pack=False,
+                           predict_rebuild=False):
     """
     From git ref to incremental pack.
 
@@ -142,6 +203,19 @@ def IAL_gitref_to_incrpack(repository,
         before actually creating pack and populating
     :param remove_ics_: to remove the ics_ file.
     :param fetch: to fetch branch on remote or not
+    :param reuse_equivalent_pack: if True, look in the pack registry for a pack
+        successfully built from the same commit, touched files and genesis
+        arguments, and if any, return it instead of creating a new one
+        (cf. equivalent_pack_lookup()).
+        If 'clone', the equivalent pack is cloned as **packname** instead;
+        if none, the latest pack successfully built with the same genesis
+        arguments is (cf. clone_base_lookup()), and then populated, for
+        an incremental compilation of what differs only (cf. Pack.clone()).
+        A pack reused (or cloned) as is, already built, has its
+        *reused_from* attribute set, so that pack_build_executables() skips
+        its build.
+    :param predict_rebuild: print the predicted number of compilation units
+        to be rebuilt, from the module dependency graph of the repository
     """
     if packname is None:
         packname = git_ref
@@ -153,50 +227,230 @@ def IAL_gitref_to_incrpack(repository,
     print("-" * 50)
     print("Start export of git ref: '{}' to incremental pack: '{}'".format(git_ref, packname))
     if ask_confirmation:
-        ok = six.moves.input("Confirm ? [y/n] ")
-        if ok == 'n':
-            print("Confirmation cancelled: exit.")
-            exit()
-        elif ok != 'y':
-            print("Please answer by 'y' or 'n'. Exit.")
-            exit()
+        _ask_confirmation()
     os.environ['GMK_RELEASE_CASE_SENSITIVE'] = '1'
-    view = IALview(repository, git_ref, fetch=fetch)
+    with span('IALview'):
+        view = IALview(repository, git_ref, fetch=fetch)
+    key = None
+    pack = None
+    snapshot = None  # sources of a cloned pack, before population
     try:
         if preexisting_pack:
             pack = Pack(packname, preexisting=preexisting_pack, homepack=homepack)
             if clean_if_preexisting:
                 pack.cleanpack()
+            if PACK_REGISTRY:
+                key, touched_hash = view_build_key(view, genesis_key_fields(pack.genesis_arguments),
+                                                   start_ref=start_ref)
         else:
-            if start_ref is None:
-                ancestor_info = view.latest_official_branch_from_main_release
-            else:
-                ref_split = view.split_ref(start_ref)
-                ancestor_info = {'b':ref_split['radical'],
-                                 'v':ref_split['version']}
-            pack = GmkpackTool.new_incremental_pack(packname,
-                                                    compiler_label,
-                                                    view.latest_main_release_ancestor,
-                                                    initial_branch=ancestor_info.get('b', None),
-                                                    initial_branch_version=ancestor_info.get('v', None),
-                                                    compiler_flag=compiler_flag,
-                                                    homepack=homepack,
-                                                    rootpack=rootpack,
-                                                    silent=silent)
-            if remove_ics_:
-                pack.ics_remove('')  # for it to be re-generated at compile time, with proper options
-        pack.populate_from_IALview_as_incremental(view, start_ref=start_ref)
+            ancestor_info = _incremental_ancestor_info(view, start_ref)
+            if PACK_REGISTRY:
+                args = GmkpackTool.args_for_incremental_commandline(packname,
+                                                                    compiler_label,
+                                                                    view.latest_main_release_ancestor,
+                                                                    initial_branch=ancestor_info.get('b', None),
+                                                                    initial_branch_version=ancestor_info.get('v', None),
+                                                                    compiler_flag=compiler_flag,
+                                                                    rootpack=rootpack,
+                                                                    homepack=homepack)
+                genesis = genesis_key_fields(args)
+                key, touched_hash = view_build_key(view, genesis, start_ref=start_ref)
+                if reuse_equivalent_pack:
+                    pack = equivalent_pack_lookup(key,
+                                                  commit=view.git_proxy.latest_commit,
+                                                  genesis=genesis,
+                                                  homepack=homepack)
+                    if pack is not None:
+                        reused_from = pack.abspath
+                        if reuse_equivalent_pack == 'clone':
+                            pack = pack.clone(packname, homepack=homepack)
+                            registry_update(pack, build_key=key, touched_hash=touched_hash)
+                        pack.reused_from = reused_from
+                    elif reuse_equivalent_pack == 'clone':
+                        base = clone_base_lookup(genesis, source_ref=git_ref, homepack=homepack)
+                        if base is not None:
+                            pack = base.clone(packname, homepack=homepack)
+                            snapshot = pack.snapshot_sources()
+            elif reuse_equivalent_pack:
+                print("Build cache: MISS (pack registry is disabled)")
+            if pack is None:
+                pack = _new_incremental_pack(packname, compiler_label, compiler_flag,
+                                             view.latest_main_release_ancestor, ancestor_info,
+                                             homepack=homepack, rootpack=rootpack,
+                                             silent=silent, remove_ics_=remove_ics_)
+        if pack.reused_from is None:
+            populated = pack.populate_from_IALview_as_incremental(view, start_ref=start_ref)
+            if snapshot is not None:
+                restored, removed = pack.restore_unchanged_sources(snapshot, populated)
+                print("Clone: {} source(s) unchanged, {} removed (not in increment)".format(
+                    len(restored), len(removed)))
+            if predict_rebuild:
+                with span('rebuild_impact'):
+                    view.rebuild_impact(start_ref=start_ref)
+            if key is not None:
+                registry_update(pack, build_key=key, touched_hash=touched_hash)
     except Exception:
         print("Failed export of git ref to pack !")
         del view  # to restore the repository state
         raise
     else:
-        print("Sucessful export of git ref: {} to pack: {}".format(git_ref, pack.abspath))
+        print("Successful export of git ref: {} to pack: {}".format(git_ref, pack.abspath))
+        if pack.reused_from is not None:
+            print("(reused as is, already built: {})".format(pack.reused_from))
     finally:
         print("-" * 50)
     return pack
 
 
+def view_build_key(view, genesis, start_ref=None):
+    """
+    Build key of an incremental pack populated from **view** (cf. registry.build_key()).
+
+    :param genesis: genesis fields of the pack (cf. registry.genesis_key_fields())
+    :param start_ref: increment of modification starts from this ref.
+        If None, starts from latest official tagged ancestor.
+
+    Return (build key, touched files hash).
+    """
+    if start_ref is None:
+        touched_files = view.touched_files_since_latest_official_tagged_ancestor
+    else:
+        touched_files = view.touched_files_since(start_ref)
+    touched_hash = touched_files_hash(view, touched_files)
+    return build_key(view.git_proxy.latest_commit, touched_hash, genesis, start_ref=start_ref), touched_hash
+
+
+def clone_base_lookup(genesis, source_ref=None, homepack=None):
+    """
+    Look in the pack registry of **homepack** for the latest incremental pack
+    successfully built with **genesis** fields, to be cloned; preferably
+    populated from **source_ref**.
+
+    Return the Pack, or None.
+    """
+    candidates = []
+    for record in PackRegistry(homepack).find(order_by='built', incremental=1, build_status='OK',
+                                              label=genesis['label'], flag=genesis['flag']):
+        if not os.path.isdir(record['abspath']):
+            continue
+        pack = Pack(record['packname'], preexisting=True, homepack=homepack)
+        if genesis_key_fields(pack.genesis_arguments) == genesis:
+            candidates.append((record['source_ref'] == source_ref, record['built'] or 0, pack))
+    if not candidates:
+        print("Clone: no pack built with the same genesis to be cloned")
+        return None
+    candidates.sort(key=lambda c: c[:2], reverse=True)
+    pack = candidates[0][2]
+    print("Clone: base pack {}".format(pack.abspath))
+    return pack
+
+
+def equivalent_pack_lookup(key, commit=None, genesis=None, homepack=None):
+    """
+    Look in the pack registry of **homepack** for a pack successfully built
+    with build **key**, and report about cache hit or miss (and why).
+
+    :param commit: source commit, to explain a miss
+    :param genesis: genesis fields, to explain a miss
+
+    Return the equivalent Pack, or None.
+    """
+    record, reason = PackRegistry(homepack).lookup_build(key, commit=commit, genesis=genesis)
+    if record is None:
+        print("Build cache: MISS ({})".format(reason))
+        return None
+    print("Build cache: HIT ({})".format(reason))
+    print("Reuse pack: {} (built: {})".format(record['abspath'],
+                                              time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['built']))))
+    return Pack(record['packname'], preexisting=True, homepack=homepack)
+
+
+@instrumented
+def IAL_gitref_to_incrpacks(repository,
+                            git_ref,
+                            compilers,
+                            start_ref=None,
+                            homepack=None,
+                            rootpack=None,
+                            silent=False,
+                            ask_confirmation=False,
+                            remove_ics_=True,
+                            fetch=False,
+                            threads=8):
+    """
+    From git ref to several incremental packs, one per (compiler label, flag).
+    The view is opened once, touched files are computed once and each of them
+    is read once for all packs; packs are created concurrently.
+
+    :param repository: Git repository to be used
+    :param git_ref: Git reference (branch, tag) to be exported
+    :param compilers: list of (compiler_label, compiler_flag) pairs,
+        e.g. [('IMPIFC1801', '2y'), ('IMPIFC1801', '2i')]
+    :param start_ref: increment of modification starts from this ref.
+        If None, starts from latest official tagged ancestor.
+    :param homepack: directory in which to build packs
+    :param rootpack: where to look for root packs
+    :param silent: to hide gmkpack's stdout
+    :param ask_confirmation: ask for confirmation about the packs
+        before actually creating packs and populating
+    :param remove_ics_: to remove the ics_ file.
+    :param fetch: to fetch branch on remote or not
+    :param threads: max number of parallel pack creations/file copies
+
+    Return the list of packs, in the order of **compilers**.
+    """
+    packnames = [guess_packname(git_ref,
+                                compiler_label,
+                                'incr',
+                                compiler_flag=compiler_flag)
+                 for compiler_label, compiler_flag in compilers]
+    print("-" * 50)
+    print("Start export of git ref: '{}' to incremental packs:".format(git_ref))
+    for packname in packnames:
+        print("  '{}'".format(packname))
+    if ask_confirmation:
+        _ask_confirmation()
+    for packname in packnames:  # before creating any
+        Pack(packname, preexisting=False, homepack=homepack)
+    os.environ['GMK_RELEASE_CASE_SENSITIVE'] = '1'
+    with span('IALview'):
+        view = IALview(repository, git_ref, fetch=fetch)
+    created = []  # packs being created by this call, removed if failing meanwhile
+    try:
+        ancestor_info = _incremental_ancestor_info(view, start_ref)
+        initial_release = view.latest_main_release_ancestor
+
+        def new_pack(packname_and_compiler):
+            packname, (compiler_label, compiler_flag) = packname_and_compiler
+            # registered before creation: gmkpack may fail after creating the directory
+            created.append(Pack(packname, preexisting=False, homepack=homepack))
+            return _new_incremental_pack(packname, compiler_label, compiler_flag,
+                                         initial_release, ancestor_info,
+                                         homepack=homepack, rootpack=rootpack,
+                                         silent=silent, remove_ics_=remove_ics_)
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(compilers)))) as executor:
+            futures = [executor.submit(new_pack, pc) for pc in zip(packnames, compilers)]
+        packs = [f.result() for f in futures]  # all done: raise the first failure, if any
+        Pack.populate_several_from_IALview_as_incremental(packs, view,
+                                                          start_ref=start_ref,
+                                                          threads=threads)
+    except Exception:
+        print("Failed export of git ref to packs !")
+        for pack in created:
+            if os.path.exists(pack.abspath):
+                print("Remove partially created pack: {}".format(pack.abspath))
+                pack.rmpack()
+        del view  # to restore the repository state
+        raise
+    else:
+        for pack in packs:
+            print("Successful export of git ref: {} to pack: {}".format(git_ref, pack.abspath))
+    finally:
+        print("-" * 50)
+    return packs
+
+
+@instrumented
 def IAL_gitref_to_main_pack(repository,
                             git_ref,
                             compiler_label,
@@ -208,7 +462,8 @@ def IAL_gitref_to_main_pack(repository,
                             ask_confirmation=False,
                             prefix='__user__',
                             remove_ics_=True,
-                            fetch=False):
+                            fetch=False,
+                            hub_cache='__config__'):
     """
     From git ref to main pack.
 
@@ -227,19 +482,18 @@ def IAL_gitref_to_main_pack(repository,
     :param prefix: '__user__' or None.
     :param remove_ics_: to remove the ics_ file.
     :param fetch: to fetch branch on remote or not
+    :param hub_cache: a hubcache.HubCache of built hub packages, linked into
+        the pack instead of being built again; if '__config__', the one
+        configured by $IAL_BUILD_HUB_CACHE if any; if None, no cache.
     """
+    hub_cache = _hub_cache(hub_cache)
     print("-" * 50)
     print("Start export of git ref: '{}' to main pack".format(git_ref))
     if ask_confirmation:
-        ok = six.moves.input("Confirm ? [y/n] ")
-        if ok == 'n':
-            print("Confirmation cancelled: exit.")
-            exit()
-        elif ok != 'y':
-            print("Please answer by 'y' or 'n'. Exit.")
-            exit()
+        _ask_confirmation()
     os.environ['GMK_RELEASE_CASE_SENSITIVE'] = '1'
-    view = IALview(repository, git_ref, fetch=fetch)
+    with span('IALview'):
+        view = IALview(repository, git_ref, fetch=fetch)
     # prepare arguments
     ref_split = view.split_ref(git_ref)
     if prefix == '__user__':
@@ -256,7 +510,8 @@ def IAL_gitref_to_main_pack(repository,
                                          silent=silent)
         if remove_ics_:
             pack.ics_remove('')  # for it to be re-generated at compile time, with proper options
-        pack.populate_hub(view.latest_main_release_ancestor)  # to build hub packages
+        pack.populate_hub(view.latest_main_release_ancestor,  # to build hub packages
+                          hub_cache=hub_cache)
         pack.populate_from_IALview_as_main(view,
                                            populate_filter_file=populate_filter_file,
                                            link_filter_file=link_filter_file)
@@ -265,12 +520,13 @@ def IAL_gitref_to_main_pack(repository,
         del view  # to restore the repository state
         raise
     else:
-        print("Sucessful export of git ref: {} to pack: {}".format(git_ref, pack.abspath))
+        print("Successful export of git ref: {} to pack: {}".format(git_ref, pack.abspath))
     finally:
         print("-" * 50)
     return pack
 
 
+@instrumented
 def bundle_to_main_pack(bundle,
                         compiler_label,
                         compiler_flag=None,
@@ -280,7 +536,12 @@ def bundle_to_main_pack(bundle,
                         link_filter_file='__inconfig__',
                         silent=False,
                         update_git_repositories=True,
-                        bundle_download_threads=0):
+                        bundle_download_threads=0,
+                        pipeline=False,
+                        populate_threads=4,
+                        mirror_store=BUNDLE_MIRROR_STORE,
+                        lockfile=None,
+                        hub_cache='__config__'):
     """
     From bundle to main pack.
 
@@ -297,12 +558,38 @@ def bundle_to_main_pack(bundle,
     :param update_git_repositories: if False, take git repositories as they are,
         without trying to update (fetch/checkout/pull)
     :param bundle_download_threads: number of parallel threads to download (clone/fetch) repositories
+    :param pipeline: if True, populate each component into the pack as soon
+        as it has been downloaded, instead of waiting for all downloads
+    :param populate_threads: number of components populated in parallel,
+        in pipeline mode
+    :param mirror_store: root directory of a shared store of bare mirrors,
+        through which repositories are cloned/fetched (None to clone/fetch
+        directly from remotes)
+    :param lockfile: a lockfile pinning the components to commits, e.g. the
+        one of a previous pack (cf. bundle2cache()).
+        In any case, the lockfile of the components actually populated is
+        written in the pack.
+    :param hub_cache: a hubcache.HubCache of built hub packages, linked into
+        the pack instead of being populated and built again; if '__config__',
+        the one configured by $IAL_BUILD_HUB_CACHE if any; if None, no cache.
     """
+    hub_cache = _hub_cache(hub_cache)
     os.environ['GMK_RELEASE_CASE_SENSITIVE'] = '1'
-    cache_dir, bundle_info = bundle2cache(bundle,
-                                          src_dir=bundle_cache_dir,
-                                          update=update_git_repositories,
-                                          threads=bundle_download_threads)
+    if bundle_cache_dir is None:
+        bundle_cache_dir = os.getcwd()
+    if pipeline and lockfile is not None:
+        print("(Lockfile is provided: pipeline mode is deactivated.)")
+        pipeline = False
+    if pipeline:
+        cache_dir = bundle_cache_dir
+        bundle_info = bundle_projects(bundle)
+    else:
+        cache_dir, bundle_info = bundle2cache(bundle,
+                                              src_dir=bundle_cache_dir,
+                                              update=update_git_repositories,
+                                              threads=bundle_download_threads,
+                                              mirror_store=mirror_store,
+                                              lockfile=lockfile)
     # prepare arguments
     ref_split = IALview.split_ref(bundle_info['arpifs']['version'])
     try:
@@ -317,23 +604,39 @@ def bundle_to_main_pack(bundle,
                                          homepack=homepack,
                                          silent=silent)
         pack.ics_remove('')  # for it to be re-generated at compile time, with proper options
-        pack.bundle_populate_mainpack(cache_dir,
-                                      bundle_info,
-                                      populate_filter_file=populate_filter_file,
-                                      link_filter_file=link_filter_file)
+        if pipeline:
+            bundle_pipeline_to_pack(bundle, pack,
+                                    src_dir=cache_dir,
+                                    update=update_git_repositories,
+                                    download_threads=bundle_download_threads,
+                                    populate_threads=populate_threads,
+                                    populate_filter_file=populate_filter_file,
+                                    link_filter_file=link_filter_file,
+                                    mirror_store=mirror_store,
+                                    hub_cache=hub_cache)
+        else:
+            pack.bundle_populate_mainpack(cache_dir,
+                                          bundle_info,
+                                          populate_filter_file=populate_filter_file,
+                                          link_filter_file=link_filter_file,
+                                          hub_cache=hub_cache)
         shutil.copy(bundle, os.path.join(pack.abspath, 'bundle.yml'))
+        bundle_lock_write(bundle_lock(bundle, cache_dir, bundle_info),
+                          os.path.join(pack.abspath, LOCKFILE_BASENAME))
     except Exception:
         print("Failed export of bundle to pack !")
         raise
     else:
-        print("\nSucessful export of bundle: {} to pack: {}".format(bundle, pack.abspath))
+        print("\nSuccessful export of bundle: {} to pack: {}".format(bundle, pack.abspath))
     finally:
         print("-" * 50)
     return pack
 
 
+@instrumented
 def bundle2cache(bundle, src_dir=None, update=False, threads=1, no_colour=True,
-                 dryrun=False):
+                 dryrun=False, mirror_store=BUNDLE_MIRROR_STORE,
+                 lockfile=None):
     """
     Set repositories defined in **bundle** into bundle cache **src_dir**.
     
@@ -342,29 +645,151 @@ def bundle2cache(bundle, src_dir=None, update=False, threads=1, no_colour=True,
     :param update: if repositories are to be updated/checkedout
     :param threads: number of threads to do parallel downloads
     :param no_colour: Disable color output
+    :param dryrun: if True, nothing is downloaded: the bundle is only resolved
+        against the repositories already in cache (cf. bundle.bundle_resolve())
+    :param mirror_store: root directory of a shared store of bare mirrors
+    :param lockfile: a lockfile pinning the components to commits:
+        if it matches **bundle** and the pinned commits are found in cache,
+        no download/update happens at all; otherwise the repositories are
+        downloaded then checked out at the pinned commits.
     """
-    from ecbundle import BundleDownloader, BundleCreator
     if src_dir is None:
         src_dir = os.getcwd()
-    b = BundleDownloader(bundle=bundle,
-                         src_dir=src_dir,
-                         update=update,
-                         threads=threads,
-                         no_colour=no_colour,
-                         dryrun=False,
-                         dry_run=False,
-                         shallow=False,
-                         forced_update=False)
-    if b.download() != 0:
-        raise RuntimeError("Downloading repositories failed.")
-    projects = {}
-    for project in b.bundle().get('projects'):
-        for name, conf in project.items():
-            projects[name] = dict(conf)
-    src_dir = b.src_dir()
+    if dryrun:
+        return os.path.abspath(src_dir), bundle_resolve(bundle, src_dir=src_dir)
+    lock = None
+    if lockfile is not None:
+        lock = bundle_lock_read(lockfile)
+        if lock['bundle_hash'] != bundle_hash(bundle):
+            print("! Lockfile {} does not match bundle {}: ignored.".format(lockfile, bundle))
+            lock = None
+        elif bundle_lock_checkout(lock, src_dir):
+            print("Lockfile {} matches cache: no download/update.".format(lockfile))
+            return os.path.abspath(src_dir), bundle_lock_info(lock, bundle)
+    src_dir, projects = bundle_download(bundle,
+                                        src_dir=src_dir,
+                                        update=update,
+                                        threads=threads,
+                                        no_colour=no_colour,
+                                        mirror_store=mirror_store)
+    if lock is not None:
+        if not bundle_lock_checkout(lock, src_dir):
+            raise RuntimeError("Pinned commits of lockfile {} not found in cache {}.".format(lockfile, src_dir))
+        projects = bundle_lock_info(lock, bundle)
     return src_dir, projects
 
 
+@instrumented
+def bundle_pipeline_to_pack(bundle,
+                            pack,
+                            src_dir=None,
+                            update=False,
+                            download_threads=0,
+                            populate_threads=4,
+                            populate_filter_file='__inconfig__',
+                            link_filter_file='__inconfig__',
+                            mirror_store=BUNDLE_MIRROR_STORE,
+                            hub_cache=None):
+    """
+    Download the components of **bundle** into cache and populate them into
+    main **pack**, each component being populated as soon as its own
+    download is finished.
+
+    :param bundle: bundle file (yaml)
+    :param pack: the Pack to be populated
+    :param src_dir: cache directory in which to download/update repositories
+    :param update: if repositories are to be updated/checkedout
+    :param download_threads: number of parallel downloads (0 for the number of CPUs)
+    :param populate_threads: number of components populated in parallel
+    :param mirror_store: root directory of a shared store of bare mirrors
+    :param hub_cache: a hubcache.HubCache: hub projects found built in it are
+        linked into the pack, their packages being neither downloaded nor
+        populated
+
+    Cf. Pack.bundle_populate_mainpack() for other arguments.
+
+    Return the dict of timings (s) per component: {component:{'download':, 'populate':}}.
+    """
+    downloader = BundleSplitDownloader(bundle, src_dir=src_dir, update=update,
+                                       mirror_store=mirror_store)
+    components = downloader.components
+    if download_threads == 0:
+        download_threads = multiprocessing.cpu_count()
+    timings = {c:{'download':0., 'populate':0.} for c in components}
+    bundle_info = {}
+    if hub_cache is not None:  # hub projects found in cache: nothing to download
+        projects = bundle_projects(bundle)
+        cached = pack.bundle_hub_from_cache(projects, hub_cache, cache_dir=downloader.src_dir)
+        for c in list(components):
+            if os.path.basename(pack._bundle_component_destination(c, projects[c]).rstrip('/')) in cached:
+                bundle_info[c] = projects[c]
+                components.remove(c)
+
+    def download(component):
+        t0 = time.time()
+        properties = downloader.download(component)
+        timings[component]['download'] = time.time() - t0
+        print("[{}] downloaded in {:.1f}s".format(component, timings[component]['download']))
+        return properties
+
+    def populate(component, properties):
+        t0 = time.time()
+        pack.bundle_populate_component(downloader.src_dir, component, properties,
+                                       populate_filter_file=populate_filter_file,
+                                       link_filter_file=link_filter_file)
+        timings[component]['populate'] = time.time() - t0
+        print("[{}] populated in {:.1f}s".format(component, timings[component]['populate']))
+
+    t0 = time.time()
+    with pack.staged_population():  # merged in once all components are populated
+        with ThreadPoolExecutor(max_workers=max(1, download_threads)) as downloads, \
+             ThreadPoolExecutor(max_workers=max(1, populate_threads)) as populates:
+            pending = {downloads.submit(download, c):c for c in components}
+            populating = []
+            for future in as_completed(pending):
+                component = pending[future]
+                bundle_info[component] = future.result()
+                populating.append(populates.submit(populate, component, bundle_info[component]))
+            for future in populating:
+                future.result()
+        pack._bundle_write_properties(bundle_info)
+    # report
+    print("-" * 50)
+    print("{:20} {:>12} {:>12}".format('Component', 'Download (s)', 'Populate (s)'))
+    for c in sorted(timings.keys()):
+        print("{:20} {:>12.1f} {:>12.1f}".format(c, timings[c]['download'], timings[c]['populate']))
+    print("Total elapsed: {:.1f}s".format(time.time() - t0))
+    print("-" * 50)
+    return timings
+
+
+def _hub_cache(hub_cache):
+    if hub_cache == '__config__':
+        return HubCache() if HUB_CACHE_DIR is not None else None
+    return hub_cache
+
+
+def _executables_options(pack, other_options):
+    """Options of the ics_ scripts of executables."""
+    if not pack.is_incremental:
+        # pack main: assume compilation and libs ok from ics_ and skip updates
+        other_options = copy.copy(other_options)
+        other_options['no_compilation'] = True
+        other_options['no_libs_update'] = True
+    return other_options
+
+
+def _print_build_errors(compile_output, maximum=5):
+    errors = compile_output.get('Errors', [])
+    if compile_output.get('Aborted'):
+        print("-> aborted after {} error(s)".format(len(errors)))
+    for e in errors[:maximum]:
+        print("-> {}".format(CompileMonitor.format_error(e)))
+    if len(errors) > maximum:
+        print("-> ... ({} more)".format(len(errors) - maximum))
+
+
+@instrumented
 def pack_build_executables(pack,
                            programs=USUAL_BINARIES,
                            silent=False,
@@ -373,81 +798,114 @@ def pack_build_executables(pack,
                            other_options={},
                            homepack=None,
                            fatal_build_failure='__any__',
-                           dump_build_report=False):
-    """Build pack executables."""
+                           dump_build_report=False,
+                           abort_on_fatal=False,
+                           max_errors=None,
+                           object_cache='__config__',
+                           artifact_store='__config__',
+                           fetch_if_available=False,
+                           publish=False):
+    """
+    Build pack executables.
+
+    If **cleanpack** is '__selective__', only the objects and module files
+    made stale by the sources touched since the latest successful compilation
+    are removed, according to the module dependency graph of the pack
+    (cf. Pack.selective_clean()); else if True, all of them (cleanpack).
+
+    If **dump_build_report**, the build report is dumped in 'build_report.json'
+    and the instrumentation spans of the run in 'build_spans.jsonl'.
+
+    If **abort_on_fatal**, each build is aborted at its first fatal error
+    (aborted compilation, failed link); if **max_errors** is not None, after
+    that many errors. Errors parsed from the output are in the build report.
+
+    The number of compilation threads (GMK_THREADS) is planned from the
+    resources of the machine and the builds running from the same HOMEPACK,
+    unless given in **other_options** or $IAL_BUILD_GMK_THREADS; the build
+    waits for a build slot if too many are already running
+    (cf. resources.build_slot()).
+
+    **object_cache**: an objcache.ObjectCache shared across packs, from which
+    objects and modules are seeded before the compilation of sources, and in
+    which newly compiled ones are harvested; if '__config__', the one configured by
+    $IAL_BUILD_OBJECT_CACHE if any; if None, no cache.
+
+    **artifact_store**: an artifacts.ArtifactStore shared across packs and
+    users; if '__config__', the one configured by $IAL_BUILD_ARTIFACT_STORE
+    if any. If **fetch_if_available**, executables published in it with the
+    same provenance (genesis, sources, ics_ script) are fetched instead of
+    built; if all are, nothing is compiled. If **publish**, successfully
+    built executables are published in it.
+
+    If the pack has been reused as is, already built (cf. *reused_from*
+    attribute, set by IAL_gitref_to_incrpack()), and all **programs** are
+    in it, nothing is compiled either.
+
+    The build status of the pack in the pack registry is that of the whole
+    build: 'OK' if all compilations and executables are.
+    """
     os.environ['GMK_RELEASE_CASE_SENSITIVE'] = '1'
     # preprocess args
-    if isinstance(pack, six.string_types):
+    if isinstance(pack, str):
         pack = Pack(pack, preexisting=True, homepack=homepack)
     elif not isinstance(pack, Pack):
         raise PackError("**pack** argument must be a pack name or a Pack instance")
-    if isinstance(programs, six.string_types):
+    if isinstance(programs, str):
         if programs == '__usual__':
             programs = USUAL_BINARIES
         else:
             programs = [p.strip() for p in programs.split(',')]
     elif not isinstance(programs, list):
         raise TypeError("**programs** must be a string (e.g. 'MASTERODB,BATOR') or a list")
+    if object_cache == '__config__':
+        object_cache = ObjectCache() if OBJECT_CACHE_DIR is not None else None
+    if artifact_store == '__config__':
+        artifact_store = ArtifactStore() if ARTIFACT_STORE_DIR is not None else None
     build_report = {}
-    # start by compiling sources without any executable
-    print("-" * 50)
-    print("Start compilation...")
-    try:
-        if not pack.ics_available_for('') or regenerate_ics:
-            print("(Re-)generate ics_ script ...")
-            pack.ics_build_for('', **other_options)
-    except Exception as e:
-        message = "... ics_ generation failed: {}".format(str(e))
-        print(message)
-        build_report['compilation'] = {'OK':False, 'Output':message}
-    else:
-        print("Run ics_ ...")
-        compile_output = pack.compile('',
-                                      silent=silent,
-                                      clean_before=cleanpack,
-                                      fatal=False)
-        if compile_output['OK']:
-            print("... compilation OK !")
-        else:  # build failed but not fatal
-            print("... compilation failed !")
-            if not silent:
-                print("-> compilation output: {}".format(compile_output['Output']))
+    if pack.reused_from is not None:
+        inventory = pack.executables_inventory()
+        if all([any([n in inventory for n in (p, p.lower(), p.upper())]) for p in programs]):
+            print("Pack reused as is, already built ({}): build skipped.".format(pack.reused_from))
+            build_report = {p:{'OK':True, 'Output':None, 'reused':pack.reused_from} for p in programs}
+            _dump_build_report(build_report, dump_build_report)
+            return pack, build_report
+    generated = set()  # ics_ scripts generated before the build
+    if fetch_if_available and artifact_store is not None:
         print("-" * 50)
-        build_report['compilation'] = compile_output
-    # Executables
-    if not pack.is_incremental:
-        # pack main: assume compilation and libs ok from ics_ and skip updates 
-        other_options = copy.copy(other_options)
-        other_options['no_compilation'] = True
-        other_options['no_libs_update'] = True
-    for program in programs:
+        with span('artifacts_fetch'):
+            for program in programs:
+                if not pack.ics_available_for(program) or regenerate_ics:
+                    # threads are not part of the provenance, and set once planned
+                    options = dict(_executables_options(pack, other_options),
+                                   GMK_THREADS=other_options.get('GMK_THREADS', 1))
+                    pack.ics_build_for(program, **options)
+                    generated.add(program)
+                entry = artifact_store.fetch(pack, program)
+                if entry is not None:
+                    build_report[program] = {'OK':True, 'Output':None, 'fetched':entry['key']}
         print("-" * 50)
-        print("Build: {} ...".format(program))
-        try:
-            if not pack.ics_available_for(program) or regenerate_ics:
-                print("(Re-)generate ics_{} script ...".format(program.lower()))
-                pack.ics_build_for(program, **other_options)
-        except Exception as e:
-            message = "... ics_{} generation failed: {}".format(program, str(e))
-            print(message)
-            if fatal_build_failure == '__any__':
-                raise
-            else:
-                build_report[program] = {'OK':False, 'Output':message}
-        else:  # ics_ generation OK
-            print("Run ics_{} ...".format(program))
-            compile_output = pack.compile(program,
-                                          silent=silent,
-                                          clean_before=False,
-                                          fatal=fatal_build_failure=='__any__')
-            if compile_output['OK']:
-                print("... {} OK !".format(program))
-            else:  # build failed but not fatal
-                print("... {} failed !".format(program))
-                if not silent:
-                    print("-> build output: {}".format(compile_output['Output']))
-            print("-" * 50)
-            build_report[program] = compile_output
+        if len(programs) > 0 and len(build_report) == len(programs):
+            print("All executables fetched from the artifact store: compilation skipped.")
+            pack._registry_update_build('OK')
+            _dump_build_report(build_report, dump_build_report)
+            return pack, build_report
+    try:
+        _build_executables(pack, programs, build_report, generated,
+                           silent=silent,
+                           regenerate_ics=regenerate_ics,
+                           cleanpack=cleanpack,
+                           other_options=other_options,
+                           fatal_build_failure=fatal_build_failure,
+                           abort_on_fatal=abort_on_fatal,
+                           max_errors=max_errors,
+                           object_cache=object_cache,
+                           artifact_store=artifact_store,
+                           publish=publish)
+    except Exception:
+        pack._registry_update_build('failed')
+        raise
+    pack._registry_update_build('OK' if all([r['OK'] for r in build_report.values()]) else 'failed')
     if fatal_build_failure == '__finally__':
         which = [k for k, v in build_report.items() if not v['OK']]
         OK = [k for k, v in build_report.items() if v['OK']]
@@ -460,8 +918,111 @@ def pack_build_executables(pack,
             if len(OK) > 0:
                 message += "(OK for: {})".format(OK)
             raise PackError(message)
+    _dump_build_report(build_report, dump_build_report)
+    return pack, build_report
+
+
+def _dump_build_report(build_report, dump_build_report):
+    """Dump **build_report** and the instrumentation spans of the run, if requested."""
     if dump_build_report:
         with open('build_report.json', 'w') as out:
             json.dump(build_report, out)
-    return pack, build_report
+        set_output('build_spans.jsonl')
+
+
+def _build_executables(pack, programs, build_report, generated,
+                       silent=False,
+                       regenerate_ics=True,
+                       cleanpack=True,
+                       other_options={},
+                       fatal_build_failure='__any__',
+                       abort_on_fatal=False,
+                       max_errors=None,
+                       object_cache=None,
+                       artifact_store=None,
+                       publish=False):
+    """Compilation and executables of pack_build_executables(), filling **build_report**."""
+    with build_slot(pack.homepack, gmk_threads=other_options.get('GMK_THREADS')) as plan:
+        # number of compilation threads, as planned from available resources
+        print(plan.report())
+        other_options = dict(other_options, GMK_THREADS=plan.gmk_threads)
+        for program in [''] + programs:
+            if (not regenerate_ics or program in generated) and pack.ics_available_for(program):
+                pack.ics_set_threads(program, plan.gmk_threads)
+        # start by compiling sources without any executable
+        print("-" * 50)
+        print("Start compilation...")
+        try:
+            if not pack.ics_available_for('') or regenerate_ics:
+                print("(Re-)generate ics_ script ...")
+                with span('ics_build_for', program=''):
+                    pack.ics_build_for('', **other_options)
+        except Exception as e:
+            message = "... ics_ generation failed: {}".format(str(e))
+            print(message)
+            build_report['compilation'] = {'OK':False, 'Output':message}
+        else:
+            print("Run ics_ ...")
+            with span('compile', program=''):
+                compile_output = pack.compile('',
+                                              silent=silent,
+                                              clean_before=cleanpack,
+                                              fatal=False,
+                                              abort_on_fatal=abort_on_fatal,
+                                              max_errors=max_errors,
+                                              object_cache=object_cache,
+                                              register_build=False)
+            if compile_output['OK']:
+                print("... compilation OK !")
+            else:  # build failed but not fatal
+                print("... compilation failed !")
+                _print_build_errors(compile_output)
+                if not silent:
+                    print("-> compilation output: {}".format(compile_output['Output']))
+            print("-" * 50)
+            compile_output['resources'] = plan.as_dict()
+            build_report['compilation'] = compile_output
+        # Executables
+        other_options = _executables_options(pack, other_options)
+        for program in programs:
+            if program in build_report:  # fetched
+                continue
+            print("-" * 50)
+            print("Build: {} ...".format(program))
+            try:
+                if not pack.ics_available_for(program) or (regenerate_ics and program not in generated):
+                    print("(Re-)generate ics_{} script ...".format(program.lower()))
+                    with span('ics_build_for', program=program):
+                        pack.ics_build_for(program, **other_options)
+            except Exception as e:
+                message = "... ics_{} generation failed: {}".format(program, str(e))
+                print(message)
+                if fatal_build_failure == '__any__':
+                    raise
+                else:
+                    build_report[program] = {'OK':False, 'Output':message}
+            else:  # ics_ generation OK
+                print("Run ics_{} ...".format(program))
+                with span('compile', program=program):
+                    compile_output = pack.compile(program,
+                                                  silent=silent,
+                                                  clean_before=False,
+                                                  fatal=fatal_build_failure=='__any__',
+                                                  abort_on_fatal=abort_on_fatal,
+                                                  max_errors=max_errors,
+                                                  register_build=False)
+                if compile_output['OK']:
+                    print("... {} OK !".format(program))
+                    if publish and artifact_store is not None:
+                        try:
+                            compile_output['artifact'] = artifact_store.publish(pack, program)
+                        except (OSError, PackError) as e:
+                            print("! Warning: unable to publish {}: {}".format(program, e))
+                else:  # build failed but not fatal
+                    print("... {} failed !".format(program))
+                    _print_build_errors(compile_output)
+                    if not silent:
+                        print("-> build output: {}".format(compile_output['Output']))
+                print("-" * 50)
+                build_report[program] = compile_output
 
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Store of built executables, shared across packs and users.
+
+Executables are published under the key of their provenance:
+
+- the genesis of the pack (release, reference branch/version, compiler
+  label and flag, root pack);
+- its sources: the resolved commits of a main pack (as in the pack
+  registry), or the sources of src/local for an incremental pack (build
+  products are not accounted for);
+- the files ignored at compilation time, and the stubs of symbols ignored
+  at link time (src/unsxref/verbose);
+- the build manifest: the ics_ script of the program, normalised (pack
+  location and number of threads are not accounted for).
+
+Contents are content-addressed (by sha256), so that identical executables
+published under different keys are stored once.
+
+Layout of the store::
+
+    blobs/<sha256[:2]>/<sha256>      executables
+    entries/<key[:2]>/<key>.json     {program, executables: {name: sha256}, provenance...}
+"""
+import os
+import io
+import re
+import json
+import time
+import uuid
+import shutil
+import getpass
+import hashlib
+
+from .config import ARTIFACT_STORE_DIR
+from .util import file_sha256
+from .pygmkpack import Pack, PackError
+from .registry import PackRegistry, genesis_key_fields, registry_update
+
+#: No automatic export
+__all__ = []
+
+_re_manifest_ignored = re.compile(r'^\s*(export\s+GMK_THREADS=|#SBATCH|#PBS|#MSUB)')
+
+
+def tree_hash(directories, skipped_ext=()):
+    """
+    Hash of the contents of files (and symlinks) in **directories** {name: path}.
+    Hidden files and directories, and files with an extension in **skipped_ext**, are not accounted for.
+    """
+    h = hashlib.sha256()
+    for name, directory in sorted(directories.items()):
+        if not os.path.isdir(directory):
+            continue
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = sorted([d for d in dirnames if not d.startswith('.')])
+            for f in sorted(filenames):
+                if f.startswith('.') or os.path.splitext(f)[1] in skipped_ext:
+                    continue
+                path = os.path.join(dirpath, f)
+                rel = os.path.join(name, os.path.relpath(path, directory))
+                if os.path.islink(path):
+                    h.update('{} -> {}\n'.format(rel, os.readlink(path)).encode('utf-8'))
+                else:
+                    h.update('{} {}\n'.format(rel, file_sha256(path)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def build_manifest(pack, program):
+    """Normalised ics_ script of **program** in **pack**."""
+    with io.open(pack.ics_path_for(program), 'r') as f:
+        lines = f.readlines()
+    manifest = []
+    for line in lines:
+        if _re_manifest_ignored.match(line):
+            continue
+        line = line.replace(pack.abspath, '$PACK').replace(pack.homepack, '$HOMEPACK')
+        manifest.append(line.replace(pack.packname, '$PACKNAME'))
+    return ''.join(manifest)
+
+
+def provenance(pack, program):
+    """
+    Provenance of the executable(s) of **program** in **pack**, as a dict.
+    Raise PackError if the sources of a main pack are not known by their commits.
+    """
+    genesis = genesis_key_fields(pack.genesis_arguments)
+    if pack.is_incremental:
+        sources = {'tree':tree_hash({'src/local':pack._local,
+                                     'hub/local/src':pack._hub_local_src},
+                                    skipped_ext=Pack._build_products_ext)}
+    else:
+        record = PackRegistry(pack.homepack).get(pack.packname) or {}
+        sources = {'commit':record.get('source_commit'),
+                   'bundle':record.get('bundle')}
+        if not any(sources.values()):
+            raise PackError("Commits of the sources of pack {} unknown (not in the pack registry)".format(
+                pack.packname))
+    ignored = pack._ignore_at_compiletime_filepath
+    sources['ignored_at_compiletime'] = file_sha256(ignored) if os.path.exists(ignored) else None
+    sources['ignored_at_linktime'] = tree_hash({'src/unsxref/verbose':pack._ignore_at_linktime_dirpath},
+                                               skipped_ext=Pack._build_products_ext)
+    manifest = build_manifest(pack, program)
+    return {'program':program.lower(),
+            'genesis':genesis,
+            'sources':sources,
+            'manifest':hashlib.sha256(manifest.encode('utf-8')).hexdigest()}
+
+
+def provenance_key(provenance):
+    return hashlib.sha256(json.dumps(provenance, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ArtifactStore(object):
+    """Content-addressed store of executables, keyed by provenance."""
+
+    def __init__(self, store_dir=None):
+        """
+        :param store_dir: directory of the store (default: config ARTIFACT_STORE_DIR)
+        """
+        if store_dir is None:
+            store_dir = ARTIFACT_STORE_DIR
+        if store_dir is None:
+            raise ValueError("No directory for the artifact store (cf. $IAL_BUILD_ARTIFACT_STORE)")
+        self.store_dir = os.path.abspath(store_dir)
+
+    def _blob(self, sha256):
+        return os.path.join(self.store_dir, 'blobs', sha256[:2], sha256)
+
+    def _entry(self, key):
+        return os.path.join(self.store_dir, 'entries', key[:2], key + '.json')
+
+    def _atomic_write(self, path, write):
+        """Write **path** through a temporary file, with **write**(temporary path)."""
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:  # concurrently created
+                pass
+        tmp = '{}.tmp.{}'.format(path, uuid.uuid4().hex)
+        try:
+            write(tmp)
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def lookup(self, key):
+        """Entry of **key**, or None."""
+        try:
+            with io.open(self._entry(key), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return None
+
+    def put(self, key, program, executables, provenance, origin=None):
+        """
+        Publish **executables** {name: path} of **program** under **key**.
+        Return the stats {'blobs_new', 'blobs_existing', 'bytes_new'}.
+        """
+        stats = {'blobs_new':0, 'blobs_existing':0, 'bytes_new':0}
+        names = {}
+        for name, path in sorted(executables.items()):
+            sha256 = file_sha256(path)
+            blob = self._blob(sha256)
+            if os.path.exists(blob):  # deduplicated
+                stats['blobs_existing'] += 1
+            else:
+                def write(tmp):
+                    shutil.copyfile(path, tmp)
+                    os.chmod(tmp, 0o755)
+                self._atomic_write(blob, write)
+                stats['blobs_new'] += 1
+                stats['bytes_new'] += os.path.getsize(blob)
+            names[name] = sha256
+        entry = {'key':key,
+                 'program':program,
+                 'executables':names,
+                 'provenance':provenance,
+                 'origin':origin,
+                 'publisher':getpass.getuser(),
+                 'published':time.time()}
+
+        def write(tmp):
+            with io.open(tmp, 'w') as f:
+                f.write(json.dumps(entry, indent=2, sort_keys=True))
+            os.chmod(tmp, 0o644)
+        self._atomic_write(self._entry(key), write)
+        return stats
+
+    def get(self, key, directory):
+        """
+        Install the executables of **key** into **directory**.
+        Return the entry, or None if not in store.
+        """
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        for name, sha256 in entry['executables'].items():
+            if not os.path.exists(self._blob(sha256)):  # incomplete entry (blob removed)
+                return None
+        for name, sha256 in sorted(entry['executables'].items()):
+            target = os.path.join(directory, name)
+
+            def write(tmp):
+                shutil.copyfile(self._blob(sha256), tmp)
+                os.chmod(tmp, 0o755)
+                if file_sha256(tmp) != sha256:
+                    raise PackError("Corrupted blob in artifact store: {}".format(self._blob(sha256)))
+            self._atomic_write(target, write)
+        return entry
+
+    # Packs --------------------------------------------------------------------
+
+    def publish(self, pack, program):
+        """
+        Publish the executable(s) of **program** built in **pack**.
+        Return the key, or None if the program has not been built.
+        """
+        inventory = pack.executables_inventory()
+        names = [n for n in (program, program.lower(), program.upper()) if n in inventory]
+        if not names:
+            return None
+        prov = provenance(pack, program)
+        key = provenance_key(prov)
+        stats = self.put(key, program,
+                         {n:os.path.join(pack._bin, n) for n in sorted(set(names))},
+                         prov, origin=pack.abspath)
+        print("Artifact store: {} published ({}, {} new blob(s), {} deduplicated)".format(
+            program, key[:16], stats['blobs_new'], stats['blobs_existing']))
+        return key
+
+    def fetch(self, pack, program):
+        """
+        Fetch the executable(s) of **program** into **pack**, if published
+        with the same provenance. Return the entry, or None.
+        """
+        try:
+            key = provenance_key(provenance(pack, program))
+        except PackError as e:
+            print("Artifact store: MISS for {} ({})".format(program, e))
+            return None
+        if not os.path.exists(pack._bin):
+            os.makedirs(pack._bin)
+        before = pack._bin_snapshot()
+        entry = self.get(key, pack._bin)
+        if entry is None:
+            print("Artifact store: MISS for {} ({})".format(program, key[:16]))
+            return None
+        inventory = pack.refresh_executables_inventory(before=before, run_id='fetched.' + key[:16],
+                                                       program=program)
+        registry_update(pack, binaries=sorted(inventory.keys()), executables=inventory)
+        print("Artifact store: HIT for {} ({}): published by {} from {}, {}".format(
+            program, key[:16], entry['publisher'], entry['origin'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['published']))))
+        return entry
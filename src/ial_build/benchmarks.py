@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of IAL-build, on synthetic IAL-like repositories and fake packs.
+
+A synthetic repository has official tags from CY38 on (following
+IALview._re_official_tags), an official branch tag, development branches
+with modified, added, deleted and renamed files. Packs are faked (.genesis,
+src/local, ics_*), and gmkpack/scanpack/cleanpack are replaced by stubs.
+
+Results are stored as JSON, and may be compared to reference results to
+catch regressions.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import tempfile
+import platform
+import subprocess
+from contextlib import contextmanager
+
+from . import __version__
+from .repositories import GitProxy, IALview
+from .pygmkpack import Pack
+
+#: No automatic export
+__all__ = []
+
+#: Parameters of the synthetic repositories, by scale
+SCALES = {'small':{'nfiles':500,
+                   'nreleases':3,
+                   'nbranches':2,
+                   'ncommits':5,
+                   'nmodified':20,
+                   'nrenamed':5},
+          'medium':{'nfiles':5000,
+                    'nreleases':5,
+                    'nbranches':2,
+                    'ncommits':10,
+                    'nmodified':100,
+                    'nrenamed':20},
+          'large':{'nfiles':30000,
+                   'nreleases':8,
+                   'nbranches':2,
+                   'ncommits':20,
+                   'nmodified':500,
+                   'nrenamed':100},
+          }
+
+#: Projects of the synthetic repositories
+PROJECTS = ['aeolus', 'algor', 'arpifs', 'biper', 'etrans', 'ifsaux', 'mpa',
+            'odb', 'satrad', 'surfex', 'trans', 'utilities', 'xrd']
+
+#: Official branch radical (tag CYxx_<radical>.01) in the synthetic repositories
+OFFICIAL_BRANCH = 'bench'
+
+#: Stub of gmkpack: creates the pack layout and .genesis, and an ics_ script
+_GMKPACK_STUB = """#!{python}
+import sys, os
+args = sys.argv[1:]
+arguments = {{}}
+options = []
+i = 0
+while i < len(args):
+    if i + 1 < len(args) and not args[i + 1].startswith('-'):
+        arguments[args[i]] = args[i + 1]
+        i += 2
+    else:
+        options.append(args[i])
+        i += 1
+homepack = arguments.get('-h', os.environ.get('HOMEPACK'))
+if '-u' in arguments:
+    packname = arguments['-u']
+else:
+    packname = '{{}}{{}}_{{}}.{{}}.{{}}.{{}}'.format(arguments.get('-g', ''), arguments['-r'], arguments['-b'],
+                                        arguments['-n'], arguments['-l'], arguments['-o'])
+pack = os.path.join(homepack, packname)
+program = arguments.pop('-p', '')
+if not os.path.exists(pack):
+    for d in ('src/local', 'src/unsxref/verbose', 'bin', 'hub/local/src', 'lib'):
+        os.makedirs(os.path.join(pack, d))
+    with open(os.path.join(pack, '.genesis'), 'w') as g:
+        g.write(' '.join(['gmkpack'] + [' '.join(kv) for kv in arguments.items()] + options) + '\\n')
+with open(os.path.join(pack, 'ics_' + program), 'w') as f:
+    f.write('\\n'.join(['#!/bin/bash',
+                       '#SBATCH -p normal',
+                       'export GMK_THREADS=1',
+                       'Ofrt=2',
+                       'export ICS_ICFMODE=full',
+                       'export ICS_UPDLIBS=full',
+                       'cat <<end_of_ignored_files> $GMKWRKDIR/.ignored_files',
+                       'end_of_ignored_files',
+                       'touch {{}}/bin/{{}}'.format(pack, program.upper() or 'LIBS'),
+                       '']))
+os.chmod(os.path.join(pack, 'ics_' + program), 0o755)
+"""
+
+#: Stub of scanpack: lists files in cwd (src/local)
+_SCANPACK_STUB = """#!/bin/sh
+find . -type f | sed 's|^\\./||'
+"""
+
+#: Stub of cleanpack: removes .o & .mod
+_CLEANPACK_STUB = """#!/bin/sh
+find src/local \\( -name '*.o' -o -name '*.mod' \\) -delete
+"""
+
+
+# Synthetic material -----------------------------------------------------------
+
+def official_releases(n):
+    """The **n** first official releases under Git: CY38, CY38T1, CY39..."""
+    releases = []
+    cycle = 38
+    while len(releases) < n:
+        releases.append('CY{}'.format(cycle))
+        if len(releases) < n:
+            releases.append('CY{}T1'.format(cycle))
+        cycle += 1
+    return releases
+
+
+def _git(cmd, repository):
+    subprocess.check_call(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost'] + cmd,
+                          cwd=repository, stdout=subprocess.DEVNULL)
+
+
+def _fortran_source(name, rng, nlines=60):
+    lines = ["SUBROUTINE {}(KLON, PT)".format(name.upper()),
+             "USE PARKIND1, ONLY : JPIM, JPRB",
+             "IMPLICIT NONE",
+             "INTEGER(KIND=JPIM), INTENT(IN) :: KLON",
+             "REAL(KIND=JPRB), INTENT(INOUT) :: PT(KLON)",
+             "INTEGER(KIND=JPIM) :: JL"]
+    for _ in range(nlines):
+        lines.append("PT(:) = PT(:) * {:.6f} + {:.6f}".format(rng.random(), rng.random()))
+    lines.append("END SUBROUTINE {}".format(name.upper()))
+    return '\n'.join(lines) + '\n'
+
+
+def _write(repository, filename, content):
+    path = os.path.join(repository, filename)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with io.open(path, 'w') as f:
+        f.write(content)
+
+
+def make_synthetic_repository(repository,
+                              nfiles=500,
+                              nreleases=3,
+                              nbranches=2,
+                              ncommits=5,
+                              nmodified=20,
+                              nrenamed=5,
+                              seed=0):
+    """
+    Generate an IAL-like git repository.
+
+    :param nfiles: number of source files, spread among projects
+    :param nreleases: number of official releases (tags), from CY38 on,
+        each with **nmodified** files modified
+    :param nbranches: number of development branches, from the latest
+        release, named bench_<release>_dev<i>
+    :param ncommits: number of commits on each branch; each one modifies
+        **nmodified** files, adds and deletes one file; the first one also
+        renames **nrenamed** files
+    :param nrenamed: number of renamed files on each branch
+    :param seed: seed of the pseudo-random generator (for reproducibility)
+
+    Return a description of the repository (releases, official tag, branches).
+    """
+    rng = random.Random(seed)
+    os.makedirs(repository)
+    _git(['init', '-q', '-b', 'main'], repository)
+    files = []
+    for i in range(nfiles):
+        project = PROJECTS[i % len(PROJECTS)]
+        name = '{}_{:06d}'.format(project, i)
+        files.append(os.path.join(project, 'sub{:02d}'.format(i % 17), name + '.F90'))
+        _write(repository, files[-1], _fortran_source(name, rng))
+    releases = official_releases(nreleases)
+    for n, release in enumerate(releases):
+        if n > 0:
+            for f in rng.sample(files, min(nmodified, len(files))):
+                _write(repository, f, _fortran_source(os.path.basename(f)[:-4], rng))
+        _git(['add', '-A'], repository)
+        _git(['commit', '-q', '-m', release], repository)
+        _git(['tag', release], repository)
+    latest = releases[-1]
+    # official branch on latest release
+    official_tag = '{}_{}.01'.format(latest, OFFICIAL_BRANCH)
+    _git(['checkout', '-q', '-b', '{}_{}'.format(latest, OFFICIAL_BRANCH)], repository)
+    for f in rng.sample(files, min(nmodified, len(files))):
+        _write(repository, f, _fortran_source(os.path.basename(f)[:-4], rng))
+    _git(['commit', '-q', '-a', '-m', official_tag], repository)
+    _git(['tag', official_tag], repository)
+    # development branches
+    branches = []
+    for b in range(nbranches):
+        branch = 'bench_{}_dev{}'.format(latest, b)
+        _git(['checkout', '-q', '-b', branch, latest], repository)
+        living = list(files)
+        for c in range(ncommits):
+            if c == 0:
+                for f in rng.sample(living, min(nrenamed, len(living))):
+                    renamed = f[:-4] + '_renamed.F90'
+                    _git(['mv', f, renamed], repository)
+                    living[living.index(f)] = renamed
+            for f in rng.sample(living, min(nmodified, len(living))):
+                _write(repository, f, _fortran_source(os.path.basename(f)[:-4], rng))
+            added = os.path.join('arpifs', 'new', 'new_{}_{}.F90'.format(b, c))
+            _write(repository, added, _fortran_source('new_{}_{}'.format(b, c), rng))
+            living.append(added)
+            deleted = living.pop(rng.randrange(len(living)))
+            os.remove(os.path.join(repository, deleted))
+            _git(['add', '-A'], repository)
+            _git(['commit', '-q', '-m', '{} {}'.format(branch, c)], repository)
+        branches.append(branch)
+    _git(['checkout', '-q', 'main'], repository)
+    return {'repository':repository,
+            'releases':releases,
+            'official_tag':official_tag,
+            'branches':branches}
+
+
+def make_gmkpack_stubs(bindir):
+    """Write stubs of gmkpack, scanpack and cleanpack in **bindir**."""
+    if not os.path.exists(bindir):
+        os.makedirs(bindir)
+    for name, stub in (('gmkpack', _GMKPACK_STUB.format(python=sys.executable)),
+                       ('scanpack', _SCANPACK_STUB),
+                       ('cleanpack', _CLEANPACK_STUB)):
+        path = os.path.join(bindir, name)
+        with io.open(path, 'w') as f:
+            f.write(stub)
+        os.chmod(path, 0o755)
+    return bindir
+
+
+def make_fake_pack(homepack, packname, release,
+                   branch='main',
+                   version=None,
+                   compiler_label='BENCH',
+                   compiler_flag='x',
+                   main=False):
+    """
+    Make the layout of a gmkpack pack (.genesis, src/local...), without gmkpack.
+
+    :param release: e.g. 'CY47T1'
+    :param branch: official branch the pack starts from
+    :param version: version on the official branch the pack starts from
+    :param main: main pack (vs. incremental)
+    """
+    abspath = os.path.join(homepack, packname)
+    for d in ('src/local', 'src/unsxref/verbose', 'bin', 'hub/local/src', 'lib'):
+        os.makedirs(os.path.join(abspath, d))
+    genesis = ['gmkpack',
+               '-r', release.replace('CY', '').lower(),
+               '-b', branch,
+               '-l', compiler_label,
+               '-o', compiler_flag,
+               '-h', homepack]
+    if version is not None:
+        genesis.extend(['-v', version])
+    if main:
+        genesis.extend(['-n', '01', '-a'])
+    else:
+        genesis.extend(['-u', packname])
+    with io.open(os.path.join(abspath, '.genesis'), 'w') as g:
+        g.write(' '.join(genesis) + '\n')
+    return Pack(packname, homepack=homepack)
+
+
+# Timing -----------------------------------------------------------------------
+
+@contextmanager
+def _quiet():
+    """Context: mute stdout."""
+    stdout = sys.stdout
+    with io.open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+@contextmanager
+def _path_prepended(bindir):
+    """Context: **bindir** first in $PATH."""
+    path = os.environ.get('PATH', '')
+    os.environ['PATH'] = os.pathsep.join([bindir, path])
+    try:
+        yield
+    finally:
+        os.environ['PATH'] = path
+
+
+def time_it(func, setup=None, repeat=3):
+    """
+    Time **func**, **repeat** times.
+
+    :param setup: if not None, called (untimed) before each run, and returning
+        the arguments to be passed to **func**
+    """
+    runs = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        with _quiet():
+            start = time.time()
+            result = func(*args)
+            runs.append(time.time() - start)
+        del result  # e.g. an IALview, that checks out back when deleted
+    return {'runs':runs,
+            'min':min(runs),
+            'median':sorted(runs)[len(runs) // 2]}
+
+
+def run_scale(workdir, scale, repeat=3):
+    """Generate the material of **scale** in **workdir**, and time the operations on it."""
+    params = SCALES[scale]
+    scaledir = os.path.join(workdir, scale)
+    if os.path.exists(scaledir):
+        shutil.rmtree(scaledir)
+    os.makedirs(scaledir)
+    bindir = make_gmkpack_stubs(os.path.join(scaledir, 'bin'))
+    homepack = os.path.join(scaledir, 'pack')
+    os.makedirs(homepack)
+    print("Generate synthetic repository ({})...".format(
+        ', '.join(['{}={}'.format(k, v) for k, v in sorted(params.items())])))
+    repo = make_synthetic_repository(os.path.join(scaledir, 'IAL'), **params)
+    repository = repo['repository']
+    latest = repo['releases'][-1]
+    branch = repo['branches'][0]
+    git = GitProxy(repository)
+    counter = {'packs':0}
+
+    def new_pack(main=False):
+        counter['packs'] += 1
+        return (make_fake_pack(homepack, 'pack{:04d}'.format(counter['packs']), latest, main=main),)
+
+    def checkout_main():
+        git.ref_checkout('main')
+        return ()
+
+    results = {}
+    with _path_prepended(bindir):
+        print("Time operations...")
+        results['IALview'] = time_it(lambda: IALview(repository, branch),
+                                     setup=checkout_main, repeat=repeat)
+        results['touched_between'] = time_it(lambda: git.touched_between(latest, branch),
+                                             repeat=repeat)
+        if len(repo['branches']) > 1:
+            results['preview_merge'] = time_it(lambda: git.preview_merge(repo['branches'][1], branch),
+                                               repeat=repeat)
+        view = IALview(repository, branch)
+        results['populate_from_IALview_as_incremental'] = time_it(
+            lambda pack, view=view: pack.populate_from_IALview_as_incremental(view, latest),
+            setup=new_pack, repeat=repeat)
+        del view
+        results['_populate_main_from_repo'] = time_it(
+            lambda pack: pack._populate_main_from_repo(repository),
+            setup=lambda: new_pack(main=True), repeat=repeat)
+        results['ics_build_for'] = time_it(
+            lambda pack: pack.ics_build_for('masterodb', silent=True),
+            setup=new_pack, repeat=repeat)
+    return results
+
+
+def run_benchmarks(workdir, scales=('small',), repeat=3):
+    """Run the benchmarks at the given **scales**, in **workdir**."""
+    results = {'meta':{'date':time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'host':socket.gethostname(),
+                       'python':platform.python_version(),
+                       'ial_build':__version__,
+                       'repeat':repeat},
+               'results':{}}
+    for scale in scales:
+        print("*** Scale: {} ***".format(scale))
+        results['results'][scale] = run_scale(workdir, scale, repeat=repeat)
+    return results
+
+
+# Storage & comparison ---------------------------------------------------------
+
+def save_results(results, filename):
+    """Save **results** as JSON."""
+    with io.open(filename, 'w') as f:
+        f.write(json.dumps(results, indent=2, sort_keys=True))
+
+
+def load_results(filename):
+    """Load results from JSON."""
+    with io.open(filename, 'r') as f:
+        return json.load(f)
+
+
+def compare_results(reference, results, tolerance=0.25, min_delta=0.01):
+    """
+    Compare **results** to **reference** (medians), and return regressions as a
+    list of (scale, case, reference median, median).
+
+    :param tolerance: relative slowdown tolerated
+    :param min_delta: absolute slowdown (s) tolerated, to absorb noise on
+        very short operations
+    """
+    regressions = []
+    for scale, cases in sorted(results['results'].items()):
+        for case, timing in sorted(cases.items()):
+            ref = reference['results'].get(scale, {}).get(case)
+            if ref is None:
+                continue
+            if (timing['median'] > ref['median'] * (1. + tolerance) and
+                timing['median'] - ref['median'] > min_delta):
+                regressions.append((scale, case, ref['median'], timing['median']))
+    return regressions
+
+
+def results_table(results, reference=None):
+    """Table of the results (medians), compared to **reference** if given."""
+    header = "{:8} {:40} {:>12}".format('Scale', 'Operation', 'Median (s)')
+    if reference is not None:
+        header += " {:>12} {:>8}".format('Ref. (s)', 'Ratio')
+    lines = ["-" * len(header), header, "-" * len(header)]
+    for scale, cases in sorted(results['results'].items()):
+        for case, timing in sorted(cases.items()):
+            line = "{:8} {:40} {:>12.3f}".format(scale, case, timing['median'])
+            if reference is not None:
+                ref = reference['results'].get(scale, {}).get(case)
+                if ref is not None:
+                    line += " {:>12.3f} {:>8.2f}".format(ref['median'],
+                                                         timing['median'] / max(ref['median'], 1e-9))
+            lines.append(line)
+    lines.append("-" * len(header))
+    return '\n'.join(lines)
+
+
+def main(scales=('small',), repeat=3, workdir=None, output=None,
+         reference=None, tolerance=0.25, keep=False):
+    """
+    Run benchmarks, print and save results, and compare to **reference**.
+
+    Return the list of regressions.
+    """
+    tmp = workdir is None
+    if tmp:
+        workdir = tempfile.mkdtemp(prefix='ial_build_bench.')
+    try:
+        results = run_benchmarks(os.path.abspath(workdir), scales=scales, repeat=repeat)
+    finally:
+        if tmp and not keep:
+            shutil.rmtree(workdir)
+    if reference is not None:
+        reference = load_results(reference)
+    print(results_table(results, reference=reference))
+    if output is not None:
+        save_results(results, output)
+        print("Results saved in: {}".format(output))
+    regressions = []
+    if reference is not None:
+        regressions = compare_results(reference, results, tolerance=tolerance)
+        for scale, case, ref, median in regressions:
+            print("! Regression: {} ({}): {:.3f}s vs. {:.3f}s".format(case, scale, median, ref))
+    return regressions
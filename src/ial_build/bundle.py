@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Management of bundles: sets of repositories of components, as described in a
+bundle file (yaml), downloaded in a cache through *ecbundle*.
+"""
+import os
+import io
+import re
+import shutil
+import tempfile
+import hashlib
+import subprocess
+import threading
+import fcntl
+import json
+
+from .config import BUNDLE_MIRROR_STORE
+from .commands import runner
+
+
+def bundle_projects(bundle):
+    """
+    Read the projects described in **bundle** file, without downloading.
+
+    Return a dict {component:{properties}}, as read in the bundle file.
+    """
+    from ecbundle import Bundle
+    projects = {}
+    for project in Bundle(bundle, env=True).get('projects', []):
+        for name, conf in project.items():
+            projects[name] = dict(conf)
+    return projects
+
+
+def bundle_resolve(bundle, src_dir=None):
+    """
+    Resolve the components of **bundle** against the repositories already
+    present in bundle cache **src_dir**, without any download (offline).
+
+    :param bundle: bundle file (yaml)
+    :param src_dir: cache directory in which to look for repositories
+
+    Return a dict {component:{properties}}, as read in the bundle file, with
+    additional properties:
+    - 'cached': whether the repository of the component is present in cache
+    - 'commit': commit id the version resolves to in cache, or None
+    """
+    if src_dir is None:
+        src_dir = os.getcwd()
+    projects = bundle_projects(bundle)
+    for component, properties in projects.items():
+        repository = os.path.join(src_dir, component)
+        properties['cached'] = os.path.isdir(os.path.join(repository, '.git'))
+        properties['commit'] = None
+        if properties['cached']:
+            version = str(properties['version'])
+            remote = properties.get('remote', 'origin')
+            for rev in (version, '/'.join([remote, version])):
+                try:
+                    properties['commit'] = runner.check_output(
+                        ['git', 'rev-parse', '--verify', '--quiet', rev + '^{commit}'],
+                        cwd=repository).decode('utf-8').strip()
+                    break
+                except subprocess.CalledProcessError:
+                    continue
+    return projects
+
+
+def bundle_split(bundle, outdir):
+    """
+    Split **bundle** file into one bundle file per component, in **outdir**.
+
+    Return a dict {component:bundle_file}.
+    """
+    from ecbundle import Bundle
+    from ecbundle.parse import to_yaml_str
+    b = Bundle(bundle, env=True)
+    split = {}
+    for project in b.get('projects', []):
+        for name, conf in project.items():
+            if conf.get('dir') and not os.path.isabs(conf['dir']):
+                # relative to the original bundle file
+                conf['dir'] = os.path.join(os.path.dirname(os.path.abspath(bundle)), conf['dir'])
+            config = dict(b.config)
+            config['projects'] = [project]
+            config.pop('data', None)
+            split[name] = os.path.join(outdir, '{}.yml'.format(name))
+            with io.open(split[name], 'w') as f:
+                f.write(to_yaml_str(config))
+    return split
+
+
+def bundle_download(bundle, src_dir=None, update=False, threads=1, no_colour=True,
+                    mirror_store=BUNDLE_MIRROR_STORE):
+    """
+    Set repositories defined in **bundle** into bundle cache **src_dir**,
+    through *ecbundle*'s BundleDownloader.
+
+    :param bundle: bundle file (yaml)
+    :param src_dir: cache directory in which to download/update repositories
+    :param update: if repositories are to be updated/checkedout
+    :param threads: number of threads to do parallel downloads
+    :param no_colour: Disable color output
+    :param mirror_store: a MirrorStore instance or the path to its root
+        directory, through which repositories are cloned/fetched;
+        None to clone/fetch directly from remotes
+
+    Return the actual cache directory and the dict of projects as read in
+    the bundle file.
+    """
+    from ecbundle import BundleDownloader
+    if src_dir is None:
+        src_dir = os.getcwd()
+    kwargs = {}
+    if mirror_store is not None:
+        if not isinstance(mirror_store, MirrorStore):
+            mirror_store = MirrorStore(mirror_store)
+        kwargs['git'] = mirror_store.git_class()
+    b = BundleDownloader(bundle=bundle,
+                         src_dir=src_dir,
+                         update=update,
+                         threads=threads,
+                         no_colour=no_colour,
+                         dryrun=False,
+                         dry_run=False,
+                         shallow=False,
+                         forced_update=False,
+                         **kwargs)
+    if b.download() != 0:
+        raise RuntimeError("Downloading repositories failed.")
+    projects = {}
+    for project in b.bundle().get('projects'):
+        for name, conf in project.items():
+            projects[name] = dict(conf)
+    src_dir = b.src_dir()
+    return src_dir, projects
+
+
+# Lockfile ---------------------------------------------------------------------
+
+#: Basename of the lockfile, next to bundle.yml in packs
+LOCKFILE_BASENAME = 'bundle.lock'
+
+
+def _git_output(cmd, repository):
+    return runner.check_output(cmd, cwd=repository,
+                               stderr=subprocess.STDOUT).decode('utf-8').strip()
+
+
+def bundle_hash(bundle):
+    """Hash of the contents of **bundle** file."""
+    with io.open(bundle, 'rb') as b:
+        return hashlib.sha256(b.read()).hexdigest()
+
+
+def bundle_lock(bundle, cache_dir, bundle_info):
+    """
+    Pin the components of **bundle**, as currently checked out in
+    **cache_dir**, to their commit id and tree hash.
+
+    :param bundle: bundle file (yaml)
+    :param cache_dir: cache directory in which to find the repositories
+    :param bundle_info: dict of projects as read in the bundle file
+
+    Return the lock, as a dict.
+    """
+    components = {}
+    for component, properties in bundle_info.items():
+        repository = os.path.join(cache_dir, component)
+        commit, tree = _git_output(['git', 'rev-parse', 'HEAD', 'HEAD^{tree}'],
+                                   repository).split()
+        components[component] = {'git':properties['git'],
+                                  'version':str(properties['version']),
+                                  'commit':commit,
+                                  'tree':tree}
+    return {'bundle_hash':bundle_hash(bundle),
+            'components':components}
+
+
+def bundle_lock_write(lock, lockfile):
+    """Write **lock** into **lockfile**."""
+    with io.open(lockfile, 'w') as f:
+        f.write(json.dumps(lock, indent=2, sort_keys=True))
+
+
+def bundle_lock_read(lockfile):
+    """Read lock from **lockfile**."""
+    with io.open(lockfile, 'r') as f:
+        return json.load(f)
+
+
+def bundle_lock_info(lock, bundle):
+    """
+    Bundle info (dict of projects properties) of **bundle** file, with the
+    pins of **lock** ('commit' and 'tree') merged into the properties of the
+    components.
+    """
+    projects = bundle_projects(bundle)
+    for component, properties in lock['components'].items():
+        projects.setdefault(component, {}).update(properties)
+    return projects
+
+
+def _git_checkout(repository, rev, detach=True):
+    cmd = ['git', '-c', 'advice.detachedHead=false', 'checkout', '--quiet']
+    if detach:
+        cmd.append('--detach')
+    _git_output(cmd + [rev], repository)
+
+
+def bundle_lock_checkout(lock, cache_dir):
+    """
+    Check that the pinned commits of **lock** are available in the
+    repositories of **cache_dir**, with the pinned trees, by object-id lookup
+    only (no fetch), and check them out if needed.
+
+    All components are checked before any checkout; if a checkout
+    fails nevertheless, the repositories already checked out are restored
+    to their previous state.
+
+    Return True if all components are available and checked out, False otherwise.
+    """
+    to_checkout = []
+    for component, properties in lock['components'].items():
+        repository = os.path.join(cache_dir, component)
+        if not os.path.isdir(os.path.join(repository, '.git')):
+            return False
+        commit = properties['commit']
+        try:
+            head, tree = _git_output(['git', 'rev-parse', 'HEAD',
+                                      commit + '^{tree}'], repository).split()
+        except subprocess.CalledProcessError:  # missing object
+            return False
+        if tree != properties['tree']:
+            return False
+        if head != commit:
+            if _git_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                           repository) != '':
+                return False
+            try:
+                branch = _git_output(['git', 'symbolic-ref', '--quiet', '--short', 'HEAD'],
+                                     repository)
+            except subprocess.CalledProcessError:  # detached
+                branch = None
+            to_checkout.append((repository, commit, head, branch))
+    done = []
+    try:
+        for repository, commit, head, branch in to_checkout:
+            _git_checkout(repository, commit)
+            done.append((repository, head, branch))
+    except subprocess.CalledProcessError:
+        for repository, head, branch in done:
+            if branch is None:
+                _git_checkout(repository, head)
+            else:
+                _git_checkout(repository, branch, detach=False)
+        return False
+    return True
+
+
+class BundleSplitDownloader(object):
+    """
+    Download the components of a bundle one by one, so that each of them can be
+    processed as soon as it has been cloned/fetched.
+    """
+
+    def __init__(self, bundle, src_dir=None, update=False, no_colour=True,
+                 mirror_store=BUNDLE_MIRROR_STORE):
+        """
+        :param bundle: bundle file (yaml)
+        :param src_dir: cache directory in which to download/update repositories
+        :param update: if repositories are to be updated/checkedout
+        :param no_colour: Disable color output
+        :param mirror_store: cf. bundle_download()
+        """
+        if mirror_store is not None and not isinstance(mirror_store, MirrorStore):
+            mirror_store = MirrorStore(mirror_store)
+        self.mirror_store = mirror_store
+        self.bundle = bundle
+        self.src_dir = os.path.abspath(os.getcwd() if src_dir is None else src_dir)
+        self.update = update
+        self.no_colour = no_colour
+        self._tmpdir = tempfile.mkdtemp(prefix='bundle_split.')
+        self._split = bundle_split(bundle, self._tmpdir)
+
+    def __del__(self):
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    @property
+    def components(self):
+        """Components of the bundle."""
+        return list(self._split.keys())
+
+    def download(self, component):
+        """
+        Clone/fetch **component** into cache.
+
+        Return the dict of properties of the component, as read in the bundle file.
+        """
+        _, projects = bundle_download(self._split[component],
+                                      src_dir=self.src_dir,
+                                      update=self.update,
+                                      threads=1,
+                                      no_colour=self.no_colour,
+                                      mirror_store=self.mirror_store)
+        return projects[component]
+
+
+def _git(cmd, cwd=None):
+    """Run git **cmd**, its stderr being kept in the exception if it fails."""
+    return runner.check_output(cmd, cwd=cwd, stderr=subprocess.PIPE)
+
+
+def _git_error_message(error):
+    """Message of a failed git command (subprocess.CalledProcessError)."""
+    stderr = error.stderr or b''
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode('utf-8', errors='replace')
+    return "Command '{}' failed ({}): {}".format(' '.join(error.cmd), error.returncode, stderr.strip())
+
+
+class MirrorStore(object):
+    """
+    Shared store of bare mirrors of remote repositories, keyed by remote URL.
+
+    Each mirror is refreshed by a single fetch (at most once per instance), and
+    bundle caches are cloned from it with alternates (objects are not copied),
+    their 'origin' remote still pointing to the actual remote URL.
+    """
+
+    def __init__(self, rootdir):
+        """
+        :param rootdir: root directory of the store
+        """
+        self.rootdir = os.path.abspath(os.path.expanduser(rootdir))
+        if not os.path.exists(self.rootdir):
+            os.makedirs(self.rootdir)
+        self._refreshed = set()
+        self._lock = threading.Lock()
+        self._url_locks = {}  # per mirror: concurrent callers wait for a single refresh
+
+    def mirror_path(self, url):
+        """Path to the bare mirror of **url**."""
+        name = re.sub('[^A-Za-z0-9_.-]', '_', url.rstrip('/').split('/')[-1])
+        if name.endswith('.git'):
+            name = name[:-4]
+        key = hashlib.md5(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.rootdir, '{}.{}.git'.format(name, key))
+
+    def mirror(self, url):
+        """
+        Create or refresh the mirror of **url**, at most once in the lifetime
+        of the store object, and return its path.
+        """
+        path = self.mirror_path(url)
+        with self._lock:
+            url_lock = self._url_locks.setdefault(path, threading.Lock())
+        with url_lock:  # vs. other threads: wait for the refresh in progress, if any
+            if path in self._refreshed:
+                return path
+            with io.open(path + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # vs. other processes/users
+                try:
+                    if os.path.exists(path):
+                        print("Refresh mirror of {}: {}".format(url, path))
+                        _git(['git', 'fetch', '--prune', '--quiet', 'origin'], cwd=path)
+                    else:
+                        print("Create mirror of {}: {}".format(url, path))
+                        _git(['git', 'clone', '--mirror', '--quiet', url, path])
+                        # objects may be borrowed by clones: never prune them
+                        _git(['git', 'config', 'gc.pruneExpire', 'never'], cwd=path)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            self._refreshed.add(path)  # only once complete
+        return path
+
+    def clone(self, url, src_dir, origin='origin'):
+        """
+        Clone **url** into **src_dir** through its mirror, with alternates,
+        keeping **origin** remote pointing to **url**.
+        """
+        mirror = self.mirror(url)
+        _git(['git', 'clone', '--quiet', '--reference', mirror,
+              '-o', origin, mirror, src_dir])
+        _git(['git', 'remote', 'set-url', origin, url], cwd=src_dir)
+        self.fetch(url, src_dir, origin)
+
+    def fetch(self, url, src_dir, remote='origin', rev=None):
+        """
+        Update **remote** refs of the repository in **src_dir** from the mirror of **url**.
+        If **rev** (e.g. a commit reached by no branch or tag) is not known then,
+        it is fetched explicitly from **remote**.
+        """
+        mirror = self.mirror(url)
+        _git(['git', 'fetch', '--quiet', '--tags', mirror,
+              '+refs/heads/*:refs/remotes/{}/*'.format(remote)],
+             cwd=src_dir)
+        if rev and not any([self._knows(src_dir, r) for r in (rev, '/'.join([remote, rev]))]):
+            print("Fetch {} from {} (not in mirror)".format(rev, url))
+            _git(['git', 'fetch', '--quiet', remote, rev], cwd=src_dir)
+
+    @staticmethod
+    def _knows(src_dir, rev):
+        """Whether **rev** resolves to a commit in the repository in **src_dir**."""
+        try:
+            _git(['git', 'rev-parse', '--verify', '--quiet', '{}^{{commit}}'.format(rev)], cwd=src_dir)
+        except subprocess.CalledProcessError:
+            return False
+        return True
+
+    def git_class(self):
+        """
+        Return a subclass of *ecbundle*'s Git utility, in which clone/fetch/pull
+        go through the mirrors of this store.
+        """
+        from ecbundle.git import Git
+        store = self
+
+        class MirroredGit(Git):
+
+            @classmethod
+            def _url(cls, src_dir, remote):
+                return runner.check_output(['git', 'config', '--get', 'remote.{}.url'.format(remote)],
+                                           cwd=src_dir).decode('utf-8').strip()
+
+            @classmethod
+            def clone(cls, repo_url, src_dir, rev, origin, dryrun, shallow=False):
+                if dryrun:
+                    return super(MirroredGit, cls).clone(repo_url, src_dir, rev, origin, dryrun, shallow)
+                try:
+                    store.clone(repo_url, src_dir, origin)
+                    store.fetch(repo_url, src_dir, origin, rev=rev)
+                except subprocess.CalledProcessError as e:
+                    raise RuntimeError(_git_error_message(e))
+                cls.checkout(src_dir, rev, dryrun)
+
+            @classmethod
+            def fetch(cls, src_dir, remote, rev, dryrun):
+                if dryrun:
+                    return super(MirroredGit, cls).fetch(src_dir, remote, rev, dryrun)
+                try:
+                    store.fetch(cls._url(src_dir, remote), src_dir, remote, rev=rev)
+                except subprocess.CalledProcessError as e:
+                    raise RuntimeError(_git_error_message(e))
+
+            @classmethod
+            def pull(cls, src_dir, origin, branch, dryrun):
+                if dryrun:
+                    return super(MirroredGit, cls).pull(src_dir, origin, branch, dryrun)
+                cls.fetch(src_dir, origin, branch, dryrun)
+                try:
+                    _git(['git', 'merge', '--quiet', '/'.join([origin, branch])], cwd=src_dir)
+                except subprocess.CalledProcessError as e:
+                    raise RuntimeError(_git_error_message(e))
+
+        return MirroredGit
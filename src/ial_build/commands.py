@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Central runner of external commands (git, gmkpack, ics_ scripts...).
+
+Every invocation is recorded (argv, cwd, duration, exit code, output size) in
+a ring buffer, optionally traced to a file as JSON lines, and may be capped by
+a timeout, configured by default or per command.
+"""
+import os
+import io
+import json
+import time
+import signal
+import threading
+import subprocess
+import collections
+
+from .config import COMMANDS_TRACE_FILE, COMMANDS_TIMEOUT
+from .instrumentation import count
+
+#: No automatic export
+__all__ = []
+
+
+class CommandRunner(object):
+    """Run commands and keep track of them."""
+
+    def __init__(self, maxlen=1000, trace_file=None, timeout=None, timeouts=None):
+        """
+        :param maxlen: number of records kept in the ring buffer
+        :param trace_file: if not None, each record is appended as a JSON line
+            to this file
+        :param timeout: default timeout (s) for all commands (None for no timeout)
+        :param timeouts: timeouts (s) per command, overriding default,
+            e.g. {'git':60, 'gmkpack':600}
+        """
+        self.records = collections.deque(maxlen=maxlen)
+        self.trace_file = trace_file
+        self.timeout = timeout
+        self.timeouts = {} if timeouts is None else dict(timeouts)
+        self._lock = threading.Lock()
+
+    def timeout_for(self, cmd):
+        """Timeout to be applied to **cmd**."""
+        return self.timeouts.get(os.path.basename(cmd[0]), self.timeout)
+
+    def record(self, cmd, cwd, start, duration, returncode, output_size=None):
+        """Record an invocation."""
+        record = {'argv':list(cmd),
+                  'cwd':os.path.abspath(cwd if cwd is not None else os.getcwd()),
+                  'start':start,
+                  'duration':duration,
+                  'returncode':returncode,
+                  'output_size':output_size}
+        count('subprocesses')
+        with self._lock:
+            self.records.append(record)
+            if self.trace_file is not None:
+                with io.open(self.trace_file, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+        return record
+
+    def dump(self, trace_file):
+        """Dump the records of the ring buffer as JSON lines into **trace_file**."""
+        with self._lock:
+            records = list(self.records)
+        with io.open(trace_file, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """Count, cumulated and max durations per command."""
+        summary = {}
+        with self._lock:
+            records = list(self.records)
+        for r in records:
+            name = os.path.basename(r['argv'][0])
+            s = summary.setdefault(name, {'count':0, 'duration':0., 'max_duration':0.})
+            s['count'] += 1
+            s['duration'] += r['duration']
+            s['max_duration'] = max(s['max_duration'], r['duration'])
+        return summary
+
+    @staticmethod
+    def _size_of(f):
+        """Current size of file object **f**, if it is an actual file."""
+        try:
+            return os.fstat(f.fileno()).st_size
+        except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+            return None
+
+    def _run(self, method, cmd, cwd=None, timeout='__default__', **kwargs):
+        if timeout == '__default__':
+            timeout = self.timeout_for(cmd)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        stdout = kwargs.get('stdout')
+        size0 = self._size_of(stdout)
+        start = time.time()
+        returncode = 0
+        output = None
+        try:
+            output = method(cmd, cwd=cwd, **kwargs)
+            return output
+        except subprocess.CalledProcessError as e:
+            returncode = e.returncode
+            output = e.output
+            raise
+        except subprocess.TimeoutExpired:
+            returncode = 'timeout'
+            raise
+        except OSError:  # e.g. command not found
+            returncode = 'OSError'
+            raise
+        finally:
+            if isinstance(output, bytes):
+                output_size = len(output)
+            elif size0 is not None:
+                output_size = self._size_of(stdout) - size0
+            else:
+                output_size = None
+            self.record(cmd, cwd, start, time.time() - start, returncode, output_size)
+
+    def check_output(self, cmd, cwd=None, timeout='__default__', **kwargs):
+        """Proxy to subprocess.check_output()."""
+        return self._run(subprocess.check_output, cmd, cwd=cwd, timeout=timeout, **kwargs)
+
+    def check_call(self, cmd, cwd=None, timeout='__default__', **kwargs):
+        """Proxy to subprocess.check_call()."""
+        return self._run(subprocess.check_call, cmd, cwd=cwd, timeout=timeout, **kwargs)
+
+    def stream(self, cmd, on_line=None, tee=None, cwd=None, timeout='__default__',
+               kill_grace=10):
+        """
+        Run **cmd** in its own process group, streaming its output (stdout
+        and stderr merged) line by line.
+
+        :param on_line: function called on each line (text); if it returns
+            True, the whole process group is killed (fail fast)
+        :param tee: file object in which to write the output lines
+        :param timeout: if not None, the process group is killed after that (s)
+        :param kill_grace: delay (s) between SIGTERM and SIGKILL when killing
+
+        Return the exit code, and raise subprocess.CalledProcessError if not
+        0, unless killed on request of **on_line**. Raise
+        subprocess.TimeoutExpired in case of timeout.
+        """
+        if timeout == '__default__':
+            timeout = self.timeout_for(cmd)
+        state = {'killed':None, 'size':0}
+
+        def kill(reason):
+            if state['killed'] is None:
+                state['killed'] = reason
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                    hard_kill = threading.Timer(kill_grace, killpg, [signal.SIGKILL])
+                    hard_kill.daemon = True
+                    hard_kill.start()
+                except OSError:  # already terminated
+                    pass
+
+        def killpg(sig):
+            try:
+                os.killpg(proc.pid, sig)
+            except OSError:
+                pass
+        start = time.time()
+        try:
+            proc = subprocess.Popen(cmd, cwd=cwd,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+        except OSError:
+            self.record(cmd, cwd, start, time.time() - start, 'OSError')
+            raise
+        watchdog = None
+        if timeout is not None:
+            watchdog = threading.Timer(timeout, kill, ['timeout'])
+            watchdog.daemon = True
+            watchdog.start()
+        returncode = None
+        try:
+            for raw in iter(proc.stdout.readline, b''):
+                state['size'] += len(raw)
+                line = raw.decode('utf-8', errors='replace')
+                if tee is not None:
+                    tee.write(line)
+                    tee.flush()
+                if on_line is not None and state['killed'] is None:
+                    if on_line(line):
+                        kill('on_line')
+            returncode = proc.wait()
+        except BaseException:  # e.g. KeyboardInterrupt: do not leave the group running
+            kill('interrupted')
+            proc.wait()
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            proc.stdout.close()
+            recorded = state['killed'] if state['killed'] is not None else returncode
+            self.record(cmd, cwd, start, time.time() - start, recorded, state['size'])
+        if state['killed'] == 'timeout':
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        if returncode != 0 and state['killed'] is None:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        return returncode
+
+
+#: The runner through which commands are run
+runner = CommandRunner(trace_file=COMMANDS_TRACE_FILE,
+                       timeout=COMMANDS_TIMEOUT)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental parsing of compilation output (ics_ scripts, gmkpack), to
+collect compiler and linker errors as they occur, and decide to abort the
+build early (fail fast).
+"""
+import re
+
+#: No automatic export
+__all__ = []
+
+
+class CompileMonitor(object):
+    """
+    Parse compilation output line by line, collecting errors as dicts
+    {'file', 'line', 'message', 'severity' (error|fatal), 'kind' (compile|link)}.
+
+    Usable as **on_line** callback of CommandRunner.stream(): returns True
+    when the build should be aborted.
+    """
+
+    # compiler errors with location on the same line
+    _re_errors = [
+        # Intel Fortran: file.F90(12): error #6404: This name does not have a type...
+        re.compile(r'^(?P<file>[^\s(]+)\((?P<line>\d+)\): (?P<severity>error|catastrophic error) #\d+: (?P<message>.*)$'),
+        # GNU C/C++, Intel C, clang: file.c:12:5: error: ...
+        re.compile(r'^(?P<file>[^\s:]+):(?P<line>\d+):(\d+:)? (?P<severity>fatal error|error): (?P<message>.*)$'),
+        # PGI/NVHPC: PGF90-S-0038-Symbol, x, has not been explicitly declared (file.F90: 12)
+        re.compile(r'^PG\w+-(?P<severity>S|F)-\d+-(?P<message>.*) \((?P<file>[^:]+): (?P<line>\d+)\)$'),
+        ]
+    # gfortran: location on a line, message a few lines below
+    _re_gfortran_location = re.compile(r'^(?P<file>[^\s:]+\.\w+):(?P<line>\d+):(\d+):$')
+    _re_gfortran_message = re.compile(r'^(?P<severity>Error|Fatal Error): (?P<message>.*)$')
+    # linker
+    _re_link_location = re.compile(r'^(?P<file>[^\s:]+\.(o|a|so)):?.*: In function')
+    _re_undefined = re.compile(r"^(?P<file>[^\s:]+)?:?.*undefined reference to [`'](?P<symbol>[^']+)'")
+    _re_link_fatal = re.compile(r'^(collect2: error: ld returned|ld: .*(cannot find|error)|(\S*/)?ld(\.\S+)?: final link failed)(?P<message>.*)$')
+    # build aborted anyway
+    _re_fatal = [
+        re.compile(r'^compilation aborted for (?P<file>\S+) \(code \d+\)'),
+        ]
+
+    def __init__(self, abort_on_fatal=False, max_errors=None):
+        """
+        :param abort_on_fatal: abort the build on the first fatal error
+            (aborted compilation, failed link)
+        :param max_errors: if not None, abort the build after that many errors
+        """
+        self.abort_on_fatal = abort_on_fatal
+        self.max_errors = max_errors
+        self.errors = []
+        self.aborted = False
+        self._seen = set()
+        self._location = None
+        self._link_file = None
+
+    def _add(self, filename, line, message, severity='error', kind='compile'):
+        key = (filename, line, message)
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        self.errors.append({'file':filename,
+                            'line':None if line is None else int(line),
+                            'message':message.strip(),
+                            'severity':severity,
+                            'kind':kind})
+
+    def parse(self, line):
+        """Parse one line of output."""
+        line = line.rstrip('\n')
+        stripped = line.strip()
+        for pattern in self._re_errors:
+            m = pattern.match(stripped)
+            if m:
+                severity = 'fatal' if m.group('severity') in ('catastrophic error', 'fatal error', 'F') else 'error'
+                self._add(m.group('file'), m.group('line'), m.group('message'), severity)
+                return
+        m = self._re_gfortran_location.match(stripped)
+        if m:
+            self._location = (m.group('file'), m.group('line'))
+            return
+        m = self._re_gfortran_message.match(stripped)
+        if m:
+            filename, lineno = self._location if self._location is not None else (None, None)
+            self._add(filename, lineno, m.group('message'),
+                      'fatal' if m.group('severity') == 'Fatal Error' else 'error')
+            self._location = None
+            return
+        m = self._re_link_location.match(stripped)
+        if m:
+            self._link_file = m.group('file')
+            return
+        m = self._re_undefined.search(stripped)
+        if m:
+            self._add(m.group('file') or self._link_file, None,
+                      'undefined reference to {}'.format(m.group('symbol')), kind='link')
+            return
+        m = self._re_link_fatal.match(stripped)
+        if m:
+            self._add(None, None, stripped, 'fatal', kind='link')
+            return
+        for pattern in self._re_fatal:
+            m = pattern.match(stripped)
+            if m:
+                self._add(m.group('file'), None, stripped, 'fatal')
+                return
+
+    def should_abort(self):
+        """Whether the build should be aborted, given errors so far."""
+        if self.abort_on_fatal and any([e['severity'] == 'fatal' for e in self.errors]):
+            return True
+        if self.max_errors is not None and len(self.errors) >= self.max_errors:
+            return True
+        return False
+
+    def __call__(self, line):
+        self.parse(line)
+        if not self.aborted and self.should_abort():
+            self.aborted = True
+            print("! Build aborted after {} error(s), first one: {}".format(len(self.errors),
+                                                                           self.format_error(self.errors[0])))
+        return self.aborted
+
+    @staticmethod
+    def format_error(error):
+        location = error['file'] or '?'
+        if error['line'] is not None:
+            location += ':{}'.format(error['line'])
+        return "{} ({} {}): {}".format(location, error['kind'], error['severity'], error['message'])
@@ -3,7 +3,6 @@
 # Copyright (c) Météo France (2020)
 # This software is governed by the CeCILL-C license under French law.
 # http://www.cecill.info
-from __future__ import print_function, absolute_import, unicode_literals, division
 """
 Configuration parameters.
 """
@@ -16,6 +15,57 @@ if DEFAULT_IA4H_REPO in ('', None):
     GIT_HOMEPACK = os.environ.get('GIT_HOMEPACK', os.path.join(os.environ['HOME'], 'repositories'))
     DEFAULT_IA4H_REPO = os.path.join(GIT_HOMEPACK, 'IA4H')
 
+# shared store of bare mirrors of bundle repositories (None: no mirrors)
+BUNDLE_MIRROR_STORE = os.environ.get('IAL_BUNDLE_MIRROR_STORE')
+if BUNDLE_MIRROR_STORE in ('', None):
+    BUNDLE_MIRROR_STORE = None
+
+# file in which to append instrumentation spans of the runs, as JSON lines (None: no file)
+INSTRUMENTATION_FILE = os.environ.get('IAL_BUILD_INSTRUMENTATION')
+if INSTRUMENTATION_FILE in ('', None):
+    INSTRUMENTATION_FILE = None
+# print the summary table of the instrumentation spans at the end of the runs (0 to disable)
+INSTRUMENTATION_SUMMARY = os.environ.get('IAL_BUILD_INSTRUMENTATION_SUMMARY', '1') not in ('', '0')
+
+# file in which to append a trace of the external commands run, as JSON lines (None: no file)
+COMMANDS_TRACE_FILE = os.environ.get('IAL_BUILD_COMMANDS_TRACE')
+if COMMANDS_TRACE_FILE in ('', None):
+    COMMANDS_TRACE_FILE = None
+# default timeout (s) of external commands (None: no timeout)
+COMMANDS_TIMEOUT = os.environ.get('IAL_BUILD_COMMANDS_TIMEOUT')
+if COMMANDS_TIMEOUT in ('', None):
+    COMMANDS_TIMEOUT = None
+else:
+    COMMANDS_TIMEOUT = float(COMMANDS_TIMEOUT)
+
+# registry of packs, in each HOMEPACK (disabled if '0')
+PACK_REGISTRY = os.environ.get('IAL_BUILD_PACK_REGISTRY', '1') != '0'
+
+# shared cache of compiled objects & modules, across packs (None: no cache)
+OBJECT_CACHE_DIR = os.environ.get('IAL_BUILD_OBJECT_CACHE')
+if OBJECT_CACHE_DIR in ('', None):
+    OBJECT_CACHE_DIR = None
+# max size of the objects cache (GB), least recently used entries being evicted beyond
+OBJECT_CACHE_MAX_SIZE = float(os.environ.get('IAL_BUILD_OBJECT_CACHE_MAX_SIZE', 20))
+
+# shared cache of built hub packages, across main packs (None: no cache)
+HUB_CACHE_DIR = os.environ.get('IAL_BUILD_HUB_CACHE')
+if HUB_CACHE_DIR in ('', None):
+    HUB_CACHE_DIR = None
+
+# shared store of built executables, across packs and users (None: no store)
+ARTIFACT_STORE_DIR = os.environ.get('IAL_BUILD_ARTIFACT_STORE')
+if ARTIFACT_STORE_DIR in ('', None):
+    ARTIFACT_STORE_DIR = None
+
+# number of compilation threads of builds (None: planned from the resources of the machine)
+GMK_THREADS_OVERRIDE = os.environ.get('IAL_BUILD_GMK_THREADS')
+GMK_THREADS_OVERRIDE = int(GMK_THREADS_OVERRIDE) if GMK_THREADS_OVERRIDE not in ('', None) else None
+# max number of concurrent builds from a HOMEPACK (None: planned from the resources of the machine)
+MAX_CONCURRENT_BUILDS_OVERRIDE = os.environ.get('IAL_BUILD_MAX_CONCURRENT_BUILDS')
+MAX_CONCURRENT_BUILDS_OVERRIDE = (int(MAX_CONCURRENT_BUILDS_OVERRIDE)
+                                  if MAX_CONCURRENT_BUILDS_OVERRIDE not in ('', None) else None)
+
 # temporary => UNTIL USE OF BUNDLE
 _ecSDK_dir = {'belenos':'/home/gmap/mrpe/mary/public/ecSDK',
               'taranis':'/home/gmap/mrpe/mary/public/ecSDK',
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Dependency graph of Fortran/C sources (MODULE/USE/INCLUDE relations), to
+predict the compilation units to be rebuilt after a set of modifications.
+
+Scanning results are cached per file (by size and mtime) in a JSON file, so
+that re-scanning a tree only reads the modified files.
+"""
+import os
+import io
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#: No automatic export
+__all__ = []
+
+#: Extensions of compilation units
+COMPILATION_UNITS_EXTENSIONS = ('.F90', '.f90', '.F', '.f', '.F95', '.f95', '.F03', '.f03', '.F08', '.f08',
+                                '.c', '.cc', '.cpp', '.cxx', '.C')
+#: Extensions of files that may be included
+INCLUDES_EXTENSIONS = ('.h', '.hpp', '.inc', '.intfb.h', '.func.h', '.ok', '.nml')
+#: Version of the cache format
+_CACHE_VERSION = 1
+
+_re_module = re.compile(r'^\s*module\s+(?!procedure\b|function\b|subroutine\b)(\w+)\s*(!.*)?$', re.IGNORECASE)
+_re_submodule = re.compile(r'^\s*submodule\s*\(\s*(\w+)', re.IGNORECASE)
+_re_use = re.compile(r'^\s*use\s*(?:,\s*(intrinsic|non_intrinsic)\s*)?(?:::)?\s*(\w+)', re.IGNORECASE)
+_re_include = re.compile(r'''^\s*(?:#\s*include|include)\s*["'<]([^"'>]+)["'>]''', re.IGNORECASE)
+
+
+def is_compilation_unit(filename):
+    """Whether **filename** is a compilation unit (vs. included file, etc...)."""
+    return (not any([filename.endswith(e) for e in INCLUDES_EXTENSIONS]) and
+            os.path.splitext(filename)[1] in COMPILATION_UNITS_EXTENSIONS)
+
+
+def is_scanned(filename):
+    """Whether **filename** is to be scanned for dependencies."""
+    return (os.path.splitext(filename)[1] in COMPILATION_UNITS_EXTENSIONS or
+            any([filename.endswith(e) for e in INCLUDES_EXTENSIONS]))
+
+
+def scan_source(path):
+    """
+    Scan source file **path** for dependencies.
+
+    Return a dict {'modules': defined modules, 'uses': used modules,
+    'includes': basenames of included files} (sorted lists, lower case for
+    modules).
+    """
+    modules = set()
+    uses = set()
+    includes = set()
+    with io.open(path, 'r', errors='replace') as f:
+        for line in f:
+            # cheap filter before regexps
+            stripped = line.lstrip()[:10].lower()
+            if not stripped or stripped[0] == '!':
+                continue
+            if stripped.startswith('use'):
+                m = _re_use.match(line)
+                if m and (m.group(1) or '').lower() != 'intrinsic':
+                    uses.add(m.group(2).lower())
+            elif stripped.startswith('module'):
+                m = _re_module.match(line)
+                if m:
+                    modules.add(m.group(1).lower())
+            elif stripped.startswith('submodule'):
+                m = _re_submodule.match(line)
+                if m:
+                    uses.add(m.group(1).lower())
+            elif stripped.startswith('include') or stripped.startswith('#'):
+                m = _re_include.match(line)
+                if m:
+                    includes.add(os.path.basename(m.group(1)))
+    uses -= modules
+    return {'modules':sorted(modules),
+            'uses':sorted(uses),
+            'includes':sorted(includes)}
+
+
+class DependencyGraph(object):
+    """
+    Dependency graph of the sources of one or several source trees.
+
+    When several trees are given (e.g. the views of a pack, local first), a
+    file present in several trees is taken from the first one.
+    """
+
+    def __init__(self, roots, cache_file=None, threads=8):
+        """
+        :param roots: source tree or list of source trees, by decreasing priority
+        :param cache_file: JSON file in which to cache scanning results
+        :param threads: number of files scanned concurrently
+        """
+        if isinstance(roots, str):
+            roots = [roots]
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.cache_file = cache_file
+        self.threads = threads
+        self.files = {}  # relpath: {size, mtime_ns, modules, uses, includes}
+        self.scan_stats = {}
+        self._reverse = None
+
+    # Scanning -----------------------------------------------------------------
+
+    def _walk(self):
+        """Return {relpath: abspath} of files to be scanned, with priority of roots."""
+        found = {}
+        for root in self.roots:
+            for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for f in filenames:
+                    if is_scanned(f):
+                        path = os.path.join(dirpath, f)
+                        found.setdefault(os.path.relpath(path, root), path)
+        return found
+
+    def _load_cache(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with io.open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+        except ValueError:  # corrupted
+            return {}
+        if cache.get('version') != _CACHE_VERSION or cache.get('roots') != self.roots:
+            return {}
+        return cache.get('files', {})
+
+    def _save_cache(self):
+        if self.cache_file is None:
+            return
+        tmp = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+        with io.open(tmp, 'w') as f:
+            json.dump({'version':_CACHE_VERSION,
+                       'roots':self.roots,
+                       'files':self.files}, f)
+        os.rename(tmp, self.cache_file)
+
+    def load(self):
+        """Load the graph as cached (without scanning)."""
+        self.files = self._load_cache()
+        self._reverse = None
+        return self
+
+    def scan(self):
+        """(Re-)scan the trees, reading only files modified since cached."""
+        t0 = time.time()
+        cached = self._load_cache()
+        found = self._walk()
+        to_scan = []
+        files = {}
+        for relpath, path in found.items():
+            st = os.stat(path)
+            entry = cached.get(relpath)
+            if (entry is not None and entry['path'] == path and
+                entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns):
+                files[relpath] = entry
+            else:
+                to_scan.append((relpath, path, st))
+
+        def scan_one(item):
+            relpath, path, st = item
+            entry = scan_source(path)
+            entry.update(path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+            return relpath, entry
+        with ThreadPoolExecutor(max_workers=max(1, self.threads)) as executor:
+            for relpath, entry in executor.map(scan_one, to_scan):
+                files[relpath] = entry
+        self.files = files
+        self._reverse = None
+        self.scan_stats = {'files':len(files),
+                           'scanned':len(to_scan),
+                           'elapsed':time.time() - t0}
+        self._save_cache()
+        return self
+
+    # Relations ----------------------------------------------------------------
+
+    def _build_reverse(self):
+        """Reverse graph: {relpath: set of relpaths directly depending on it}."""
+        providers = {}  # module: defining files
+        by_basename = {}  # basename: files
+        for relpath, entry in self.files.items():
+            for m in entry['modules']:
+                providers.setdefault(m, set()).add(relpath)
+            by_basename.setdefault(os.path.basename(relpath), set()).add(relpath)
+        reverse = {}
+        for relpath, entry in self.files.items():
+            for m in entry['uses']:
+                for p in providers.get(m, ()):
+                    reverse.setdefault(p, set()).add(relpath)
+            for i in entry['includes']:
+                for p in by_basename.get(i, ()):
+                    reverse.setdefault(p, set()).add(relpath)
+        self._providers = providers
+        self._by_basename = by_basename
+        self._reverse = reverse
+
+    @property
+    def reverse(self):
+        if self._reverse is None:
+            self._build_reverse()
+        return self._reverse
+
+    def module_providers(self, module):
+        """Files defining **module**."""
+        self.reverse  # build if necessary
+        return sorted(self._providers.get(module.lower(), ()))
+
+    def dependencies(self, relpath):
+        """Files **relpath** directly depends on (by USE or INCLUDE)."""
+        self.reverse  # build if necessary
+        entry = self.files[relpath]
+        deps = set()
+        for m in entry['uses']:
+            deps.update(self._providers.get(m, ()))
+        for i in entry['includes']:
+            deps.update(self._by_basename.get(i, ()))
+        deps.discard(relpath)
+        return sorted(deps)
+
+    def dependents(self, relpaths):
+        """All files depending, directly or not, on any of **relpaths** (themselves included)."""
+        reverse = self.reverse
+        seen = set()
+        stack = [f for f in relpaths]
+        while stack:
+            f = stack.pop()
+            if f in seen:
+                continue
+            seen.add(f)
+            stack.extend(reverse.get(f, set()) - seen)
+        return seen
+
+    # Impact -------------------------------------------------------------------
+
+    @staticmethod
+    def touched_as_list(touched_files):
+        """
+        Flatten a touched files dict (as returned by touched_between()) into
+        the list of new and modified files, and the list of deleted ones.
+        """
+        modified = set()
+        deleted = set()
+        for k in ('A', 'M', 'T'):
+            modified.update(touched_files.get(k, []))
+        for k in ('R', 'C'):
+            for f in touched_files.get(k, []):
+                modified.add(f[1])
+                if k == 'R':
+                    deleted.add(f[0])
+        deleted.update(touched_files.get('D', []))
+        return sorted(modified), sorted(deleted)
+
+    def _strip_prefix(self, relpath, prefix):
+        if prefix and relpath.startswith(prefix):
+            return relpath[len(prefix):]
+        return relpath
+
+    def impacted(self, touched_files, prefix=''):
+        """
+        Predict the compilation units to be recompiled after **touched_files**
+        (as returned by touched_between(): {status: files}) or list of files.
+
+        Deleted files impact the files that depended on them, as of the
+        scanned graph (i.e. to be scanned before deletion to be exact).
+
+        :param prefix: prefix of **touched_files** paths relative to the
+            scanned roots (e.g. 'src/' if the roots are the src/ of a
+            repository whose touched files are relative to its top)
+        """
+        if isinstance(touched_files, dict):
+            modified, deleted = self.touched_as_list(touched_files)
+        else:
+            modified, deleted = list(touched_files), []
+        prefix = os.path.join(prefix, '') if prefix else ''
+        touched = set()
+        for f in modified + deleted:
+            f = self._strip_prefix(f, prefix)
+            if f in self.files:
+                touched.add(f)
+        impacted = self.dependents(touched)
+        # new/modified compilation units not yet scanned are compiled anyway
+        for f in modified:
+            f = self._strip_prefix(f, prefix)
+            if f not in self.files and is_compilation_unit(f):
+                impacted.add(f)
+        for f in deleted:
+            impacted.discard(self._strip_prefix(f, prefix))
+        return sorted([f for f in impacted if is_compilation_unit(f)])
+
+    def cost(self, relpaths):
+        """Estimated cost of compiling **relpaths**: total size of sources (bytes)."""
+        return sum([self.files[f]['size'] for f in relpaths if f in self.files])
+
+    def impact_summary(self, touched_files, prefix='', out=None):
+        """
+        Print a summary of the rebuild impact of **touched_files** (cf.
+        impacted()), and return the impacted units.
+        """
+        import sys
+        out = sys.stdout if out is None else out
+        impacted = self.impacted(touched_files, prefix=prefix)
+        units = [f for f in self.files if is_compilation_unit(f)]
+        out.write("Rebuild impact: {} compilation units out of {} ({:.1f}%), {:.1f} MB of sources\n".format(
+            len(impacted), len(units),
+            100. * len(impacted) / max(1, len(units)),
+            self.cost(impacted) / 1024. ** 2))
+        # most widely used modules among the touched ones
+        modified, deleted = (self.touched_as_list(touched_files) if isinstance(touched_files, dict)
+                             else (list(touched_files), []))
+        fanout = []
+        for f in modified + deleted:
+            f = self._strip_prefix(f, os.path.join(prefix, '') if prefix else '')
+            if f in self.files:
+                fanout.append((len(self.dependents([f])) - 1, f))
+        for n, f in sorted(fanout, reverse=True)[:10]:
+            if n > 0:
+                out.write("  {:6} dependents: {}\n".format(n, f))
+        return impacted
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache of built hub packages (eckit, fckit, ecbuild...), shared across main
+packs.
+
+Hub packages are built and installed by gmkpack per project (e.g. ecSDK) in
+hub/local/install/<project>: an entry is thus the installed tree of a
+project (libs, headers, cmake configs), keyed by its packages@versions and
+the compiler label and flag. Versions of packages from a bundle are their
+resolved commits: projects of which a package is not pinned (a branch
+rather than a tag) bypass the cache.
+
+Install trees are relocated into the cache when stored: references to the
+install directory in the pack are replaced by the one in cache, and trees
+still referring to the pack (e.g. in the RPATH of binaries) are not cached.
+
+On a hit at populate time, the install tree of the project is linked in the
+pack from the cache, and the sources of its packages are not populated, so
+that gmkpack has nothing to build for it. After a successful compilation,
+the projects built in the pack are harvested into the cache.
+"""
+import os
+import io
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import subprocess
+
+from .config import HUB_CACHE_DIR
+from .commands import runner
+
+#: No automatic export
+__all__ = []
+
+#: Where gmkpack installs hub projects, in a pack
+HUB_INSTALL_SUBDIR = os.path.join('hub', 'local', 'install')
+#: File in which the hub projects of a pack are described (cf. HubCache.record())
+HUB_RECORD_BASENAME = '.pygmkpack.hub.json'
+
+
+def hub_projects(packages):
+    """
+    Group hub **packages** by project.
+
+    :param packages: dict {package: (project, version)}, version being None
+        if not pinned (cf. pinned_version())
+
+    Return a dict {project: {package: version}}.
+    """
+    projects = {}
+    for package, (project, version) in packages.items():
+        projects.setdefault(project, {})[package] = None if version is None else str(version)
+    return projects
+
+
+def pinned_version(version, repository=None, commit=None):
+    """
+    Version under which a hub package from a bundle is cached: its resolved
+    **commit** if known, else the commit **version** resolves to in
+    **repository** if it is a tag there; None if not pinned (e.g. a branch,
+    or repository not available), the project of the package then
+    bypassing the cache.
+    """
+    if commit:
+        return commit
+    if repository is None or not os.path.isdir(os.path.join(repository, '.git')):
+        return None
+    try:
+        return runner.check_output(['git', 'rev-parse', '--verify', '--quiet',
+                                    'refs/tags/{}^{{commit}}'.format(version)],
+                                   cwd=repository).decode('utf-8').strip()
+    except subprocess.CalledProcessError:  # not a tag
+        return None
+
+
+class HubCache(object):
+    """Cache of installed hub projects, in a directory."""
+
+    def __init__(self, cache_dir=None):
+        """
+        :param cache_dir: directory of the cache (default: config HUB_CACHE_DIR)
+        """
+        if cache_dir is None:
+            cache_dir = HUB_CACHE_DIR
+        if cache_dir is None:
+            raise ValueError("No directory for the hub cache (cf. $IAL_BUILD_HUB_CACHE)")
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    @staticmethod
+    def key(project, packages, label, flag):
+        """Key of a **project** with **packages** {package: version}, built with **label**.**flag**."""
+        desc = json.dumps({'project':project,
+                           'packages':{p:str(v) for p, v in packages.items()},
+                           'label':label,
+                           'flag':flag}, sort_keys=True)
+        return hashlib.sha256(desc.encode('utf-8')).hexdigest()[:16]
+
+    def entry_dir(self, project, packages, label, flag):
+        return os.path.join(self.cache_dir, '{}.{}'.format(label, flag), project,
+                            self.key(project, packages, label, flag))
+
+    def lookup(self, project, packages, label, flag):
+        """Installed tree of **project** in cache, or None."""
+        install = os.path.join(self.entry_dir(project, packages, label, flag), 'install')
+        if os.path.isdir(install):
+            os.utime(os.path.dirname(install), None)  # last used
+            return install
+        return None
+
+    def put(self, project, packages, label, flag, install, origin=None):
+        """
+        Store **install** tree of **project** into the cache, relocated
+        (cf. relocate()).
+        Return True if stored, False if already there.
+
+        :param origin: the pack **install** is in; the tree is not stored if
+            it still refers to it once relocated (ValueError)
+        """
+        entry = self.entry_dir(project, packages, label, flag)
+        if os.path.exists(entry):
+            return False
+        tmp = os.path.join(self.cache_dir, '.tmp.{}'.format(uuid.uuid4().hex))
+        try:
+            shutil.copytree(install, os.path.join(tmp, 'install'), symlinks=True)
+            self.relocate(os.path.join(tmp, 'install'), install, os.path.join(entry, 'install'),
+                          origin=install if origin is None else origin)
+            with io.open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                f.write(json.dumps({'project':project,
+                                    'packages':packages,
+                                    'label':label,
+                                    'flag':flag,
+                                    'created':time.time()}, sort_keys=True))
+            if not os.path.exists(os.path.dirname(entry)):
+                os.makedirs(os.path.dirname(entry))
+            os.rename(tmp, entry)  # atomic: entries are complete or absent
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if os.path.exists(entry):  # concurrently stored
+                return False
+            raise
+        except ValueError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return True
+
+    @staticmethod
+    def relocate(tree, install, target, origin):
+        """
+        Relocate **tree**, a copy of **install**, to **target**: references to
+        **install** in text files (cmake configs, pkg-config files...) and
+        symlinks are replaced by **target**.
+        Raise ValueError if references to **origin** remain, e.g. in binaries.
+        """
+        def variants(path):
+            return sorted(set([os.path.abspath(path), os.path.realpath(path)]), key=len, reverse=True)
+        installs = [p.encode('utf-8') for p in variants(install)]
+        origins = [p.encode('utf-8') for p in variants(origin)]
+        for dirpath, dirnames, filenames in os.walk(tree):
+            for name in dirnames + filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    link = os.readlink(path).encode('utf-8')
+                    for i in installs:
+                        link = link.replace(i, target.encode('utf-8'))
+                    if any([o in link for o in origins]):
+                        raise ValueError("Not relocatable: symlink {} refers to {}".format(os.path.relpath(path, tree), origin))
+                    if link != os.readlink(path).encode('utf-8'):
+                        os.unlink(path)
+                        os.symlink(link.decode('utf-8'), path)
+                elif name in filenames:
+                    with io.open(path, 'rb') as f:
+                        data = f.read()
+                    if not any([o in data for o in origins]):
+                        continue
+                    if b'\0' in data:
+                        raise ValueError("Not relocatable: binary {} refers to {}".format(os.path.relpath(path, tree), origin))
+                    relocated = data
+                    for i in installs:
+                        relocated = relocated.replace(i, target.encode('utf-8'))
+                    if any([o in relocated for o in origins]):
+                        raise ValueError("Not relocatable: {} refers to {}".format(os.path.relpath(path, tree), origin))
+                    with io.open(path, 'wb') as f:
+                        f.write(relocated)
+
+    # Packs --------------------------------------------------------------------
+
+    def link_into(self, pack, packages):
+        """
+        For each project of hub **packages** ({package: (project, version)})
+        found in cache, link its install tree into **pack**.
+
+        Return the set of projects found in cache; the record of the hub of
+        the pack is written meanwhile (cf. record()).
+        """
+        args = pack.genesis_arguments
+        label, flag = args.get('-l'), args.get('-o')
+        hits = set()
+        projects = hub_projects(packages)
+        for project, pkgs in sorted(projects.items()):
+            if None in pkgs.values():
+                print("Hub cache: bypassed for {} (not pinned: {})".format(
+                    project, ', '.join(sorted([p for p, v in pkgs.items() if v is None]))))
+                continue
+            install = self.lookup(project, pkgs, label, flag)
+            if install is None:
+                print("Hub cache: MISS for {} ({})".format(project, self._describe(pkgs)))
+                continue
+            link = os.path.join(pack.abspath, HUB_INSTALL_SUBDIR, project)
+            if not os.path.exists(os.path.dirname(link)):
+                os.makedirs(os.path.dirname(link))
+            if os.path.islink(link):
+                os.unlink(link)
+            elif os.path.exists(link):
+                shutil.rmtree(link)
+            os.symlink(install, link)
+            hits.add(project)
+            print("Hub cache: HIT for {} ({}): build skipped, linked to {}".format(
+                project, self._describe(pkgs), install))
+        self.record(pack, projects, hits)
+        return hits
+
+    @staticmethod
+    def _describe(packages):
+        return ', '.join(['{}@{}'.format(p, v) for p, v in sorted(packages.items())])
+
+    def record(self, pack, projects, hits):
+        """Record hub **projects** of **pack**, for harvest after compilation."""
+        record = {project:{'packages':pkgs,
+                           'cached':project in hits,
+                           'cacheable':None not in pkgs.values(),
+                           'cache_dir':self.cache_dir}
+                  for project, pkgs in projects.items()}
+        with io.open(os.path.join(pack.abspath, HUB_RECORD_BASENAME), 'w') as f:
+            f.write(json.dumps(record, indent=2, sort_keys=True))
+
+    @classmethod
+    def harvest(cls, pack):
+        """
+        Store the hub projects built in **pack** into their cache, as recorded
+        at populate time. Return the list of projects stored.
+        """
+        record_file = os.path.join(pack.abspath, HUB_RECORD_BASENAME)
+        if not os.path.exists(record_file):
+            return []
+        with io.open(record_file, 'r') as f:
+            record = json.load(f)
+        args = pack.genesis_arguments
+        label, flag = args.get('-l'), args.get('-o')
+        stored = []
+        for project, desc in sorted(record.items()):
+            install = os.path.join(pack.abspath, HUB_INSTALL_SUBDIR, project)
+            if (desc['cached'] or not desc.get('cacheable', True) or
+                os.path.islink(install) or not os.path.isdir(install)):
+                continue
+            try:
+                if cls(desc['cache_dir']).put(project, desc['packages'], label, flag, install,
+                                              origin=pack.abspath):
+                    stored.append(project)
+                    print("Hub cache: {} ({}) stored".format(project, cls._describe(desc['packages'])))
+            except (OSError, ValueError) as e:
+                print("! Warning: unable to store hub project {} in cache: {}".format(project, e))
+        return stored
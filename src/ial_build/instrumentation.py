@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the build pipelines: nested timed spans, with wall time,
+CPU time, peak RSS and counters (bytes copied, files copied, subprocesses...).
+
+Usage:
+
+>>> with span('IAL_gitref_to_incrpack', git_ref=git_ref):
+...     with span('populate'):
+...         count('files_copied', 12)
+
+or, for a whole function:
+
+>>> @instrumented
+... def IAL_gitref_to_incrpack(...):
+
+When the outermost span of a run is closed, spans are appended as JSON
+lines to the file given by $IAL_BUILD_INSTRUMENTATION, if any, and to the
+one given to set_output(), and a summary table is printed, unless disabled
+by $IAL_BUILD_INSTRUMENTATION_SUMMARY=0 or set_summary(False).
+"""
+import os
+import io
+import json
+import time
+import threading
+import resource
+import functools
+from contextlib import contextmanager
+
+from .config import INSTRUMENTATION_FILE, INSTRUMENTATION_SUMMARY
+
+#: No automatic export
+__all__ = []
+
+_lock = threading.Lock()
+_local = threading.local()
+_run = {'root':None, 'stack':[], 'spans':[], 'outputs':[], 'summary':None}
+
+
+class Span(object):
+    """A timed section of a run."""
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.attributes = attributes
+        self.counters = {}
+        self.wall = None
+        self.cpu = None
+        self.peak_rss = None
+        self._start_wall = time.time()
+        self._start_cpu = self._cpu_time()
+
+    @staticmethod
+    def _cpu_time():
+        """CPU time (user+sys) of the process and its terminated children."""
+        s = resource.getrusage(resource.RUSAGE_SELF)
+        c = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+
+    @staticmethod
+    def _peak_rss():
+        """Peak resident set size (kB), of the process or of its largest child."""
+        return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    def count(self, key, n=1):
+        with _lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def close(self):
+        self.wall = time.time() - self._start_wall
+        self.cpu = self._cpu_time() - self._start_cpu
+        self.peak_rss = self._peak_rss()
+        if self.parent is not None:  # parents account for their children's counters
+            for k, n in self.counters.items():
+                self.parent.count(k, n)
+
+    def as_dict(self):
+        return {'name':self.name,
+                'parent':None if self.parent is None else self.parent.name,
+                'depth':self.depth,
+                'start':self._start_wall,
+                'wall':self.wall,
+                'cpu':self.cpu,
+                'peak_rss_kB':self.peak_rss,
+                'counters':self.counters,
+                'attributes':self.attributes}
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_span():
+    """
+    Current span of the thread, or (e.g. in worker threads) the current span
+    of the thread that started the run, or None if there is no run.
+    """
+    stack = _stack()
+    if stack:
+        return stack[-1]
+    stack = _run['stack']
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name, **attributes):
+    """Context: a timed span, nested in the current one."""
+    parent = current_span()
+    s = Span(name, parent=parent, **attributes)
+    is_root = parent is None
+    if is_root:
+        with _lock:
+            _run['root'] = s
+            _run['stack'] = _stack()
+            _run['spans'] = []
+    _stack().append(s)
+    try:
+        yield s
+    finally:
+        _stack().pop()
+        s.close()
+        with _lock:
+            _run['spans'].append(s)
+        if is_root:
+            if INSTRUMENTATION_SUMMARY if _run['summary'] is None else _run['summary']:
+                print(summary())
+            outputs = _run['outputs']
+            if INSTRUMENTATION_FILE is not None:
+                outputs = [INSTRUMENTATION_FILE] + outputs
+            for outfile in outputs:
+                dump(outfile)
+            with _lock:
+                _run['root'] = None
+                _run['stack'] = []
+                _run['outputs'] = []
+                _run['summary'] = None
+
+
+def instrumented(func):
+    """Decorator: run the function within a span named after it."""
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapped
+
+
+def set_output(outfile):
+    """Dump the spans of the current run to **outfile** (too), at the end of the run."""
+    with _lock:
+        _run['outputs'].append(os.path.abspath(outfile))
+
+
+def set_summary(enable=True):
+    """Print (or not, if not **enable**) the summary table of the current run, at its end."""
+    with _lock:
+        _run['summary'] = enable
+
+
+def count(key, n=1):
+    """Increment counter **key** of the current span, if any."""
+    s = current_span()
+    if s is not None:
+        s.count(key, n)
+
+
+def spans():
+    """Closed spans of the current (or latest) run, in order of opening."""
+    return sorted(_run['spans'], key=lambda s: s._start_wall)
+
+
+def dump(outfile):
+    """Append the spans of the current (or latest) run as JSON lines to **outfile**."""
+    with io.open(outfile, 'a') as f:
+        for s in spans():
+            f.write(json.dumps(s.as_dict(), sort_keys=True) + '\n')
+
+
+def summary():
+    """Summary table of the spans of the current (or latest) run."""
+    counters = sorted(set([k for s in spans() for k in s.counters.keys()]))
+    header = "{:40} {:>9} {:>9} {:>10}".format('Span', 'Wall (s)', 'CPU (s)', 'RSS (MB)')
+    header += ''.join([" {:>14}".format(k) for k in counters])
+    lines = ["-" * len(header), header, "-" * len(header)]
+    for s in spans():
+        label = '  ' * s.depth + s.name
+        if s.attributes.get('program'):
+            label += ' ({})'.format(s.attributes['program'])
+        line = "{:40} {:>9.2f} {:>9.2f} {:>10.1f}".format(label[:40],
+                                                          s.wall, s.cpu, s.peak_rss / 1024.)
+        line += ''.join([" {:>14}".format(s.counters.get(k, '')) for k in counters])
+        lines.append(line)
+    lines.append("-" * len(header))
+    return '\n'.join(lines)
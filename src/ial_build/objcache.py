@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cache of compiled objects (.o) and module files (.mod), shared across packs.
+
+An entry is keyed by the path and contents of a compilation unit, the
+genesis of the pack (compiler label and flag, root pack), its hub packages,
+and (recursively) the keys of the modules it uses and files it includes: an
+identical source compiled in a sibling pack on top of identical dependencies
+gives identical products.
+
+Before compilation, the objects of the pack's src/local found in the cache
+are seeded into the pack; after a successful compilation, the newly
+compiled ones are harvested into the cache. The cache is bounded in size,
+least recently used entries being evicted.
+"""
+import os
+import io
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import uuid
+from contextlib import contextmanager
+
+from .util import file_sha256, unlink_if_exists
+from .config import OBJECT_CACHE_DIR, OBJECT_CACHE_MAX_SIZE
+from .registry import genesis_key_fields
+from .hubcache import HUB_RECORD_BASENAME
+
+#: No automatic export
+__all__ = []
+
+#: Version of the keys (to be incremented if the key definition changes)
+_KEY_VERSION = 2
+
+
+class ObjectCache(object):
+    """Size-bounded LRU cache of compilation products, in a directory."""
+
+    def __init__(self, cache_dir=None, max_size=None):
+        """
+        :param cache_dir: directory of the cache (default: config OBJECT_CACHE_DIR)
+        :param max_size: max size of the cache, in GB (default: config OBJECT_CACHE_MAX_SIZE)
+        """
+        if cache_dir is None:
+            cache_dir = OBJECT_CACHE_DIR
+        if cache_dir is None:
+            raise ValueError("No directory for the objects cache (cf. $IAL_BUILD_OBJECT_CACHE)")
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = (OBJECT_CACHE_MAX_SIZE if max_size is None else max_size) * 1024 ** 3
+        self.index = os.path.join(self.cache_dir, 'index.sqlite')
+
+    @contextmanager
+    def _connect(self):
+        """Context: a connection to the index, committed at exit."""
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        connection = sqlite3.connect(self.index, timeout=60)
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS entries "
+                               "(key TEXT PRIMARY KEY, unit TEXT, size INTEGER, created REAL, last_used REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries (last_used)")
+            yield connection
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, dst_root):
+        """
+        Copy the products of entry **key** under **dst_root**.
+        Return the list of copied files, or None if not in cache.
+        """
+        entry_dir = self._entry_dir(key)
+        meta = os.path.join(entry_dir, 'meta.json')
+        try:
+            with io.open(meta, 'r') as f:
+                files = json.load(f)['files']
+        except (IOError, OSError, ValueError):
+            return None
+        copied = []
+        for i, relpath in enumerate(files):
+            dst = os.path.join(dst_root, relpath)
+            if not os.path.exists(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            unlink_if_exists(dst)  # may be a hardlink to another pack's file
+            shutil.copyfile(os.path.join(entry_dir, str(i)), dst)
+            copied.append(dst)
+        with self._connect() as connection:
+            connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return copied
+
+    def put(self, key, src_root, relpaths, unit=None):
+        """
+        Store files **relpaths** (relative to **src_root**) as entry **key**.
+        Return True if stored, False if already there.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return False
+        tmp = os.path.join(self.cache_dir, '.tmp.{}'.format(uuid.uuid4().hex))
+        os.makedirs(tmp)
+        size = 0
+        try:
+            for i, relpath in enumerate(relpaths):
+                shutil.copyfile(os.path.join(src_root, relpath), os.path.join(tmp, str(i)))
+                size += os.path.getsize(os.path.join(tmp, str(i)))
+            with io.open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                f.write(json.dumps({'files':list(relpaths), 'unit':unit}))
+            if not os.path.exists(os.path.dirname(entry_dir)):
+                os.makedirs(os.path.dirname(entry_dir))
+            os.rename(tmp, entry_dir)  # atomic: entries are complete or absent
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if os.path.exists(entry_dir):  # concurrently stored
+                return False
+            raise
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO entries (key, unit, size, created, last_used) "
+                               "VALUES (?, ?, ?, ?, ?)", (key, unit, size, now, now))
+        return True
+
+    def size(self):
+        """Total size of the entries (bytes)."""
+        with self._connect() as connection:
+            return connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Evict least recently used entries beyond max size. Return (number, bytes) evicted."""
+        evicted = []
+        with self._connect() as connection:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_size:
+                return 0, 0
+            for key, size in connection.execute("SELECT key, size FROM entries ORDER BY last_used"):
+                if total <= self.max_size:
+                    break
+                evicted.append((key, size))
+                total -= size
+            connection.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in evicted])
+        for key, _ in evicted:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        return len(evicted), sum([s for _, s in evicted])
+
+
+class CachedCompilation(object):
+    """
+    Seeding of a pack's src/local from an ObjectCache before compilation,
+    and harvesting of its newly compiled products after.
+    """
+
+    def __init__(self, cache, pack, graph=None):
+        """
+        :param cache: an ObjectCache
+        :param pack: the Pack to be compiled
+        :param graph: the dependencies.DependencyGraph of the pack (scanned if None)
+        """
+        self.cache = cache
+        self.pack = pack
+        self.graph = pack.dependency_graph() if graph is None else graph
+        self.identity = json.dumps({'genesis':genesis_key_fields(pack.genesis_arguments),
+                                    'hub':self._hub_hash(pack)}, sort_keys=True)
+        self._keys = {}
+        self._hashes = {}
+        self.misses = []
+        self.stats = {'hits':0, 'misses':0, 'uptodate':0,
+                      'harvested':0, 'evicted':0, 'evicted_bytes':0}
+
+    @staticmethod
+    def _hub_hash(pack):
+        """Hash of the hub packages (and versions) of **pack**, per project, if recorded."""
+        record_file = os.path.join(pack.abspath, HUB_RECORD_BASENAME)
+        if not os.path.exists(record_file):
+            return None
+        with io.open(record_file, 'r') as f:
+            record = json.load(f)
+        packages = {project:r['packages'] for project, r in record.items()}
+        return hashlib.sha256(json.dumps(packages, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _content_hash(self, relpath):
+        if relpath not in self._hashes:
+            self._hashes[relpath] = file_sha256(self.graph.files[relpath]['path'])
+        return self._hashes[relpath]
+
+    def key(self, relpath, _visiting=None):
+        """Cache key of **relpath**, accounting for its dependencies."""
+        if relpath in self._keys:
+            return self._keys[relpath]
+        visiting = set() if _visiting is None else _visiting
+        visiting.add(relpath)
+        h = hashlib.sha256()
+        h.update('{}\n{}\n{}\n{}\n'.format(_KEY_VERSION, self.identity, relpath,
+                                           self._content_hash(relpath)).encode('utf-8'))
+        for dep in self.graph.dependencies(relpath):
+            if dep in visiting:  # include cycle
+                h.update('{} {}\n'.format(dep, self._content_hash(dep)).encode('utf-8'))
+            else:
+                h.update('{} {}\n'.format(dep, self.key(dep, visiting)).encode('utf-8'))
+        visiting.discard(relpath)
+        self._keys[relpath] = h.hexdigest()
+        return self._keys[relpath]
+
+    def _local_units(self):
+        """Compilation units of src/local, as (relpath, source path, object relpath)."""
+        from .dependencies import is_compilation_unit
+        local = os.path.join(self.pack._local, '')
+        for relpath, entry in sorted(self.graph.files.items()):
+            if is_compilation_unit(relpath) and entry['path'].startswith(local):
+                yield relpath, entry['path'], os.path.splitext(relpath)[0] + '.o'
+
+    def _module_files(self):
+        """{module name: relpath of its .mod in src/local}."""
+        mods = {}
+        for dirpath, _, filenames in os.walk(self.pack._local):
+            for f in filenames:
+                if f.endswith('.mod'):
+                    mods[f[:-4].lower()] = os.path.relpath(os.path.join(dirpath, f), self.pack._local)
+        return mods
+
+    def seed(self):
+        """Copy the products of cached units of src/local into the pack, unless up to date."""
+        t0 = time.time()
+        for relpath, source, obj in self._local_units():
+            obj_path = os.path.join(self.pack._local, obj)
+            if os.path.exists(obj_path) and os.path.getmtime(obj_path) >= os.path.getmtime(source):
+                self.stats['uptodate'] += 1
+                continue
+            if self.cache.get(self.key(relpath), self.pack._local) is not None:
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+                self.misses.append(relpath)
+        self.stats['seed_time'] = time.time() - t0
+        print("Objects cache: {} hits, {} misses, {} up to date ({:.1f}s)".format(
+            self.stats['hits'], self.stats['misses'], self.stats['uptodate'], self.stats['seed_time']))
+        return self.stats
+
+    def harvest(self, since):
+        """
+        Store into the cache the products of missed units compiled after
+        **since** (time), then evict beyond the cache max size.
+        """
+        mods = self._module_files()
+        for relpath in self.misses:
+            obj = os.path.splitext(relpath)[0] + '.o'
+            obj_path = os.path.join(self.pack._local, obj)
+            if not os.path.exists(obj_path) or os.path.getmtime(obj_path) < since:
+                continue
+            products = [obj]
+            complete = True
+            for m in self.graph.files[relpath]['modules']:
+                if m in mods:
+                    products.append(mods[m])
+                else:  # do not cache incomplete products
+                    complete = False
+            if complete and self.cache.put(self.key(relpath), self.pack._local, products, unit=relpath):
+                self.stats['harvested'] += 1
+        self.stats['evicted'], self.stats['evicted_bytes'] = self.cache.evict()
+        print("Objects cache: {} units harvested, {} entries evicted".format(
+            self.stats['harvested'], self.stats['evicted']))
+        return self.stats
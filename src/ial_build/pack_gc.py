@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Garbage collection of packs in a HOMEPACK, according to retention policies.
+
+Packs are scanned in parallel (disk usage, last activity, build status),
+then the ones not retained are removed concurrently. Dry run by default.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .pygmkpack import Pack, PackError
+from .registry import PackRegistry, registry_remove
+from .config import PACK_REGISTRY
+
+#: No automatic export
+__all__ = []
+
+
+def scandir_usage(path):
+    """
+    Disk usage of directory **path**, not following symlinks.
+
+    Return (bytes, number of files, latest mtime).
+    """
+    usage = 0
+    nfiles = 0
+    latest = 0.
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:  # e.g. permission denied, or removed meanwhile
+            continue
+        for entry in entries:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            usage += st.st_blocks * 512
+            latest = max(latest, st.st_mtime)
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                nfiles += 1
+    return usage, nfiles, latest
+
+
+def scandir_remove(path, threads=1):
+    """
+    Remove directory **path**, using os.scandir(); its subdirectories are
+    removed concurrently by **threads** threads.
+    """
+    def remove(directory):
+        for entry in os.scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                remove(entry.path)
+            else:
+                os.unlink(entry.path)
+        os.rmdir(directory)
+    subdirs = []
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append(entry.path)
+        else:
+            os.unlink(entry.path)
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        for _ in executor.map(remove, subdirs):
+            pass
+    os.rmdir(path)
+
+
+class PackInfo(object):
+    """Information about a pack, as needed for garbage collection."""
+
+    def __init__(self, pack, record=None):
+        """
+        :param pack: a Pack
+        :param record: its record in the pack registry, if any
+        """
+        self.pack = pack
+        self.packname = pack.packname
+        self.size, self.nfiles, self.last_activity = scandir_usage(pack.abspath)
+        args = pack.genesis_arguments
+        self.label = args.get('-l')
+        self.flag = args.get('-o')
+        self.branch = self._branch(pack, record, self.label, self.flag)
+        self.binaries_mtime = None
+        if record is not None and record.get('executables') is not None:
+            mtimes = [e['mtime_ns'] for e in record['executables'].values()]
+        else:  # read only: the pack is not to look active for having been scanned
+            mtimes = [s[0] for s in pack._bin_snapshot().values()]
+        if mtimes:
+            self.binaries_mtime = max(mtimes) / 1e9
+        if record is not None and record.get('build_status') is not None:
+            self.build_status = record['build_status']
+        else:
+            self.build_status = 'OK' if self.binaries_mtime is not None else None
+        self.logs = os.path.join(pack.abspath, 'log')
+        self.roots = self._roots(pack)
+        self.keep_reasons = []
+
+    @staticmethod
+    def _branch(pack, record, label, flag):
+        """Branch the pack has been made from: source ref if registered, or guessed from name."""
+        if record is not None and record.get('source_ref'):
+            return record['source_ref']
+        suffix = '.{}.{}'.format(label, flag)
+        if pack.packname.endswith(suffix):
+            return pack.packname[:-len(suffix)]
+        return pack.packname
+
+    @staticmethod
+    def _roots(pack):
+        """Real paths pointed by symlinks in src/ (e.g. to root packs)."""
+        roots = []
+        src = os.path.join(pack.abspath, 'src')
+        if os.path.isdir(src):
+            for entry in os.scandir(src):
+                if entry.is_symlink():
+                    roots.append(os.path.realpath(entry.path))
+        return roots
+
+    @property
+    def age(self):
+        """Days since last activity in the pack."""
+        return (time.time() - self.last_activity) / 86400.
+
+
+def scan_packs(homepack=None, threads=8):
+    """Scan the packs of **homepack** in parallel, and return their PackInfo."""
+    if homepack in (None, ''):
+        from .pygmkpack import GmkpackTool
+        homepack = GmkpackTool.get_homepack()
+    records = {}
+    if PACK_REGISTRY:
+        try:
+            records = {r['packname']:r for r in PackRegistry(homepack).find()}
+        except Exception as e:
+            print("! Warning: unable to read pack registry: {}".format(e))
+    packnames = [e.name for e in os.scandir(homepack)
+                 if e.is_dir(follow_symlinks=False) and os.path.exists(os.path.join(e.path, '.genesis'))]
+
+    def scan(packname):
+        try:
+            return PackInfo(Pack(packname, homepack=homepack), records.get(packname))
+        except Exception as e:
+            print("Skip pack '{}': {}".format(packname, e))
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        infos = [i for i in executor.map(scan, packnames) if i is not None]
+    return infos
+
+
+def apply_retention(infos, keep_last=3, keep_binaries_days=14.):
+    """
+    Sort packs between kept and to be deleted, according to policies:
+
+    - keep the **keep_last** most recently active packs of each branch
+    - keep packs with binaries younger than **keep_binaries_days** days
+    - keep root packs of kept packs
+
+    Return (kept, to be deleted), as lists of PackInfo; kept ones have their
+    *keep_reasons* filled.
+    """
+    by_branch = {}
+    for info in infos:
+        by_branch.setdefault(info.branch, []).append(info)
+    for branch, packs in by_branch.items():
+        for info in sorted(packs, key=lambda i: i.last_activity, reverse=True)[:keep_last]:
+            info.keep_reasons.append('last {} of branch'.format(keep_last))
+    now = time.time()
+    for info in infos:
+        if (info.binaries_mtime is not None and
+            (now - info.binaries_mtime) / 86400. < keep_binaries_days):
+            info.keep_reasons.append('binaries < {} days'.format(keep_binaries_days))
+    # root packs of kept packs
+    changed = True
+    while changed:
+        changed = False
+        for info in infos:
+            if not info.keep_reasons:
+                continue
+            for root in info.roots:
+                for other in infos:
+                    if (not other.keep_reasons and
+                        os.path.join(root, '').startswith(os.path.join(os.path.realpath(other.pack.abspath), ''))):
+                        other.keep_reasons.append('root of {}'.format(info.packname))
+                        changed = True
+    kept = [i for i in infos if i.keep_reasons]
+    deleted = [i for i in infos if not i.keep_reasons]
+    return kept, deleted
+
+
+def remove_old_logs(info, older_than_days):
+    """Remove log files of pack older than **older_than_days** days. Return freed bytes."""
+    freed = 0
+    if not os.path.isdir(info.logs):
+        return freed
+    limit = time.time() - older_than_days * 86400.
+    for entry in os.scandir(info.logs):
+        st = entry.stat(follow_symlinks=False)
+        if entry.is_file(follow_symlinks=False) and st.st_mtime < limit:
+            os.unlink(entry.path)
+            freed += st.st_blocks * 512
+    return freed
+
+
+def remove_orphan_lock_files(homepack=None):
+    """
+    Remove the lock files of packs which do not exist anymore (e.g. removed
+    by hand), unless being held. Return the number of removed lock files.
+    """
+    if homepack in (None, ''):
+        from .pygmkpack import GmkpackTool
+        homepack = GmkpackTool.get_homepack()
+    removed = 0
+    for entry in os.scandir(homepack):
+        if not (entry.name.startswith('.') and entry.name.endswith('.lock') and
+                entry.is_file(follow_symlinks=False)):
+            continue
+        packname = entry.name[1:-len('.lock')]
+        if not packname or os.path.exists(os.path.join(homepack, packname)):
+            continue
+        pack = Pack(packname, homepack=homepack, preexisting=False)
+        try:
+            with pack.lock(blocking=False):
+                if not os.path.exists(pack.abspath):  # not created meanwhile
+                    pack._remove_lock_file()
+                    removed += 1
+        except PackError:  # being held
+            continue
+    return removed
+
+
+def _size(n):
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(n) < 1024.:
+            return "{:.1f}{}".format(n, unit)
+        n /= 1024.
+    return "{:.1f}TB".format(n)
+
+
+def gc(homepack=None,
+       keep_last=3,
+       keep_binaries_days=14.,
+       logs_older_than_days=None,
+       dryrun=True,
+       threads=8):
+    """
+    Garbage collect packs in **homepack**.
+
+    :param keep_last: number of most recently active packs kept per branch
+    :param keep_binaries_days: keep packs with binaries younger than that (days)
+    :param logs_older_than_days: if not None, also remove log files older
+        than that (days) in kept packs
+    :param dryrun: only report what would be done
+    :param threads: number of packs scanned/deleted concurrently
+
+    Return (kept, deleted), as lists of PackInfo.
+    """
+    t0 = time.time()
+    infos = scan_packs(homepack, threads=threads)
+    kept, deleted = apply_retention(infos, keep_last=keep_last,
+                                    keep_binaries_days=keep_binaries_days)
+    print("{:50} {:>10} {:>8} {:8} {}".format('Pack', 'Size', 'Age (d)', 'Build', 'Decision'))
+    for info in sorted(infos, key=lambda i: (i.branch, -i.last_activity)):
+        decision = 'keep: ' + ', '.join(info.keep_reasons) if info.keep_reasons else 'DELETE'
+        print("{:50} {:>10} {:>8.1f} {:8} {}".format(info.packname[:50], _size(info.size),
+                                                     info.age, str(info.build_status), decision))
+    freed = sum([i.size for i in deleted])
+    print("-" * 50)
+    print("Scanned {} packs ({}) in {:.1f}s: {} to be deleted ({})".format(
+        len(infos), _size(sum([i.size for i in infos])), time.time() - t0, len(deleted), _size(freed)))
+    if dryrun:
+        print("(Dry run: nothing deleted)")
+        return kept, deleted
+
+    def delete(info):
+        try:
+            with info.pack.lock(blocking=False):
+                scandir_remove(info.pack.abspath)
+                info.pack._remove_lock_file()
+        except PackError as e:  # being used
+            print("Skip: {}".format(e))
+            return False
+        registry_remove(info.pack)
+        return True
+    # packs are deleted concurrently, each one sequentially
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        done = list(executor.map(delete, deleted))
+    deleted = [i for i, d in zip(deleted, done) if d]
+    remove_orphan_lock_files(homepack)
+    if logs_older_than_days is not None:
+        freed += sum([remove_old_logs(i, logs_older_than_days) for i in kept])
+    print("Deleted {} packs, freed {} in {:.1f}s".format(len(deleted), _size(freed), time.time() - t0))
+    return kept, deleted
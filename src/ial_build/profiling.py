@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per compilation unit timing of the compilation of a pack, from its logs.
+
+Timings are taken, by order of precision:
+
+- from the output of an instrumented compiler wrapper (cf.
+  write_timing_wrapper()), which prints lines
+  ``ial_build.timing start|end <unit> <epoch>``;
+- else from the time at which each line of the log was output, as recorded
+  by LineTimer in a ``.times`` file next to the log: a unit is then
+  considered compiled from its first mention in the log until its last one,
+  or until the next line of the log if mentioned once (a lower bound).
+
+Profiles are summarised (slowest units, parallelism over time, idle phases)
+and their history kept in the pack, for trends across cycles.
+"""
+import os
+import io
+import re
+import json
+import time
+import stat
+
+#: No automatic export
+__all__ = []
+
+#: Suffix of the file of line times, next to a log
+TIMES_SUFFIX = '.times'
+#: History of the compilation profiles of a pack (JSON lines)
+HISTORY_BASENAME = '.pygmkpack.compile_profiles.jsonl'
+
+_re_wrapper = re.compile(r'^ial_build\.timing (?P<event>start|end) (?P<unit>\S+) (?P<t>[\d.]+)')
+_re_unit = re.compile(r'(?:^|[\s/(\'"])(?P<unit>[\w.+-]+(?:/[\w.+-]+)*\.(?:F90|f90|F|f|c|cc|cpp))(?=$|[\s:(\'",])')
+
+
+class LineTimer(object):
+    """
+    Record the time at which each line of an output is emitted, in a file
+    (one offset per line, after a header giving the start time).
+    Usable as **on_line** callback of CommandRunner.stream().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+        self._f = io.open(path, 'w')
+        self._f.write('# start {:.3f}\n'.format(self.start))
+
+    def __call__(self, line):
+        self._f.write('{:.3f}\n'.format(time.time() - self.start))
+        return False
+
+    def close(self):
+        self._f.close()
+
+
+def read_times(path):
+    """Read a file of line times: return (start epoch, list of offsets)."""
+    with io.open(path, 'r') as f:
+        header = f.readline().split()
+        start = float(header[2])
+        return start, [float(l) for l in f if l.strip()]
+
+
+def write_timing_wrapper(path, compiler):
+    """
+    Write at **path** a wrapper of **compiler**, printing timing lines
+    around each compilation, to be used as compiler in gmkpack config.
+    """
+    with io.open(path, 'w') as f:
+        f.write('#!/bin/bash\n')
+        f.write('# timing wrapper of {}, cf. ial_build.profiling\n'.format(compiler))
+        f.write('unit=$(for a in "$@"; do case $a in *.F90|*.f90|*.F|*.f|*.c|*.cc|*.cpp) echo $a;; esac; done | tail -1)\n')
+        f.write('echo "ial_build.timing start ${unit:-?} $(date +%s.%N)"\n')
+        f.write('{} "$@"\n'.format(compiler))
+        f.write('rc=$?\n')
+        f.write('echo "ial_build.timing end ${unit:-?} $(date +%s.%N)"\n')
+        f.write('exit $rc\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+class CompileProfile(object):
+    """Timings of the compilation units of a compilation log."""
+
+    def __init__(self, units, wall, precise, threads=None):
+        """
+        :param units: dict {unit: (start, end)}, in seconds from the start of the run
+        :param wall: wall time of the run (s)
+        :param precise: whether timings come from a timing wrapper
+        :param threads: number of compilation threads of the run, if known
+        """
+        self.units = units
+        self.wall = wall
+        self.precise = precise
+        self.threads = threads
+
+    @classmethod
+    def from_log(cls, log, threads=None):
+        """Profile of compilation **log**, or None if no timing is available."""
+        with io.open(log, 'r', errors='replace') as f:
+            lines = [l.rstrip('\n') for l in f]
+        # instrumented wrapper
+        starts = {}
+        units = {}
+        first = None
+        last = None
+        for line in lines:
+            m = _re_wrapper.match(line.strip())
+            if m:
+                t = float(m.group('t'))
+                first = t if first is None else min(first, t)
+                last = t if last is None else max(last, t)
+                if m.group('event') == 'start':
+                    starts[m.group('unit')] = t
+                elif m.group('unit') in starts:
+                    units[m.group('unit')] = (starts.pop(m.group('unit')), t)
+        if units:
+            return cls({u:(s - first, e - first) for u, (s, e) in units.items()},
+                       last - first, True, threads=threads)
+        # line times
+        times_file = log + TIMES_SUFFIX
+        if not os.path.exists(times_file):
+            return None
+        _, offsets = read_times(times_file)
+        wall = offsets[-1] if offsets else 0.
+        mentions = {}
+        for i, (line, t) in enumerate(zip(lines, offsets)):
+            m = _re_unit.search(line)
+            if m:
+                mentions.setdefault(m.group('unit'), []).append(i)
+        for unit, indices in mentions.items():
+            start = offsets[indices[0]]
+            if len(indices) > 1:
+                end = offsets[indices[-1]]
+            else:
+                end = offsets[indices[0] + 1] if indices[0] + 1 < len(offsets) else wall
+            units[unit] = (start, end)
+        return cls(units, wall, False, threads=threads)
+
+    @property
+    def busy_time(self):
+        """Sum of the compilation times of the units (s)."""
+        return sum([e - s for s, e in self.units.values()])
+
+    @property
+    def parallelism(self):
+        """Average number of units compiled simultaneously."""
+        return self.busy_time / self.wall if self.wall > 0 else 0.
+
+    @property
+    def efficiency(self):
+        """Average parallelism, relative to the number of threads (if known)."""
+        if not self.threads:
+            return None
+        return self.parallelism / self.threads
+
+    def slowest(self, n=20):
+        """The **n** slowest units, as list of (unit, duration)."""
+        return sorted([(u, e - s) for u, (s, e) in self.units.items()],
+                      key=lambda x: x[1], reverse=True)[:n]
+
+    def timeline(self, step=None):
+        """
+        Parallelism over time: list of (time, average number of units compiled
+        simultaneously during [time, time + step]).
+        """
+        if step is None:
+            step = max(1., self.wall / 50.)
+        nbins = int(self.wall // step) + 1
+        bins = [0.] * nbins
+        for s, e in self.units.values():
+            i = int(s // step)
+            while i < nbins and i * step < e:
+                overlap = min(e, (i + 1) * step) - max(s, i * step)
+                bins[i] += max(0., overlap) / step
+                i += 1
+        return [(i * step, b) for i, b in enumerate(bins)]
+
+    def idle_phases(self, min_duration=5.):
+        """Phases of the run (start, end) longer than **min_duration** with no unit compiling."""
+        intervals = sorted(self.units.values())
+        idle = []
+        current = 0.
+        for s, e in intervals:
+            if s - current >= min_duration:
+                idle.append((current, s))
+            current = max(current, e)
+        if self.wall - current >= min_duration:
+            idle.append((current, self.wall))
+        return idle
+
+    def summary(self, n=20):
+        """Summary, as a JSON-serializable dict."""
+        return {'wall':self.wall,
+                'units':len(self.units),
+                'busy_time':self.busy_time,
+                'parallelism':self.parallelism,
+                'threads':self.threads,
+                'efficiency':self.efficiency,
+                'precise':self.precise,
+                'slowest':self.slowest(n),
+                'idle_phases':self.idle_phases()}
+
+    def report(self, n=20, out=None):
+        """Print a report of the profile."""
+        import sys
+        out = sys.stdout if out is None else out
+        out.write("Compilation profile ({} timings): {} units in {:.1f}s, busy {:.1f}s, "
+                  "average parallelism {:.1f}".format('precise' if self.precise else 'approximate',
+                                                      len(self.units), self.wall, self.busy_time,
+                                                      self.parallelism))
+        if self.efficiency is not None:
+            out.write(" ({:.0%} of {} threads)".format(self.efficiency, self.threads))
+        out.write("\nSlowest units:\n")
+        for unit, duration in self.slowest(n):
+            out.write("  {:8.1f}s  {}\n".format(duration, unit))
+        idle = self.idle_phases()
+        if idle:
+            out.write("Idle phases (no unit compiling):\n")
+            for s, e in idle:
+                out.write("  {:8.1f}s -> {:8.1f}s ({:.1f}s)\n".format(s, e, e - s))
+        out.write("Parallelism over time:\n")
+        scale = max([p for _, p in self.timeline()] + [1.])
+        for t, p in self.timeline():
+            out.write("  {:8.1f}s {:5.1f} {}\n".format(t, p, '#' * int(round(40 * p / scale))))
+
+
+# Pack history -----------------------------------------------------------------
+
+def record_profile(pack, profile, run_id=None, program=''):
+    """Append the summary of **profile** to the history of **pack**."""
+    entry = dict(profile.summary(), run_id=run_id, program=program, time=time.time())
+    with io.open(os.path.join(pack.abspath, HISTORY_BASENAME), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    return entry
+
+
+def profile_history(pack):
+    """History of the compilation profiles of **pack** (list of summaries, oldest first)."""
+    path = os.path.join(pack.abspath, HISTORY_BASENAME)
+    if not os.path.exists(path):
+        return []
+    with io.open(path, 'r') as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+
+def history_report(history, n=10, out=None):
+    """Print the trends of a profile **history**: wall times, and slowest units across runs."""
+    import sys
+    out = sys.stdout if out is None else out
+    out.write("{:20} {:>10} {:>6} {:>10} {:>6}\n".format('Run', 'Wall (s)', 'Units', 'Busy (s)', 'Par.'))
+    for h in history:
+        out.write("{:20} {:>10.1f} {:>6} {:>10.1f} {:>6.1f}\n".format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(h['time'])),
+            h['wall'], h['units'], h['busy_time'], h['parallelism']))
+    worst = {}
+    for h in history:
+        for unit, duration in h['slowest']:
+            worst.setdefault(unit, []).append(duration)
+    if worst:
+        out.write("Slowest units across runs (max, runs in which among the slowest):\n")
+        for unit, durations in sorted(worst.items(), key=lambda x: max(x[1]), reverse=True)[:n]:
+            out.write("  {:8.1f}s {:4}  {}\n".format(max(durations), len(durations), unit))
@@ -3,20 +3,31 @@
 """
 Python wrapping of *gmkpack*.
 """
-from __future__ import print_function, absolute_import, unicode_literals, division
 
-import six
 import os
+import sys
 import re
-import subprocess
 import tarfile
 import io
+import json
 import shutil
-from contextlib import contextmanager
+import time
+import uuid
+import fcntl
+import threading
+from contextlib import contextmanager, ExitStack
 
 from bronx.stdtypes.date import now
 
-from .util import DirectoryFiltering, copy_files_in_cwd
+from .util import (DirectoryFiltering, copy_files_in_cwd, copy_files_in_dirs,
+                   copy_counted, copy2_counted, unlink_if_exists,
+                   elf_build_id, file_sha256, reflink)
+from .instrumentation import instrumented
+from .commands import runner
+from .compile_monitor import CompileMonitor
+from .profiling import (LineTimer, CompileProfile, TIMES_SUFFIX,
+                        record_profile, profile_history)
+from .registry import registry_update, registry_remove
 
 #: No automatic export
 __all__ = []
@@ -83,9 +94,9 @@ class GmkpackTool(object):
         command = ['gmkpack',] + arguments_as_list
         if silent:
             with io.open(os.devnull, 'w') as devnull:
-                r = subprocess.check_call(command, stdout=devnull, stderr=devnull)
+                r = runner.check_call(command, stdout=devnull, stderr=devnull)
         else:
-            r = subprocess.check_call(command)
+            r = runner.check_call(command)
         return r
 
     @staticmethod
@@ -192,6 +203,7 @@ class GmkpackTool(object):
         return packname
 
     @classmethod
+    @instrumented
     def new_incremental_pack(cls,
                              packname,
                              compiler_label,
@@ -216,8 +228,6 @@ class GmkpackTool(object):
         :param silent: to mute gmkpack
         """
         pack = Pack(packname, preexisting=False, homepack=homepack)
-        if os.path.exists(pack.abspath):
-            raise PackError('Pack already exists, cannot create: {}'.format(pack.abspath))
         args = cls.args_for_incremental_commandline(packname,
                                                     compiler_label,
                                                     initial_release=initial_release,
@@ -227,10 +237,15 @@ class GmkpackTool(object):
                                                     rootpack=rootpack,
                                                     homepack=homepack)
         print(args)
-        cls.commandline(args, silent=silent)
+        with pack.lock():  # vs. concurrent creation
+            if os.path.exists(pack.abspath):
+                raise PackError('Pack already exists, cannot create: {}'.format(pack.abspath))
+            cls.commandline(args, silent=silent)
+        registry_update(pack, created=time.time())
         return pack
 
     @classmethod
+    @instrumented
     def new_main_pack(cls,
                       initial_release,
                       branch_radical,
@@ -261,9 +276,11 @@ class GmkpackTool(object):
                                              homepack=homepack)
         packname = cls.args2packname(args, mainpack=True)
         pack = Pack(packname, preexisting=False, homepack=homepack)
-        if os.path.exists(pack.abspath):
-            raise PackError('Pack already exists, cannot create: {}'.format(pack.abspath))
-        cls.commandline(args, ['-a', '-K'], silent=silent)
+        with pack.lock():  # vs. concurrent creation
+            if os.path.exists(pack.abspath):
+                raise PackError('Pack already exists, cannot create: {}'.format(pack.abspath))
+            cls.commandline(args, ['-a', '-K'], silent=silent)
+        registry_update(pack, created=time.time())
         return pack
 
 
@@ -281,11 +298,232 @@ class Pack(object):
         self._local = os.path.join(self.abspath, 'src', 'local')
         self._hub_local_src = os.path.join(self.abspath, 'hub', 'local', 'src')
         self._bin = os.path.join(self.abspath, 'bin')
+        self._lock_guard = threading.Lock()
+        self._lock_depth = 0
+        self._lock_file = None
+        self._staging_depth = 0
+        self._staging_failed = False
+        self._staged = {}
+        self._staged_files = {}
+        self.reused_from = None  # build cache hit: equivalent pack, already built, reused as is
         if not preexisting and os.path.exists(self.abspath):
             raise PackError("Pack already exists, while *preexisting* is False ({}).".format(self.abspath))
         if preexisting and not os.path.exists(self.abspath):
             raise PackError("Pack is supposed to preexist, while it doesn't ({}).".format(self.abspath))
 
+    # Locking & staging --------------------------------------------------------
+
+    #: Directories populated through a staging directory
+    _staged_attributes = ('_hub_local_src', '_local')
+
+    @property
+    def _lock_filepath(self):
+        """Lock file, next to the pack (so that it exists before and after it)."""
+        return os.path.join(self.homepack, '.{}.lock'.format(self.packname))
+
+    @property
+    def _swap_filepath(self):
+        """Marker: staging directories and files are complete and being merged in."""
+        return os.path.join(self.abspath, '.pygmkpack.swap')
+
+    @contextmanager
+    def lock(self, blocking=True):
+        """
+        Context: advisory lock (fcntl) on the pack, vs. other processes or Pack
+        instances. Reentrant within the instance (including its threads).
+
+        :param blocking: if False, raise PackError if the pack is already locked
+        """
+        with self._lock_guard:
+            if self._lock_depth == 0:
+                if not os.path.exists(self.homepack):
+                    os.makedirs(self.homepack)
+                while True:
+                    f = io.open(self._lock_filepath, 'a')
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                    except (IOError, OSError):
+                        f.close()
+                        raise PackError("Pack is locked by another process: {}".format(self.abspath))
+                    try:
+                        same = os.stat(self._lock_filepath).st_ino == os.fstat(f.fileno()).st_ino
+                    except OSError:
+                        same = False
+                    if same:
+                        break
+                    # lock file removed (pack deleted) while waiting for it: retry on the new one
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                    f.close()
+                self._lock_file = f
+                try:
+                    self._recover_population()
+                except Exception:
+                    self._unlock()
+                    raise
+            self._lock_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock_guard:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._unlock()
+
+    def _unlock(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def _remove_lock_file(self):
+        """Remove the lock file of the deleted pack (the lock being held)."""
+        assert self._lock_file is not None
+        unlink_if_exists(self._lock_filepath)
+
+    @staticmethod
+    def _staging_path(path):
+        return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.staging')
+
+    def _staged_directories(self):
+        """Actual paths of the directories populated through staging."""
+        return [self._staged.get(attr, getattr(self, attr)) for attr in self._staged_attributes]
+
+    def _recover_population(self):
+        """
+        Recover from an interrupted population: complete the merge of the
+        staging directories and files if they were complete, discard them otherwise.
+        """
+        if not os.path.exists(self.abspath):
+            return
+        if os.path.exists(self._swap_filepath):
+            with io.open(self._swap_filepath, 'r') as f:
+                targets = [l.strip() for l in f if l.strip() != '']
+            for target in targets:
+                if os.path.lexists(self._staging_path(target)):
+                    print("Complete interrupted population of: {}".format(target))
+                    self._merge_staging(target)
+            os.remove(self._swap_filepath)
+        for directory in self._staged_directories():
+            staging = self._staging_path(directory)
+            if os.path.exists(staging):
+                print("Discard interrupted population of: {}".format(directory))
+                shutil.rmtree(staging)
+        for entry in os.listdir(self.abspath):  # staged files
+            path = os.path.join(self.abspath, entry)
+            if entry.startswith('.') and entry.endswith('.staging') and os.path.isfile(path):
+                os.remove(path)
+
+    def _merge_staging(self, target):
+        """Move the contents of the staging of **target** (directory or file) into it."""
+        staging = self._staging_path(target)
+        if os.path.islink(staging) or not os.path.isdir(staging):
+            os.rename(staging, target)
+            return
+        for dirpath, dirnames, filenames in os.walk(staging):
+            dstdir = os.path.normpath(os.path.join(target, os.path.relpath(dirpath, staging)))
+            if not os.path.isdir(dstdir):
+                unlink_if_exists(dstdir)
+                os.makedirs(dstdir)
+            for name in list(dirnames):
+                if os.path.islink(os.path.join(dirpath, name)):  # not to be walked into
+                    dirnames.remove(name)
+                    filenames.append(name)
+            for name in filenames:
+                dst = os.path.join(dstdir, name)
+                if os.path.isdir(dst) and not os.path.islink(dst):
+                    shutil.rmtree(dst)
+                os.rename(os.path.join(dirpath, name), dst)
+        shutil.rmtree(staging)
+
+    @contextmanager
+    def staged_population(self):
+        """
+        Context: populate the pack (src/local, hub/local/src) through staging
+        directories, which receive the new or replaced files only, and which
+        are merged in at the end if everything went fine, discarded otherwise.
+        Files of the pack written meanwhile through _staged_file() (ignore
+        lists, origin info) are committed along.
+        Pack is locked meanwhile. Reentrant within the instance (including
+        its threads): the merge occurs when the outermost context is exited.
+        """
+        with self.lock():
+            with self._lock_guard:
+                if self._staging_depth == 0:
+                    self._staging_start()
+                self._staging_depth += 1
+            try:
+                yield self
+            except BaseException:
+                with self._lock_guard:
+                    self._staging_failed = True
+                raise
+            finally:
+                with self._lock_guard:
+                    self._staging_depth -= 1
+                    if self._staging_depth == 0:
+                        self._staging_end()
+
+    def _staging_start(self):
+        self._staging_failed = False
+        self._staged_files = {}
+        for attr in self._staged_attributes:
+            directory = getattr(self, attr)
+            if not os.path.isdir(directory):  # not to be populated in this pack
+                continue
+            staging = self._staging_path(directory)
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+            os.makedirs(staging)
+            self._staged[attr] = directory
+            setattr(self, attr, staging)
+
+    def _staging_end(self):
+        staged = self._staged
+        self._staged = {}
+        files = self._staged_files
+        self._staged_files = {}
+        for attr, directory in staged.items():
+            setattr(self, attr, directory)
+        if self._staging_failed:
+            for directory in staged.values():
+                shutil.rmtree(self._staging_path(directory))
+            for staging in files.values():
+                unlink_if_exists(staging)
+        else:
+            targets = list(files.keys()) + [staged[attr] for attr in self._staged_attributes
+                                            if attr in staged]  # src/local last
+            with io.open(self._swap_filepath, 'w') as f:  # commit point
+                f.write('\n'.join(targets) + '\n')
+            for target in targets:
+                self._merge_staging(target)
+            os.remove(self._swap_filepath)
+
+    def _staged_file(self, path):
+        """
+        Path at which to read/write file **path** of the pack: during a
+        population, a staging copy of it, committed along with the population;
+        **path** itself otherwise.
+        """
+        with self._lock_guard:
+            if self._staging_depth == 0:
+                return path
+            if path not in self._staged_files:
+                staging = self._staging_path(path)
+                if os.path.exists(path):
+                    shutil.copy2(path, staging)
+                else:
+                    unlink_if_exists(staging)
+                self._staged_files[path] = staging
+            return self._staged_files[path]
+
+    def _abspath_in_pack(self, relpath):
+        """Absolute path of **relpath** in pack, accounting for staging."""
+        for attr, root in (('_local', 'src/local'), ('_hub_local_src', 'hub/local/src')):
+            if relpath == root or relpath.startswith(root + '/'):
+                return os.path.join(getattr(self, attr), relpath[len(root) + 1:])
+        return os.path.join(self.abspath, relpath)
+
+    # Properties ---------------------------------------------------------------
+
     @property
     def is_incremental(self):
         """Is the pack incremental ? (vs. main)"""
@@ -366,12 +604,37 @@ class Pack(object):
         return os.path.exists(self.ics_path_for(program))
 
     def ics_build_for(self, program, silent=False,
-                      GMK_THREADS=32,
+                      GMK_THREADS=None,
                       Ofrt=4,
                       partition=None,
                       no_compilation=False,
                       no_libs_update=False):
-        """Build the 'ics_*' script for **program**."""
+        """
+        Build the 'ics_*' script for **program**.
+
+        :param GMK_THREADS: number of compilation threads; if None, planned
+            from the resources of the machine and the builds running from
+            the same HOMEPACK (cf. resources.plan_resources())
+        """
+        if GMK_THREADS is None:
+            from .resources import plan_homepack_resources
+            plan = plan_homepack_resources(self.homepack)
+            print(plan.report())
+            GMK_THREADS = plan.gmk_threads
+        with self.lock():
+            self._ics_build_for(program, silent=silent,
+                                GMK_THREADS=GMK_THREADS,
+                                Ofrt=Ofrt,
+                                partition=partition,
+                                no_compilation=no_compilation,
+                                no_libs_update=no_libs_update)
+
+    def _ics_build_for(self, program, silent=False,
+                       GMK_THREADS=32,
+                       Ofrt=4,
+                       partition=None,
+                       no_compilation=False,
+                       no_libs_update=False):
         args = self.genesis_arguments
         args.update({'-p':program.lower()})
         if os.path.exists(self.ics_path_for(program)):
@@ -380,10 +643,7 @@ class Pack(object):
         # build ics
         GmkpackTool.commandline(args, self.genesis_options, silent=silent)
         # modify number of threads
-        pattern = 'export GMK_THREADS=(\d+)'
-        self._ics_modify(program,
-                         re.compile(pattern),
-                         pattern.replace('(\d+)', str(GMK_THREADS)))
+        self.ics_set_threads(program, GMK_THREADS)
         # modify optimization level
         pattern = 'Ofrt=(\d)'
         self._ics_modify(program,
@@ -411,6 +671,19 @@ class Pack(object):
         if os.path.exists(self._ignore_at_compiletime_filepath):
             self.ics_ignore_files(program, self._ignore_at_compiletime_filepath)
 
+    def ics_set_threads(self, program, GMK_THREADS):
+        """Set the number of compilation threads in ics_program."""
+        pattern = 'export GMK_THREADS=(\d+)'
+        self._ics_modify(program,
+                         re.compile(pattern),
+                         pattern.replace('(\d+)', str(GMK_THREADS)))
+
+    def ics_threads(self, program):
+        """Number of compilation threads set in ics_program, or None."""
+        with io.open(self.ics_path_for(program), 'r') as f:
+            m = re.search('export GMK_THREADS=(\d+)', f.read())
+        return int(m.group(1)) if m else None
+
     def ics_ignore_files(self, program, list_of_files):
         """
         Add **list_of_files** to be ignored to ics_program.
@@ -419,7 +692,7 @@ class Pack(object):
             or a filename of a file containing the list of filenames
         """
 
-        if isinstance(list_of_files, six.string_types):  # filename of a file containing list of files to ignore
+        if isinstance(list_of_files, str):  # filename of a file containing list of files to ignore
             pattern = 'end_of_ignored_files'
             self._ics_insert(program, pattern,
                              ['cat {} >> $GMKWRKDIR/.ignored_files'.format(list_of_files)],
@@ -489,8 +762,11 @@ class Pack(object):
 
     def populate_from_tar(self, tar):
         """Populate the incremental pack with the contents of a **tar** file."""
-        with tarfile.open(tar, 'r') as t:
-            t.extractall(path=self._local)
+        with self.staged_population():
+            with tarfile.open(tar, 'r') as t:
+                t.extractall(path=self._local)
+        registry_update(self, populated=time.time(),
+                        source_type='tar', source_repository=os.path.abspath(tar))
 
     def populate_from_files_in_dir(self, list_of_files, directory):
         """
@@ -498,9 +774,13 @@ class Pack(object):
         from a given **directory**.
         """
         directory_abspath = os.path.abspath(directory)
-        with self._cd_local():
-            copy_files_in_cwd(list_of_files, directory_abspath)
+        with self.staged_population():
+            with self._cd_local():
+                copy_files_in_cwd(list_of_files, directory_abspath)
+        registry_update(self, populated=time.time(),
+                        source_type='dir', source_repository=directory_abspath)
 
+    @instrumented
     def populate_from_IALview_as_main(self, view,
                                       populate_filter_file=None,
                                       link_filter_file=None):
@@ -520,10 +800,12 @@ class Pack(object):
         """
         from .repositories import IALview
         assert isinstance(view, IALview)
-        self._populate_main_from_repo(view.repository,
-                                      populate_filter_file=populate_filter_file,
-                                      link_filter_file=link_filter_file)
-        self.write_view_info(view)
+        with self.staged_population():
+            self._populate_main_from_repo(view.repository,
+                                          populate_filter_file=populate_filter_file,
+                                          link_filter_file=link_filter_file)
+            self.write_view_info(view)
+        registry_update(self, populated=time.time(), **self._registry_view_fields(view))
 
     def populate_from_IALview_as_incremental(self, view, start_ref=None):
         """
@@ -532,51 +814,108 @@ class Pack(object):
         :param view: a IALview instance
         :param start_ref: increment of modification starts from this ref.
             If None, starts from latest official tagged ancestor.
+
+        Return the list of files populated in src/local (relative paths).
+        """
+        return self.populate_several_from_IALview_as_incremental([self], view,
+                                                                 start_ref=start_ref)
+
+    @staticmethod
+    @instrumented
+    def populate_several_from_IALview_as_incremental(packs, view,
+                                                     start_ref=None,
+                                                     threads=1):
+        """
+        Populate several incremental packs with contents from a same IALview.
+        Touched files are computed once, and each of them is read only once
+        for all packs.
+
+        :param packs: list of Pack instances
+        :param view: a IALview instance
+        :param start_ref: increment of modification starts from this ref.
+            If None, starts from latest official tagged ancestor.
+        :param threads: number of files to be copied in parallel
+
+        Return the list of files populated in src/local (relative paths).
         """
         from .repositories import IALview, GitError
         assert isinstance(view, IALview)
         if start_ref is None:
-            self._assert_IALview_compatibility(view)
+            for pack in packs:
+                pack._assert_IALview_compatibility(view)
             touched_files = view.touched_files_since_latest_official_tagged_ancestor
         else:
             touched_files = view.touched_files_since(start_ref)
         if len(view.git_proxy.touched_since_last_commit) > 0:
             print("! Note:  non-committed files in the view are exported to the pack.")
-        # files to be copied
-        files_to_copy = []
-        for k in ('A', 'M', 'T'):
-            files_to_copy.extend(list(touched_files.get(k, [])))
-        for k in ('R', 'C'):
-            files_to_copy.extend([f[1] for f in touched_files.get(k, [])])  # new name of renamed or copied files
-        self.populate_from_files_in_dir(files_to_copy, view.repository)
-        # files to be ignored/deleted
-        files_to_delete = list(touched_files.get('D', []))
-        files_to_delete.extend([f[0] for f in touched_files.get('R', [])])  # original name of renamed files
-        self.write_ignored_files_at_compiletime(files_to_delete)
         # files of unknown status
         for k in ('U', 'X', 'B'):
             if k in touched_files:
                 raise GitError("Don't know what to do with files which Git status is: " + k)
-        self.write_view_info(view)
+        info = io.StringIO()
+        view.info(out=info)
+        with ExitStack() as stack:
+            for pack in sorted(packs, key=lambda p: p.abspath):  # consistent locking order
+                stack.enter_context(pack.staged_population())
+            # files to be copied
+            files_to_copy = []
+            for k in ('A', 'M', 'T'):
+                files_to_copy.extend(list(touched_files.get(k, [])))
+            for k in ('R', 'C'):
+                files_to_copy.extend([f[1] for f in touched_files.get(k, [])])  # new name of renamed or copied files
+            copy_files_in_dirs(files_to_copy, os.path.abspath(view.repository),
+                               [pack._local for pack in packs],
+                               threads=threads)
+            # files to be ignored/deleted
+            files_to_delete = list(touched_files.get('D', []))
+            files_to_delete.extend([f[0] for f in touched_files.get('R', [])])  # original name of renamed files
+            for pack in packs:
+                pack.write_ignored_files_at_compiletime(files_to_delete)
+                pack._write_origin_info(info.getvalue())
+        view_fields = Pack._registry_view_fields(view, start_ref=start_ref)
+        for pack in packs:
+            registry_update(pack, populated=time.time(), **view_fields)
+        return files_to_copy
 
-    def populate_hub(self, latest_main_release):
+    @staticmethod
+    def _registry_view_fields(view, start_ref=None):
+        """Fields of the pack registry describing the source **view**."""
+        return {'source_type':'git',
+                'source_repository':view.repository,
+                'source_ref':view.ref,
+                'source_commit':view.git_proxy.latest_commit,
+                'start_ref':start_ref,
+                'bundle':None}
+
+    @instrumented
+    def populate_hub(self, latest_main_release, hub_cache=None):
         """
         Populate hub packages in main pack.
 
         WARNING: temporary solution before 'bundle' implementation !
+
+        :param hub_cache: a hubcache.HubCache: projects found built in it are
+            linked instead of populated (and hence not built)
         """
         from .config import GMKPACK_HUB_PACKAGES
         from .util import host_name
         msg = "Populating vendor packages in pack's hub:"
         print(msg + "\n" + "-" * len(msg))
-        for package, properties in GMKPACK_HUB_PACKAGES.items():
-            rootdir = properties[host_name()]
-            version = properties[latest_main_release]
-            project = properties['project']
-            print("Package: '{}/{}' (v{}) from {}".format(project, package, version, rootdir))
-            pkg_src = os.path.join(rootdir, package, version)
-            pkg_dst = os.path.join(self._hub_local_src, project, package)
-            shutil.copytree(pkg_src, pkg_dst, symlinks=True)
+        cached = set()
+        if hub_cache is not None:
+            cached = hub_cache.link_into(self, {package:(properties['project'], properties[latest_main_release])
+                                                for package, properties in GMKPACK_HUB_PACKAGES.items()})
+        with self.staged_population():
+            for package, properties in GMKPACK_HUB_PACKAGES.items():
+                rootdir = properties[host_name()]
+                version = properties[latest_main_release]
+                project = properties['project']
+                if project in cached:
+                    continue
+                print("Package: '{}/{}' (v{}) from {}".format(project, package, version, rootdir))
+                pkg_src = os.path.join(rootdir, package, version)
+                pkg_dst = os.path.join(self._hub_local_src, project, package)
+                shutil.copytree(pkg_src, pkg_dst, symlinks=True, copy_function=copy2_counted)
         print("-" * len(msg))
 
     @property
@@ -586,10 +925,18 @@ class Pack(object):
 
     def write_view_info(self, view):  # DEPRECATED:migrate to bundle
         """Write view.info into self.origin_filepath."""
-        openmode = 'a' if os.path.exists(self.origin_filepath) else 'w'
-        with io.open(self.origin_filepath, openmode) as f:
+        origin_filepath = self._staged_file(self.origin_filepath)
+        openmode = 'a' if os.path.exists(origin_filepath) else 'w'
+        with io.open(origin_filepath, openmode) as f:
             view.info(out=f)
 
+    def _write_origin_info(self, info):
+        """Write already rendered **info** into self.origin_filepath."""
+        origin_filepath = self._staged_file(self.origin_filepath)
+        openmode = 'a' if os.path.exists(origin_filepath) else 'w'
+        with io.open(origin_filepath, openmode) as f:
+            f.write(info)
+
     def _assert_IALview_compatibility(self, view):  # DEPRECATED:migrate to bundle
         """Assert that view and pack have the same original node (ancestor)."""
         branch_ancestor_info = view.latest_official_branch_from_main_release
@@ -610,11 +957,13 @@ class Pack(object):
 
     # Populate from bundle -----------------------------------------------------
 
+    @instrumented
     def bundle_populate_mainpack(self,
                                  cache_dir,
                                  bundle_info,
                                  populate_filter_file=None,
-                                 link_filter_file=None):
+                                 link_filter_file=None,
+                                 hub_cache=None):
         """
         Populate src/local in main pack from bundle.
 
@@ -632,28 +981,60 @@ class Pack(object):
             Special values:
             '__inconfig__' will read according file in config of ial_build package;
             '__inrepo__' will read according file in Git repo
+        :param hub_cache: a hubcache.HubCache: hub projects found built in it
+            are linked instead of populated (and hence not built)
         """
-        # hub packages
-        self._bundle_populate_hub(cache_dir, bundle_info)
-        # src/local
-        msg = "Populating components in pack's src/local:"
-        print("\n" + msg + "\n" + "-" * len(msg))
-        for component, properties in bundle_info.items():
-            pkg_dst = self._bundle_component_destination(component, properties)
-            if pkg_dst.startswith('src/local'):
-                repository = os.path.join(cache_dir, component)
+        with self.staged_population():
+            # hub packages
+            self._bundle_populate_hub(cache_dir, bundle_info, hub_cache=hub_cache)
+            # src/local
+            msg = "Populating components in pack's src/local:"
+            print("\n" + msg + "\n" + "-" * len(msg))
+            for component, properties in bundle_info.items():
+                pkg_dst = self._bundle_component_destination(component, properties)
+                if pkg_dst.startswith('src/local'):
+                    self.bundle_populate_component(cache_dir, component, properties,
+                                                   populate_filter_file=populate_filter_file,
+                                                   link_filter_file=link_filter_file)
+            # log in pack
+            self._bundle_write_properties(bundle_info)
+
+    @instrumented
+    def bundle_populate_component(self,
+                                  cache_dir,
+                                  component,
+                                  properties,
+                                  populate_filter_file=None,
+                                  link_filter_file=None):
+        """
+        Populate a single component of a bundle in main pack, in hub or
+        src/local according to its destination.
+
+        :param cache_dir: directory in which to find the cached bundled repositories.
+        :param component: name of the component
+        :param properties: dict of properties concerning the repository of the
+            component, as read in the bundle file.
+
+        Cf. bundle_populate_mainpack() for other arguments.
+        """
+        pkg_dst = self._bundle_component_destination(component, properties)
+        repository = os.path.join(cache_dir, component)
+        version = properties['version']
+        remote = properties['git']
+        with self.staged_population():
+            if pkg_dst.startswith('hub'):
+                pkg_dst = os.path.join(self._abspath_in_pack(pkg_dst), component)
+                print("Package: '{}' (v{}) from repo: {} via cache: {}".format(component, version, remote, repository))
+                shutil.copytree(repository, pkg_dst, symlinks=True, copy_function=copy2_counted)
+            else:
                 subdir = properties.get('copy_to_subdirectory', None)
-                version = properties['version']
-                remote = properties['git']
                 print("Component: '{}' ({}) from repo: {} via cache: {}".format(component, version, remote, repository))
                 self._populate_main_from_repo(repository,
                                               subdir=subdir,
                                               populate_filter_file=populate_filter_file,
                                               link_filter_file=link_filter_file)
-        # log in pack
-        self._bundle_write_properties(bundle_info)
 
-    def _bundle_populate_hub(self, cache_dir, bundle_info):
+    def _bundle_populate_hub(self, cache_dir, bundle_info, hub_cache=None):
         """
         Populate hub packages in main pack from bundle in cache_dir.
 
@@ -661,18 +1042,39 @@ class Pack(object):
         :param bundle_info: a dict(package:{info}}, where {info} is the dict of
             properties concerning the repository of each package,
             as read in the bundle file.
+        :param hub_cache: a hubcache.HubCache: projects found built in it are
+            linked instead of populated
         """
         msg = "Populating vendor packages in pack's hub:"
         print("\n" + msg + "\n" + "-" * len(msg))
+        cached = self.bundle_hub_from_cache(bundle_info, hub_cache, cache_dir=cache_dir)
+        for package, properties in bundle_info.items():
+            pkg_dst = self._bundle_component_destination(package, properties)
+            if pkg_dst.startswith('hub') and os.path.basename(pkg_dst) not in cached:
+                self.bundle_populate_component(cache_dir, package, properties)
+
+    def bundle_hub_from_cache(self, bundle_info, hub_cache=None, cache_dir=None):
+        """
+        Link in the pack the hub projects of **bundle_info** found built in
+        **hub_cache** (a hubcache.HubCache). Return the set of such projects,
+        the packages of which are not to be populated.
+
+        Packages are looked for by commit: as pinned in **bundle_info**
+        (lockfile), else as their version resolves to in **cache_dir** if it
+        is a tag (cf. hubcache.pinned_version()).
+        """
+        if hub_cache is None:
+            return set()
+        from .hubcache import pinned_version
+        packages = {}
         for package, properties in bundle_info.items():
             pkg_dst = self._bundle_component_destination(package, properties)
             if pkg_dst.startswith('hub'):
-                pkg_src = os.path.join(cache_dir, package)
-                pkg_dst = os.path.join(self.abspath, pkg_dst, package)
-                version = properties['version']
-                remote = properties['git']
-                print("Package: '{}' (v{}) from repo: {} via cache: {}".format(package, version, remote, pkg_src))
-                shutil.copytree(pkg_src, pkg_dst, symlinks=True)
+                repository = None if cache_dir is None else os.path.join(cache_dir, package)
+                packages[package] = (os.path.basename(pkg_dst.rstrip('/')),
+                                     pinned_version(properties['version'], repository=repository,
+                                                    commit=properties.get('commit')))
+        return hub_cache.link_into(self, packages)
 
     def _bundle_component_destination(self, component, properties):
         """
@@ -715,7 +1117,7 @@ class Pack(object):
                     subproject = DirectoryFiltering(f_src, pop_filter_list)
                     subproject.copytree(f_dst, symlinks=True)  # TODO: rsync instead, to recompile only modified files
                 else:
-                    shutil.copy(f_src, f_dst)  # single file
+                    copy_counted(f_src, f_dst)  # single file
         # link filter
         link_filter_list = self._read_filter_list('link',
                                                   link_filter_file,
@@ -724,13 +1126,26 @@ class Pack(object):
 
     def _bundle_write_properties(self, bundle_info):
         """Write info into self.origin_filepath."""
-        openmode = 'a' if os.path.exists(self.origin_filepath) else 'w'
-        with io.open(self.origin_filepath, openmode) as f:
+        origin_filepath = self._staged_file(self.origin_filepath)
+        openmode = 'a' if os.path.exists(origin_filepath) else 'w'
+        with io.open(origin_filepath, openmode) as f:
             f.write("\n{} --- populate from bundle successful with:\n".format(now()))
             for component, properties in bundle_info.items():
                 f.write("* {}\n".format(component))
                 f.write("    version: {}\n".format(properties['version']))
+                if properties.get('commit'):
+                    f.write("    commit: {}\n".format(properties['commit']))
                 f.write("    from remote git: {}\n".format(properties['git']))
+        bundle = {c:{'version':str(p['version']), 'commit':p.get('commit')}
+                  for c, p in bundle_info.items()}
+        main = bundle.get('arpifs', bundle.get('ial', {}))
+        registry_update(self, populated=time.time(),
+                        source_type='bundle',
+                        source_repository=None,
+                        source_ref=main.get('version'),
+                        source_commit=main.get('commit'),
+                        start_ref=None,
+                        bundle=bundle)
 
     # Filters ------------------------------------------------------------------
 
@@ -781,27 +1196,120 @@ class Pack(object):
             filter_list = []
         return filter_list
 
-    def set_ignored_files_at_linktime(self, list_of_ignored_symbols):
-        """Set symbols to be ignored in src/unsxref/verbose."""
-        if isinstance(list_of_ignored_symbols, six.string_types):
+    @property
+    def _ignore_at_linktime_dirpath(self):
+        """Directory in which stubs of symbols to be ignored at link time are."""
+        return os.path.join(self.abspath, 'src', 'unsxref', 'verbose')
+
+    def ignored_symbols_at_linktime_diff(self, list_of_ignored_symbols):
+        """
+        Compare the current stubs in src/unsxref/verbose to the desired
+        **list_of_ignored_symbols**.
+
+        Return a dict {'missing':[...], 'stale':[...]}.
+        """
+        dirpath = self._ignore_at_linktime_dirpath
+        current = set(os.listdir(dirpath)) if os.path.isdir(dirpath) else set()
+        desired = set(list_of_ignored_symbols)
+        return {'missing':sorted(desired - current),
+                'stale':sorted(current - desired)}
+
+    def set_ignored_files_at_linktime(self, list_of_ignored_symbols,
+                                      remove_stale=False,
+                                      mtime=None):
+        """
+        Set symbols to be ignored in src/unsxref/verbose.
+
+        The directory is created if missing, and the stubs are created in a
+        batch relatively to a directory file descriptor.
+
+        :param list_of_ignored_symbols: a list of symbols,
+            or a filename of a file containing the list of symbols
+        :param remove_stale: remove the stubs which are not in
+            **list_of_ignored_symbols**
+        :param mtime: if given, modification time to be set on the stubs,
+            created or already existing (else, existing stubs are left
+            untouched, and new ones created with the current time)
+
+        Return a summary dict {'created':n, 'touched':n, 'skipped':n, 'removed':n}.
+        """
+        if isinstance(list_of_ignored_symbols, str):
             with io.open(list_of_ignored_symbols, 'r') as f:
-                list_of_ignored_symbols = [l.strip() for l in f.readlines()]
-        for s in list_of_ignored_symbols:
-            symbol_path = os.path.join(self.abspath, 'src', 'unsxref', 'verbose', s)
-            with io.open(symbol_path, 'a'):
-                os.utime(symbol_path, None)
+                list_of_ignored_symbols = [l.strip() for l in f.readlines()
+                                           if l.strip() != '']
+        dirpath = self._ignore_at_linktime_dirpath
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        summary = {'created':0, 'touched':0, 'skipped':0, 'removed':0}
+        # relatively to a directory file descriptor where supported (python3), else to the path
+        if set([os.open, os.utime, os.unlink]).issubset(getattr(os, 'supports_dir_fd', set())):
+            dir_fd = os.open(dirpath, os.O_RDONLY)
+            where = lambda s: s
+            at = {'dir_fd':dir_fd}
+        else:
+            dir_fd = None
+            where = lambda s: os.path.join(dirpath, s)
+            at = {}
+        try:
+            existing = set(os.listdir(dirpath if dir_fd is None else dir_fd))
+            for s in set(list_of_ignored_symbols):
+                if s in existing:
+                    if mtime is None:
+                        summary['skipped'] += 1
+                        continue
+                    summary['touched'] += 1
+                else:
+                    os.close(os.open(where(s), os.O_WRONLY | os.O_CREAT, 0o644, **at))
+                    summary['created'] += 1
+                    if mtime is None:
+                        continue
+                os.utime(where(s), (mtime, mtime), **at)
+            if remove_stale:
+                for s in existing.difference(list_of_ignored_symbols):
+                    os.unlink(where(s), **at)
+                    summary['removed'] += 1
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+        print("Symbols ignored at link time: {created} created, {touched} touched, "
+              "{skipped} skipped, {removed} removed.".format(**summary))
+        return summary
 
     def write_ignored_files_at_compiletime(self, list_of_files):
         """Write files to be ignored in a dedicated file."""
-        if isinstance(list_of_files, six.string_types):  # already a file containing filenames: copy
-            shutil.copyfile(list_of_files, self._ignore_at_compiletime_filepath)
+        ignore_filepath = self._staged_file(self._ignore_at_compiletime_filepath)
+        if isinstance(list_of_files, str):  # already a file containing filenames: copy
+            shutil.copyfile(list_of_files, ignore_filepath)
         else:
-            with io.open(self._ignore_at_compiletime_filepath, 'w') as f:  # a python list
+            with io.open(ignore_filepath, 'w') as f:  # a python list
                 for l in list_of_files:
                     f.write(l + '\n')
         if 'ics_' in self.ics_available:
             self.ics_ignore_files('', self._ignore_at_compiletime_filepath)
 
+    def update_ignored_files_at_compiletime(self, add=(), remove=()):
+        """
+        Add files to / remove files from those to be ignored at compilation
+        time, keeping the ics_ script referring to the list only once.
+        Return the updated list.
+        """
+        ignore_filepath = self._staged_file(self._ignore_at_compiletime_filepath)
+        ignored = []
+        if os.path.exists(ignore_filepath):
+            with io.open(ignore_filepath, 'r') as f:
+                ignored = [l.strip() for l in f.readlines() if l.strip() != '']
+        updated = [f for f in ignored if f not in set(remove)]
+        updated.extend([f for f in add if f not in set(updated)])
+        if updated != ignored:
+            with io.open(ignore_filepath, 'w') as f:
+                for l in updated:
+                    f.write(l + '\n')
+        if 'ics_' in self.ics_available:
+            reference = 'cat {} >> $GMKWRKDIR/.ignored_files'.format(self._ignore_at_compiletime_filepath)
+            if reference not in self._ics_read(''):
+                self.ics_ignore_files('', self._ignore_at_compiletime_filepath)
+        return updated
+
     # From pack to branch -------------------------------------------------------
     @property
     def _packname2branchname(self):
@@ -848,7 +1356,7 @@ class Pack(object):
         if branchname is None:
             branchname = self._packname2branchname
         touched_files = self.scanpack()
-        if isinstance(files_to_delete, six.string_types):
+        if isinstance(files_to_delete, str):
             with io.open(files_to_delete, 'r') as f:
                 files_to_delete = [file.strip() for file in f.readlines()]
         # printings
@@ -870,7 +1378,7 @@ class Pack(object):
         if commit_message is not None:
             print("And commit with message: '{}'".format(commit_message))
         if ask_confirmation:
-            ok = six.moves.input("Everything OK ? [y/n] ")
+            ok = input("Everything OK ? [y/n] ")
             if ok == 'n':
                 print("Confirmation cancelled: exit.")
                 exit()
@@ -907,22 +1415,180 @@ class Pack(object):
 
     @property
     def available_executables(self):
-        """Lists the available executables."""
-        return sorted(os.listdir(self._bin))
+        """Lists the available executables (from the inventory)."""
+        return sorted(self.executables_inventory().keys())
+
+    def executable_ok(self, program, run_id=None):
+        """
+        Check that **program** executable has been made;
+        if **run_id** is given, that it has been (re)built by this ics_ run.
+        """
+        inventory = self.executables_inventory()
+        for name in (program.lower(), program.upper()):
+            entry = inventory.get(name)
+            if entry is not None and (run_id is None or entry['run_id'] == run_id):
+                return True
+        return False
+
+    @property
+    def _executables_inventory_filepath(self):
+        """Inventory of executables in bin/: mtime, size, build-id, producing ics_ run."""
+        return os.path.join(self.abspath, '.pygmkpack.executables.json')
+
+    def executables_inventory(self):
+        """
+        Inventory of executables, as a dict {name:{mtime_ns, size, build_id,
+        sha256, run_id, program}}. Initialized from bin/ if missing, and
+        refreshed if bin/ does not match it anymore (executables rebuilt or
+        removed outside compile(), e.g. by hand).
+        """
+        inventory = self._executables_inventory_read()
+        if inventory is None:
+            if os.path.isdir(self._bin):
+                return self.refresh_executables_inventory()
+            return {}
+        # inodes are not compared: executables of a cloned pack are copies
+        snapshot = {name:[s[0], s[1]] for name, s in self._bin_snapshot().items()}
+        if snapshot != {name:[e.get('mtime_ns'), e.get('size')] for name, e in inventory.items()}:
+            inventory = self.refresh_executables_inventory()
+        return inventory
+
+    def _executables_inventory_read(self):
+        """Inventory of executables as written in the pack, or None if missing."""
+        try:
+            with io.open(self._executables_inventory_filepath, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return None
+
+    def _bin_snapshot(self):
+        """Signature (mtime, size, inode) of files in bin/."""
+        snapshot = {}
+        if os.path.isdir(self._bin):
+            for entry in os.scandir(self._bin):
+                if entry.is_file():
+                    st = entry.stat()
+                    snapshot[entry.name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return snapshot
+
+    def _executables_inventory_write(self, inventory):
+        tmp = self._executables_inventory_filepath + '.tmp'
+        with io.open(tmp, 'w') as f:
+            f.write(json.dumps(inventory, indent=2, sort_keys=True))
+        os.rename(tmp, self._executables_inventory_filepath)
+
+    def refresh_executables_inventory(self, before=None, run_id=None, program=None, write=True):
+        """
+        Update the inventory from bin/: executables that changed (vs. the
+        **before** snapshot if given, vs. the inventory otherwise) are
+        (re)recorded, as produced by ics_ **run_id** for **program**;
+        disappeared ones are forgotten.
+
+        :param write: write the updated inventory in the pack (else, the pack
+            is left untouched, e.g. when only scanned)
 
-    def executable_ok(self, program):
-        """Check that **program** executable has been made."""
-        bins = os.listdir(self._bin)
-        return program.lower() in bins or program.upper() in bins
+        Return the inventory.
+        """
+        inventory = self._executables_inventory_read() or {}
+        after = self._bin_snapshot()
+        for name in list(inventory.keys()):
+            if name not in after:
+                del inventory[name]
+        for name, signature in after.items():
+            if before is not None:
+                changed = before.get(name) != signature
+            else:
+                entry = inventory.get(name, {})
+                changed = [entry.get('mtime_ns'), entry.get('size'), entry.get('inode')] != list(signature)
+            if changed:
+                path = os.path.join(self._bin, name)
+                build_id = elf_build_id(path)
+                inventory[name] = {'mtime_ns':signature[0],
+                                   'size':signature[1],
+                                   'inode':signature[2],
+                                   'build_id':build_id,
+                                   'sha256':file_sha256(path) if build_id is None else None,
+                                   'run_id':run_id,
+                                   'program':program}
+        if write:
+            self._executables_inventory_write(inventory)
+        return inventory
 
     # Compilation --------------------------------------------------------------
 
-    def compile(self, program, silent=False, clean_before=False, fatal=True):
-        """Run interactively the ics_ compilation script for **program**"""
+    def compile(self, program, silent=False, clean_before=False, fatal=True,
+                abort_on_fatal=False, max_errors=None, object_cache=None,
+                register_build=True):
+        """
+        Run interactively the ics_ compilation script for **program**.
+        The pack is locked while cleaned/seeded before compilation, and while
+        its stamps are written after, not during the compilation itself
+        (populations may go on meanwhile: sources modified after the start of
+        the compilation are then considered stale by selective_clean()).
+
+        If **clean_before** is '__selective__', only stale .o & .mod are
+        removed beforehand (cf. selective_clean()), else if True, all of them.
+
+        The output is parsed while streamed, errors being reported in the
+        'Errors' entry of the returned report. If **silent**, the compilation
+        is also profiled from its log (cf. profiling module): the summary of
+        the profile is in the 'profile' entry of the report, and appended to
+        the history of profiles of the pack.
+
+        :param abort_on_fatal: abort the build at the first fatal error
+            (aborted compilation, failed link)
+        :param max_errors: if not None, abort the build after that many errors
+        :param object_cache: an objcache.ObjectCache, from which to seed
+            objects & modules of src/local before compilation, and in which to
+            harvest the newly compiled ones after a successful one (statistics
+            in the 'object_cache' entry of the report)
+        :param register_build: record the build status of this compilation
+            in the pack registry (pack_build_executables() records that of
+            its whole build instead)
+        """
+        try:
+            report = self._compile(program, silent=silent, clean_before=clean_before, fatal=fatal,
+                                   abort_on_fatal=abort_on_fatal, max_errors=max_errors,
+                                   object_cache=object_cache)
+        except Exception:
+            if register_build:
+                self._registry_update_build('failed')
+            raise
+        if register_build:
+            self._registry_update_build('OK' if report['OK'] else 'failed')
+        return report
+
+    def _registry_update_build(self, status):
+        inventory = self.executables_inventory()
+        registry_update(self, build_status=status, built=time.time(),
+                        binaries=sorted(inventory.keys()),
+                        executables=inventory)
+
+    def _compile(self, program, silent=False, clean_before=False, fatal=True,
+                 abort_on_fatal=False, max_errors=None, object_cache=None):
         assert os.path.exists(self.ics_path_for(program))
         cmd = [self.ics_path_for(program),]
-        if clean_before:
-            self.cleanpack()
+        if not clean_before and os.path.exists(self._hardlinked_stamp):
+            print("Build products hard linked with other pack(s): selective clean first (not to overwrite them).")
+            clean_before = '__selective__'
+        elif not clean_before and os.path.exists(self._cloned_stamp):
+            print("Cloned pack: selective clean first (products of sources changed or removed since the origin).")
+            clean_before = '__selective__'
+        cached = None
+        with self.lock():  # e.g. vs. a population in progress
+            if clean_before == '__selective__':
+                self.selective_clean()
+            elif clean_before:
+                self.cleanpack()
+            if object_cache is not None:
+                from .objcache import CachedCompilation
+                cached = CachedCompilation(object_cache, self)
+                cached.seed()
+            run_start = time.time()
+        run_id = '.'.join([program.lower() or '_', now().stdvortex, uuid.uuid4().hex[:8]])
+        before = self._bin_snapshot()
+        monitor = CompileMonitor(abort_on_fatal=abort_on_fatal, max_errors=max_errors)
+        profile = None
         try:
             if silent:
                 logdir = os.path.join(self.abspath, 'log')
@@ -936,32 +1602,103 @@ class Pack(object):
                     outname = os.path.join(logdir,
                                            '.'.join([program.lower(),
                                                      now().stdvortex]))
-                with io.open(outname, 'w') as f:
-                    ok = subprocess.check_call(cmd, stdout=f, stderr=f)
+                timer = LineTimer(outname + TIMES_SUFFIX)
+
+                def on_line(line):
+                    timer(line)
+                    return monitor(line)
+                try:
+                    with io.open(outname, 'w') as f:
+                        ok = runner.stream(cmd, on_line=on_line, tee=f)
+                finally:
+                    timer.close()
+                profile = self._record_compile_profile(program, outname, run_id)
             else:
                 outname = None
-                ok = subprocess.check_call(cmd)
+                ok = runner.stream(cmd, on_line=monitor, tee=sys.stdout)
         except Exception:
+            self.refresh_executables_inventory(before=before, run_id=run_id, program=program)
             if fatal:
+                self._print_compile_errors(monitor)
                 raise
             else:
                 ok = False
         else:
-            ok = True if int(ok) == 0 else False
-            if program != '':
-                ok = self.executable_ok(program)
+            self.refresh_executables_inventory(before=before, run_id=run_id, program=program)
+            ok = True if int(ok) == 0 and not monitor.aborted else False
+            if program != '' and not monitor.aborted:
+                ok = self.executable_ok(program, run_id=run_id)  # rebuilt by this run
+            if ok:
+                with self.lock():
+                    self._write_compiled_stamp(run_start)
+                    if program == '':
+                        from .hubcache import HubCache
+                        HubCache.harvest(self)
+                    if cached is not None:
+                        cached.harvest(run_start)
             if fatal and not ok:
                 if program == '':
                     message = "Compilation failed."
                 else:
                     message = "Build of {} failed.".format(program)
+                if monitor.aborted:
+                    message += " Aborted after {} error(s).".format(len(monitor.errors))
                 if outname is not None:
                     message += " Output: " + outname
+                self._print_compile_errors(monitor)
                 raise PackError(message)
         report = {'OK':ok,
-                  'Output':outname}
+                  'Output':outname,
+                  'run_id':run_id,
+                  'Errors':monitor.errors,
+                  'Aborted':monitor.aborted}
+        if cached is not None:
+            report['object_cache'] = cached.stats
+        if profile is not None:
+            report['profile'] = profile
         return report
 
+    def _record_compile_profile(self, program, log, run_id):
+        """Profile compilation **log**, and record it in the history of profiles of the pack."""
+        try:
+            profile = CompileProfile.from_log(log, threads=self.ics_threads(program))
+            if profile is None:
+                return None
+            return record_profile(self, profile, run_id=run_id, program=program)
+        except Exception as e:  # profiling must not break a build
+            print("! Warning: unable to profile compilation: {}".format(e))
+            return None
+
+    def compile_profile(self, log=None):
+        """
+        Profile of a compilation **log** of the pack (default: the latest one),
+        or None if not available (cf. profiling.CompileProfile).
+        """
+        if log is None:
+            logdir = os.path.join(self.abspath, 'log')
+            logs = [os.path.join(logdir, f) for f in os.listdir(logdir)
+                    if not f.endswith(TIMES_SUFFIX)] if os.path.isdir(logdir) else []
+            if not logs:
+                return None
+            log = max(logs, key=os.path.getmtime)
+        program = os.path.basename(log).split('.')[0]
+        program = '' if program == '_' else program
+        threads = self.ics_threads(program) if self.ics_available_for(program) else None
+        return CompileProfile.from_log(log, threads=threads)
+
+    def compile_profile_history(self):
+        """History of the summaries of the compilation profiles of the pack."""
+        return profile_history(self)
+
+    @staticmethod
+    def _print_compile_errors(monitor, maximum=20):
+        if monitor.errors:
+            print("Errors ({}):".format(len(monitor.errors)))
+            for e in monitor.errors[:maximum]:
+                print("  " + monitor.format_error(e))
+            if len(monitor.errors) > maximum:
+                print("  ...")
+
     def compile_all_programs(self, silent=False):
         """Run interactively the ics_ compilation script for **program**"""
         for program in [s.replace('ics_', '') for s in self.ics_available]:
@@ -983,13 +1720,146 @@ class Pack(object):
     def scanpack(self):
         """List the modified files (present in local directory)."""
         files = [f.strip()
-                 for f in subprocess.check_output(['scanpack'], cwd=self._local).decode('utf-8').split('\n')
+                 for f in runner.check_output(['scanpack'], cwd=self._local).decode('utf-8').split('\n')
                  if f != '']
         return files
 
+    @instrumented
     def cleanpack(self):
         """Clean .o & .mod."""
-        subprocess.check_call(['cleanpack', '-f'], cwd=self.abspath)
+        with self.lock():
+            runner.check_call(['cleanpack', '-f'], cwd=self.abspath)
+
+    @property
+    def _compiled_stamp(self):
+        """Stamp file of the latest successful compilation."""
+        return os.path.join(self.abspath, '.pygmkpack.compiled')
+
+    def _write_compiled_stamp(self, start):
+        """
+        Record **start** time of a successful compilation, as mtime of the
+        stamp, along with the module dependency graph of the sources, as
+        reference state for the next selective_clean().
+        """
+        try:
+            self.dependency_graph()
+        except Exception as e:  # only makes the next selective clean less selective
+            print("! Warning: unable to save the dependency graph of the pack: {}".format(e))
+        with io.open(self._compiled_stamp, 'w') as f:
+            f.write(json.dumps({'start':start}))
+        os.utime(self._compiled_stamp, (start, start))
+
+    def stale_objects(self, graph=None):
+        """
+        Compute the objects (.o) and module files (.mod) of src/local made
+        stale by the sources touched since the latest successful compilation,
+        according to the module dependency graph of the pack.
+
+        Return a dict {'touched', 'impacted', 'objects', 'modules', 'outside_local'},
+        or None if the pack has never been successfully compiled.
+        """
+        if not os.path.exists(self._compiled_stamp):
+            return None
+        from .dependencies import DependencyGraph, is_compilation_unit
+        since_ns = os.stat(self._compiled_stamp).st_mtime_ns
+        if graph is None:
+            graph = DependencyGraph(self.source_views,
+                                    cache_file=os.path.join(self.abspath, '.pygmkpack.dependencies.json'))
+        previous = graph.load().files
+        graph.scan()
+        touched = set()
+        for relpath, entry in graph.files.items():
+            before = previous.get(relpath)
+            if (entry['mtime_ns'] > since_ns or before is None or
+                (before['path'], before['size'], before['mtime_ns']) !=
+                (entry['path'], entry['size'], entry['mtime_ns'])):
+                touched.add(relpath)
+        # removed or reverted files impact their dependents, as of the previous graph
+        deleted = set([relpath for relpath, before in previous.items()
+                       if relpath not in graph.files or before['path'] != graph.files[relpath]['path']])
+        impacted = set(graph.impacted(sorted(touched)))
+        if deleted:
+            previous_graph = DependencyGraph(graph.roots)
+            previous_graph.files = previous
+            impacted.update(previous_graph.impacted(sorted(deleted)))
+        # objects and modules to be removed, in src/local
+        modules = set()
+        for relpath in impacted:
+            for source in (graph.files.get(relpath), previous.get(relpath)):
+                if source is not None:
+                    modules.update(source['modules'])
+        for relpath in deleted:
+            modules.update(previous[relpath]['modules'])
+        objects = []
+        mods = []
+        outside_local = []
+        for dirpath, _, filenames in os.walk(self._local):
+            for f in filenames:
+                stem, ext = os.path.splitext(f)
+                if ext == '.mod' and stem.lower() in modules:
+                    mods.append(os.path.join(dirpath, f))
+        local = os.path.join(self._local, '')
+        for relpath in sorted(impacted | set([d for d in deleted if is_compilation_unit(d)])):
+            obj = os.path.join(self._local, os.path.splitext(relpath)[0] + '.o')
+            if os.path.exists(obj):
+                objects.append(obj)
+            elif relpath in graph.files and not graph.files[relpath]['path'].startswith(local):
+                outside_local.append(relpath)
+        return {'touched':sorted(touched | deleted),
+                'impacted':sorted(impacted),
+                'objects':objects,
+                'modules':sorted(mods),
+                'outside_local':outside_local}
+
+    @instrumented
+    def selective_clean(self):
+        """
+        Remove only the .o & .mod made stale by the sources touched since the
+        latest successful compilation (cf. stale_objects()), so that the
+        incremental compilation redoes the minimal work.
+        Falls back on a full cleanpack if the pack has never been compiled.
+        """
+        with self.lock():
+            stale = self.stale_objects()
+            if stale is None:
+                print("Selective clean: no previous successful compilation, full cleanpack.")
+                self.cleanpack()
+                return
+            for f in stale['objects'] + stale['modules']:
+                unlink_if_exists(f)
+            print("Selective clean: {} touched file(s) impacting {} compilation unit(s): removed {} .o and {} .mod".format(
+                len(stale['touched']), len(stale['impacted']), len(stale['objects']), len(stale['modules'])))
+            if stale['outside_local']:
+                print("! Note: {} impacted unit(s) not in src/local are not recompiled by gmkpack, e.g.: {}".format(
+                    len(stale['outside_local']), stale['outside_local'][:5]))
+            return stale
+
+    @property
+    def source_views(self):
+        """
+        Source directories of the pack (src/local, src/inter.*, src/main...),
+        by decreasing priority, as listed in .gmkview if available.
+        """
+        src = os.path.join(self.abspath, 'src')
+        gmkview = os.path.join(self.abspath, '.gmkview')
+        if os.path.exists(gmkview):
+            with io.open(gmkview, 'r') as f:
+                views = [v.strip() for v in f.readlines() if v.strip() != '']
+        else:
+            views = ['local'] + sorted([v for v in os.listdir(src)
+                                        if v not in ('local', 'unsxref') and not v.startswith('.')])
+        return [os.path.join(src, v) for v in views if os.path.isdir(os.path.join(src, v))]
+
+    def dependency_graph(self, threads=8):
+        """
+        Scan the sources of the pack (all views, local first) into a
+        dependencies.DependencyGraph, cached in the pack.
+        """
+        from .dependencies import DependencyGraph
+        graph = DependencyGraph(self.source_views,
+                                cache_file=os.path.join(self.abspath, '.pygmkpack.dependencies.json'),
+                                threads=threads)
+        return graph.scan()
 
     def local2tar(self, tar_filename=None):
         """Extract the contents of the pack to a tarfile."""
@@ -1002,8 +1872,252 @@ class Pack(object):
                     t.add(f)
         return tar_filename
 
+    # Clone --------------------------------------------------------------------
+
+    #: Extensions of build products, reflinked or hard linked by clone()
+    _build_products_ext = ('.o', '.mod', '.smod', '.a', '.so')
+    #: Directories of build products, reflinked or hard linked by clone()
+    _build_products_dirs = ('bin', 'lib')
+    #: Not cloned: logs and profiles of the origin, population in progress
+    _clone_skipped = ('log', '.pygmkpack.compile_profiles.jsonl', '.pygmkpack.swap',
+                      '.pygmkpack.cloned', '.pygmkpack.hardlinked')
+
+    @property
+    def _cloned_stamp(self):
+        """Description of the origin of a cloned pack."""
+        return os.path.join(self.abspath, '.pygmkpack.cloned')
+
+    @property
+    def _hardlinked_stamp(self):
+        """Marker: build products of the pack are hard linked with other packs."""
+        return os.path.join(self.abspath, '.pygmkpack.hardlinked')
+
+    @instrumented
+    def clone(self, packname, homepack=None, link='auto'):
+        """
+        Clone the pack as **packname**, for an incremental compilation of a
+        variant: sources and scripts are copied (.genesis, ics_ scripts and
+        symlinks rewritten for the new location), build products (objects,
+        modules, libs, executables) are reflinked (copy-on-write) or hard linked.
+
+        Compilations of the clone start by a selective clean (cf.
+        selective_clean()), so that the products made stale by its population
+        (sources modified or removed since the origin) are removed. Hard
+        linked products are shared with the original pack: compilations of
+        the latter then also start by a selective clean, so that stale
+        products are removed rather than overwritten in place.
+
+        :param homepack: home of the clone (defaults to the one of this pack)
+        :param link: how build products are cloned: 'reflink' (falling back
+            on copies if not supported), 'hardlink', or 'auto' (reflink,
+            falling back on hard links)
+
+        Return the cloned Pack.
+        """
+        assert link in ('auto', 'reflink', 'hardlink')
+        clone = Pack(packname, preexisting=False, homepack=self.homepack if homepack is None else homepack)
+        print("Clone pack: {} -> {}".format(self.abspath, clone.abspath))
+        with self.lock(), clone.lock():
+            if os.path.exists(clone.abspath):
+                raise PackError('Pack already exists, cannot clone into: {}'.format(clone.abspath))
+            tmp = os.path.join(clone.homepack, '.{}.clone.{}'.format(packname, uuid.uuid4().hex[:8]))
+            try:
+                stats = self._clone_tree(tmp, clone, link)
+                os.rename(tmp, clone.abspath)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            # executables have new inodes, if not hard linked
+            inventory = clone._executables_inventory_read() or {}
+            for name, entry in inventory.items():
+                path = os.path.join(clone._bin, name)
+                if os.path.exists(path):
+                    st = os.stat(path)
+                    entry.update(mtime_ns=st.st_mtime_ns, inode=st.st_ino)
+            if inventory:
+                clone._executables_inventory_write(inventory)
+            if os.path.exists(clone._compiled_stamp):
+                clone.dependency_graph()  # reference state of the sources, for selective_clean()
+            with io.open(clone._cloned_stamp, 'w') as f:
+                f.write(json.dumps({'origin':self.abspath,
+                                    'cloned':time.time(),
+                                    'stats':stats}, sort_keys=True))
+            if stats['hardlinked'] > 0:
+                for pack in (self, clone):
+                    with io.open(pack._hardlinked_stamp, 'a') as f:
+                        f.write((clone if pack is self else self).abspath + '\n')
+        print("Cloned: {copied} file(s) copied, {rewritten} rewritten, {reflinked} reflinked, "
+              "{hardlinked} hard linked, {symlinks} symlink(s)".format(**stats))
+        self._registry_register_clone(clone)
+        return clone
+
+    def _clone_tree(self, dst, clone, link):
+        """Clone the tree of the pack into **dst**, to be the tree of **clone**."""
+        stats = {'copied':0, 'rewritten':0, 'reflinked':0, 'hardlinked':0, 'symlinks':0}
+        mode = [link]  # may fall back on another mode
+        origin = os.path.join(self.abspath, '')
+        for dirpath, dirnames, filenames in os.walk(self.abspath):
+            reldir = os.path.relpath(dirpath, self.abspath)
+            if reldir == '.':
+                reldir = ''
+                for skipped in self._clone_skipped:
+                    for names in (dirnames, filenames):
+                        if skipped in names:
+                            names.remove(skipped)
+            # staging directories of an interrupted population
+            dirnames[:] = [d for d in dirnames if not (d.startswith('.') and d.endswith('.staging'))]
+            os.makedirs(os.path.join(dst, reldir))
+            for name in sorted(dirnames + filenames):
+                relpath = os.path.join(reldir, name)
+                f_src = os.path.join(dirpath, name)
+                f_dst = os.path.join(dst, relpath)
+                if os.path.islink(f_src):
+                    target = os.readlink(f_src)
+                    if target == self.abspath or target.startswith(origin):
+                        target = clone.abspath + target[len(self.abspath):]
+                    os.symlink(target, f_dst)
+                    stats['symlinks'] += 1
+                    if name in dirnames:  # not to be walked into
+                        dirnames.remove(name)
+                elif name in filenames:
+                    if (relpath.split(os.sep)[0] in self._build_products_dirs or
+                        os.path.splitext(name)[1] in self._build_products_ext):
+                        stats[self._clone_product(f_src, f_dst, mode)] += 1
+                    elif relpath.split(os.sep)[0] not in ('src', 'hub') and self._clone_rewrite(
+                            f_src, f_dst, clone, script=name == '.genesis' or name.startswith('ics_')):
+                        stats['rewritten'] += 1
+                    else:
+                        copy2_counted(f_src, f_dst)
+                        stats['copied'] += 1
+        return stats
+
+    @staticmethod
+    def _clone_product(src, dst, mode):
+        """Clone build product **src** as **dst**, according to **mode** (a list, updated on fallback)."""
+        if mode[0] in ('auto', 'reflink'):
+            try:
+                reflink(src, dst)
+                return 'reflinked'
+            except (IOError, OSError):  # not supported by the filesystem
+                mode[0] = 'hardlink' if mode[0] == 'auto' else 'copy'
+        if mode[0] == 'hardlink':
+            try:
+                os.link(src, dst)
+                return 'hardlinked'
+            except OSError:  # e.g. across filesystems
+                mode[0] = 'copy'
+        copy2_counted(src, dst)
+        return 'copied'
+
+    def _clone_rewrite(self, src, dst, clone, script=False):
+        """
+        Copy **src** as **dst**, rewriting the location of the pack for the one
+        of **clone**, and for **script**s (.genesis, ics_) its name.
+        Return False if there was nothing to rewrite (and nothing done).
+        """
+        if os.path.getsize(src) > 1 << 26:
+            return False
+        with io.open(src, 'rb') as f:
+            contents = f.read()
+        if not script and self.abspath.encode('utf-8') not in contents:
+            return False
+        try:
+            text = contents.decode('utf-8')
+        except UnicodeDecodeError:
+            return False
+        text = text.replace(self.abspath, clone.abspath)
+        if os.path.basename(src) == '.genesis':
+            lines = text.split('\n')
+            tokens = lines[0].split()
+            for option, value in (('-u', clone.packname), ('-h', clone.homepack)):
+                if option in tokens[:-1]:
+                    tokens[tokens.index(option) + 1] = value
+                elif option == '-u':
+                    tokens.extend([option, value])
+            lines[0] = ' '.join(tokens)
+            text = '\n'.join(lines)
+        elif script:
+            text = re.sub(r'(?<![\w.-]){}(?![\w.-])'.format(re.escape(self.packname)), clone.packname, text)
+            if clone.homepack != self.homepack:
+                text = text.replace(self.homepack, clone.homepack)
+        with io.open(dst, 'w') as f:
+            f.write(text)
+        shutil.copystat(src, dst)
+        return True
+
+    def _registry_register_clone(self, clone):
+        """Register **clone** with the source and build fields of the pack."""
+        from .registry import PackRegistry
+        from .config import PACK_REGISTRY
+        fields = {}
+        if PACK_REGISTRY:
+            try:
+                record = PackRegistry(self.homepack).get(self.packname) or {}
+            except Exception as e:
+                print("! Warning: unable to read pack registry: {}".format(e))
+                record = {}
+            for k in ('populated', 'source_type', 'source_repository', 'source_ref', 'source_commit',
+                      'start_ref', 'bundle', 'build_status', 'built'):
+                if record.get(k) is not None:
+                    fields[k] = record[k]
+        inventory = clone.executables_inventory()
+        registry_update(clone, created=time.time(), cloned_from=self.abspath,
+                        binaries=sorted(inventory.keys()), executables=inventory, **fields)
+
+    def snapshot_sources(self):
+        """
+        Signature of the sources of src/local: {relpath: (size, mtime_ns,
+        sha256)}, to be compared after a population (cf.
+        restore_unchanged_sources()).
+        """
+        snapshot = {}
+        for dirpath, _, filenames in os.walk(self._local):
+            for f in filenames:
+                if f.startswith('.') or os.path.splitext(f)[1] in self._build_products_ext:
+                    continue
+                path = os.path.join(dirpath, f)
+                if os.path.islink(path):
+                    continue
+                st = os.stat(path)
+                snapshot[os.path.relpath(path, self._local)] = (st.st_size, st.st_mtime_ns,
+                                                                file_sha256(path))
+        return snapshot
+
+    def restore_unchanged_sources(self, snapshot, populated):
+        """
+        After a population of a clone, compared to its sources **snapshot**
+        before population (cf. snapshot_sources()):
+
+        - sources rewritten with the same contents get their former mtime
+          back, not to be taken for modified;
+        - sources not in **populated** (the files of the increment, as
+          returned by the population), are removed; their products are
+          removed by the selective clean starting the compilations of a
+          clone (cf. compile()).
+
+        Return (list of restored, list of removed).
+        """
+        restored = []
+        removed = []
+        populated = set([os.path.normpath(f) for f in populated])
+        for relpath, (size, mtime_ns, sha256) in sorted(snapshot.items()):
+            path = os.path.join(self._local, relpath)
+            if not os.path.exists(path):
+                continue
+            st = os.stat(path)
+            if os.path.normpath(relpath) not in populated:
+                os.unlink(path)
+                removed.append(relpath)
+            elif st.st_size == size and file_sha256(path) == sha256:
+                os.utime(path, ns=(st.st_atime_ns, mtime_ns))
+                restored.append(relpath)
+        return restored, removed
+
     # Others -------------------------------------------------------------------
 
     def rmpack(self):
         """Delete pack."""
-        shutil.rmtree(self.abspath)
+        with self.lock():
+            shutil.rmtree(self.abspath)
+            self._remove_lock_file()
+        registry_remove(self)
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Registry of the packs of a HOMEPACK, as a SQLite file, for fast lookup.
+
+It is kept up to date by pack creation, population, compilation and deletion,
+and can be rebuilt from the packs on disk.
+"""
+import os
+import io
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+#: No automatic export
+__all__ = []
+
+#: Basename of the registry file, in HOMEPACK
+REGISTRY_BASENAME = '.pygmkpack.registry.sqlite'
+
+#: Columns of the registry, with their SQL type
+COLUMNS = (('packname', 'TEXT PRIMARY KEY'),
+           ('abspath', 'TEXT'),
+           ('incremental', 'INTEGER'),
+           ('release', 'TEXT'),
+           ('branch', 'TEXT'),
+           ('version', 'TEXT'),
+           ('label', 'TEXT'),
+           ('flag', 'TEXT'),
+           ('genesis', 'TEXT'),
+           ('created', 'REAL'),
+           ('populated', 'REAL'),
+           ('source_type', 'TEXT'),  # git, bundle, tar, dir
+           ('source_repository', 'TEXT'),
+           ('source_ref', 'TEXT'),
+           ('source_commit', 'TEXT'),
+           ('start_ref', 'TEXT'),
+           ('bundle', 'TEXT'),  # JSON: {component:{version, commit}}
+           ('build_status', 'TEXT'),  # OK, failed
+           ('built', 'REAL'),
+           ('binaries', 'TEXT'),  # JSON: list of executables
+           ('executables', 'TEXT'),  # JSON: executables inventory of the pack
+           ('build_key', 'TEXT'),  # cf. build_key()
+           ('touched_hash', 'TEXT'),  # cf. touched_files_hash()
+           ('cloned_from', 'TEXT'),  # abspath of the pack it was cloned from
+           ('updated', 'REAL'),
+           )
+_COLUMN_NAMES = [c[0] for c in COLUMNS]
+_JSON_COLUMNS = ('bundle', 'binaries', 'executables')
+_INDEXED = (('source_ref',), ('source_commit',), ('label', 'flag'), ('branch',), ('build_key',))
+#: Genesis fields accounted for in the build key
+GENESIS_KEY_FIELDS = ('release', 'branch', 'version', 'label', 'flag', 'rootpack')
+
+
+class PackRegistry(object):
+    """Registry of the packs of a HOMEPACK."""
+
+    def __init__(self, homepack=None):
+        from .pygmkpack import GmkpackTool
+        if homepack in (None, ''):
+            homepack = GmkpackTool.get_homepack()
+        self.homepack = homepack
+        self.filepath = os.path.join(homepack, REGISTRY_BASENAME)
+
+    @contextmanager
+    def _connect(self):
+        """Context: a connection to the registry, committed at exit."""
+        if not os.path.exists(self.homepack):
+            os.makedirs(self.homepack)
+        connection = sqlite3.connect(self.filepath, timeout=60)
+        try:
+            connection.row_factory = sqlite3.Row
+            connection.execute("CREATE TABLE IF NOT EXISTS packs ({})".format(
+                ', '.join(['{} {}'.format(*c) for c in COLUMNS])))
+            existing = [r[1] for r in connection.execute("PRAGMA table_info(packs)").fetchall()]
+            for column, sqltype in COLUMNS:  # registry created by an older version
+                if column not in existing:
+                    connection.execute("ALTER TABLE packs ADD COLUMN {} {}".format(column, sqltype))
+            for columns in _INDEXED:
+                connection.execute("CREATE INDEX IF NOT EXISTS idx_{} ON packs ({})".format(
+                    '_'.join(columns), ', '.join(columns)))
+            yield connection
+            connection.commit()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _row2dict(row):
+        record = dict(row)
+        for k in _JSON_COLUMNS:
+            if record.get(k) is not None:
+                record[k] = json.loads(record[k])
+        return record
+
+    @staticmethod
+    def genesis_fields(pack):
+        """Fields of the registry describing **pack**, as read in its .genesis."""
+        args = pack.genesis_arguments
+        return {'packname':pack.packname,
+                'abspath':pack.abspath,
+                'incremental':int(pack.is_incremental),
+                'release':pack.release,
+                'branch':args.get('-b'),
+                'version':args.get('-v'),
+                'label':args.get('-l'),
+                'flag':args.get('-o'),
+                'genesis':pack.genesis}
+
+    # Updates ------------------------------------------------------------------
+
+    def update(self, pack, **fields):
+        """
+        Register **pack** (genesis fields), or update its record, with
+        additional **fields** (cf. COLUMNS).
+
+        A new population resets the build key and status, unless given.
+        """
+        if 'populated' in fields:
+            for k in ('build_key', 'touched_hash', 'build_status'):
+                fields.setdefault(k, None)
+        fields.update(self.genesis_fields(pack))
+        self._upsert(fields)
+
+    def _upsert(self, fields):
+        fields = dict(fields)
+        fields['updated'] = time.time()
+        for k in _JSON_COLUMNS:
+            if k in fields and fields[k] is not None:
+                fields[k] = json.dumps(fields[k], sort_keys=True)
+        unknown = set(fields.keys()).difference(_COLUMN_NAMES)
+        if unknown:
+            raise KeyError("Unknown registry fields: {}".format(sorted(unknown)))
+        columns = sorted(fields.keys())
+        sql = "INSERT INTO packs ({}) VALUES ({}) ON CONFLICT(packname) DO UPDATE SET {}".format(
+            ', '.join(columns),
+            ', '.join(['?'] * len(columns)),
+            ', '.join(['{0}=excluded.{0}'.format(c) for c in columns if c != 'packname']))
+        with self._connect() as connection:
+            connection.execute(sql, [fields[c] for c in columns])
+
+    def remove(self, packname):
+        """Remove **packname** from the registry."""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM packs WHERE packname = ?", (packname,))
+
+    # Queries ------------------------------------------------------------------
+
+    def get(self, packname):
+        """Record of **packname**, or None."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM packs WHERE packname = ?", (packname,)).fetchone()
+        return None if row is None else self._row2dict(row)
+
+    def find(self, order_by='updated', **criteria):
+        """
+        Records of packs matching **criteria**, e.g.
+        find(source_ref='mary_CY48_dev', label='IMPIFC1801', build_status='OK').
+
+        A criterion set to None matches NULL values.
+        """
+        clauses = []
+        values = []
+        for k, v in sorted(criteria.items()):
+            if k not in _COLUMN_NAMES:
+                raise KeyError("Unknown registry field: {}".format(k))
+            if v is None:
+                clauses.append("{} IS NULL".format(k))
+            else:
+                clauses.append("{} = ?".format(k))
+                values.append(v)
+        sql = "SELECT * FROM packs"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY {} DESC".format(order_by)
+        with self._connect() as connection:
+            rows = connection.execute(sql, values).fetchall()
+        return [self._row2dict(r) for r in rows]
+
+    def packnames(self):
+        """Names of the registered packs."""
+        with self._connect() as connection:
+            rows = connection.execute("SELECT packname FROM packs ORDER BY packname").fetchall()
+        return [r[0] for r in rows]
+
+    def lookup_build(self, key, commit=None, genesis=None):
+        """
+        Look for a pack successfully built with build **key**.
+
+        :param commit: source commit, to explain a miss
+        :param genesis: genesis fields (cf. genesis_key_fields()), to explain a miss
+
+        Return (record or None, reason).
+        """
+        equivalent = self.find(build_key=key)
+        for record in equivalent:
+            if (record['build_status'] == 'OK' and record['binaries'] and
+                os.path.isdir(record['abspath'])):
+                return (record, "pack '{}' was built from the same commit, touched files and genesis".format(
+                    record['packname']))
+        if equivalent:
+            return (None, "equivalent pack(s) {} not successfully built, or missing on disk".format(
+                [r['packname'] for r in equivalent]))
+        if commit is None:
+            return (None, "no equivalent pack registered")
+        candidates = self.find(source_commit=commit)
+        if not candidates:
+            return (None, "no pack registered from commit {}".format(commit[:12]))
+        record = candidates[0]
+        if genesis is not None:
+            differences = ['{} ({} vs. {})'.format(k, record.get(k), genesis[k])
+                           for k in GENESIS_KEY_FIELDS
+                           if k in record and record.get(k) != genesis[k]]
+            if differences:
+                return (None, "pack '{}' from same commit differs by: {}".format(
+                    record['packname'], ', '.join(differences)))
+        return (None, "pack '{}' from same commit differs by touched files, start ref or root pack".format(
+            record['packname']))
+
+    # Rebuild from disk --------------------------------------------------------
+
+    @staticmethod
+    def parse_origin(text):
+        """
+        Parse the contents of a pack's origin file (.pygmkpack.populated),
+        and return the source fields of the latest population.
+        """
+        fields = {}
+        bundle = {}
+        component = None
+        for line in text.split('\n'):
+            view = re.match("\*\*\* View of '(?P<ref>.+)' \*\*\*$", line.strip())
+            commit = re.match("(Latest commit|Commit): (?P<commit>\w+)$", line.strip())
+            if view:
+                fields = {'source_type':'git', 'source_ref':view.group('ref')}
+                bundle = {}
+            elif commit and fields.get('source_type') == 'git':
+                fields['source_commit'] = commit.group('commit')
+            elif 'populate from bundle successful' in line:
+                fields = {'source_type':'bundle'}
+                bundle = {}
+            elif fields.get('source_type') == 'bundle':
+                item = re.match("\* (?P<component>.+)$", line.strip())
+                prop = re.match("(?P<k>version|commit): (?P<v>.+)$", line.strip())
+                if item:
+                    component = item.group('component')
+                    bundle[component] = {}
+                elif prop and component is not None:
+                    bundle[component][prop.group('k')] = prop.group('v')
+        if bundle:
+            fields['bundle'] = bundle
+            main = bundle.get('arpifs', bundle.get('ial', {}))
+            fields['source_ref'] = main.get('version')
+            fields['source_commit'] = main.get('commit')
+        return fields
+
+    def rebuild(self):
+        """Rebuild the registry from the packs on disk."""
+        from .pygmkpack import Pack
+        found = []
+        for entry in os.scandir(self.homepack):
+            if not entry.is_dir() or not os.path.exists(os.path.join(entry.path, '.genesis')):
+                continue
+            try:
+                pack = Pack(entry.name, homepack=self.homepack)
+                fields = self.genesis_fields(pack)
+                fields['created'] = os.stat(os.path.join(pack.abspath, '.genesis')).st_mtime
+                if os.path.exists(pack.origin_filepath):
+                    with io.open(pack.origin_filepath, 'r') as f:
+                        fields.update(self.parse_origin(f.read()))
+                    fields['populated'] = os.stat(pack.origin_filepath).st_mtime
+                if os.path.exists(pack._cloned_stamp):
+                    with io.open(pack._cloned_stamp, 'r') as f:
+                        fields['cloned_from'] = json.load(f)['origin']
+                if os.path.isdir(pack._bin):
+                    fields['executables'] = pack.refresh_executables_inventory(write=False)
+                    fields['binaries'] = sorted(fields['executables'].keys())
+                    if fields['binaries']:  # at least one successful build
+                        fields['build_status'] = 'OK'
+                        fields['built'] = max([e['mtime_ns'] for e in fields['executables'].values()]) / 1e9
+                self._upsert(fields)
+                found.append(entry.name)
+            except Exception as e:
+                print("Skip pack '{}': {}".format(entry.name, e))
+        with self._connect() as connection:
+            for packname in set(self.packnames()).difference(found):
+                connection.execute("DELETE FROM packs WHERE packname = ?", (packname,))
+        return found
+
+
+# Build keys -------------------------------------------------------------------
+
+def genesis_key_fields(args):
+    """
+    Normalized genesis fields accounted for in the build key,
+    from gmkpack arguments **args** (e.g. {'-r':'47t1', '-l':'IMPIFC1801'...}).
+    """
+    return {'release':'CY' + args['-r'].upper().replace('CY', ''),
+            'branch':args.get('-b') or 'main',
+            'version':args.get('-v'),
+            'label':args.get('-l'),
+            'flag':args.get('-o'),
+            'rootpack':args.get('-f')}
+
+
+def touched_files_hash(view, touched_files):
+    """
+    Hash of the set of **touched_files** (as returned by
+    view.touched_files_since()), and of the contents of the non-committed ones.
+    """
+    h = hashlib.sha256()
+    for status in sorted(touched_files.keys()):
+        for f in sorted([f if isinstance(f, str) else '->'.join(f)
+                         for f in touched_files[status]]):
+            h.update('{} {}\n'.format(status, f).encode('utf-8'))
+    uncommitted = view.git_proxy.touched_since_last_commit
+    files = []
+    for k in ('A', 'M', 'T'):
+        files.extend(uncommitted.get(k, []))
+    for k in ('R', 'C'):
+        files.extend([f[1] for f in uncommitted.get(k, [])])
+    for f in sorted(set(files)):
+        with io.open(os.path.join(view.repository, f), 'rb') as contents:
+            h.update(f.encode('utf-8') + b'\n' + hashlib.sha256(contents.read()).digest())
+    return h.hexdigest()
+
+
+def build_key(commit, touched_hash, genesis, start_ref=None):
+    """
+    Key of a build: packs with the same key contain the same sources and are
+    compiled the same way.
+
+    :param commit: commit of the sources
+    :param touched_hash: cf. touched_files_hash()
+    :param genesis: cf. genesis_key_fields()
+    :param start_ref: start reference of the increment
+    """
+    key = {'commit':commit,
+           'touched':touched_hash,
+           'genesis':genesis,
+           'start_ref':start_ref}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def registry_update(pack, **fields):
+    """
+    Update the registry of the pack's HOMEPACK with **fields** about **pack**.
+    Best effort: never fails (the registry can be rebuilt from disk).
+    """
+    from .config import PACK_REGISTRY
+    if not PACK_REGISTRY:
+        return
+    try:
+        PackRegistry(pack.homepack).update(pack, **fields)
+    except Exception as e:
+        print("! Warning: unable to update pack registry: {}".format(e))
+
+
+def registry_remove(pack):
+    """Remove **pack** from the registry of its HOMEPACK. Best effort."""
+    from .config import PACK_REGISTRY
+    if not PACK_REGISTRY:
+        return
+    try:
+        PackRegistry(pack.homepack).remove(pack.packname)
+    except Exception as e:
+        print("! Warning: unable to update pack registry: {}".format(e))
@@ -1,17 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from __future__ import print_function, absolute_import, unicode_literals, division
 """
 Management of repositories.
 """
-import six
 import subprocess
 import os
 import re
 import sys
 import io
+import time
+import weakref
 from contextlib import contextmanager
 
+from .commands import runner
+
 
 class GitError(Exception):
     pass
@@ -38,7 +40,7 @@ class GitProxy(object):
     def _git_cmd(self, cmd, stderr=None):
         """Wrapper to execute a git command."""
         return [line.strip() for line in
-                subprocess.check_output(cmd, cwd=self.repository, stderr=stderr).decode('utf-8').split('\n')
+                runner.check_output(cmd, cwd=self.repository, stderr=stderr).decode('utf-8').split('\n')
                 if line != '']
 
     # Repository ---------------------------------------------------------------
@@ -167,7 +169,12 @@ class GitProxy(object):
 
     def _refs_get(self):
         git_cmd = ['git', 'show-ref']
-        list_of_refs = [ref.split() for ref in self._git_cmd(git_cmd)]
+        return self._parse_show_ref(self._git_cmd(git_cmd))
+
+    @staticmethod
+    def _parse_show_ref(lines):
+        """Parse the output of `git show-ref`."""
+        list_of_refs = [ref.split() for ref in lines]
         refs = []
         for h, r in list_of_refs:
             if r.startswith('refs/remotes'):
@@ -235,8 +242,12 @@ class GitProxy(object):
         """Get the list of tags between 2 references (commits, branches, tags)."""
         git_cmd = ['git', 'log', '{}...{}'.format(start_ref, end_ref),
                    '--decorate', '--simplify-by-decoration']
+        return self._parse_tags_between(self._git_cmd(git_cmd))
+
+    @staticmethod
+    def _parse_tags_between(cmd_out):
+        """Parse the output of `git log --decorate --simplify-by-decoration`."""
         _re = re.compile('commit .+ \((.+)\)$')
-        cmd_out = self._git_cmd(git_cmd)
         list_of_tagged_commits = [line for line in cmd_out if _re.match(line)]
         list_of_tags = [_re.match(line).group(1).split(', ') for line in list_of_tagged_commits]
         list_of_tags = [[ref[4:].strip() for ref in line if ref.startswith('tag:')]
@@ -290,10 +301,14 @@ class GitProxy(object):
         assert self.ref_exists(start_ref)
         assert self.ref_exists(end_ref)
         git_cmd = ['git', 'diff', '--name-status', start_ref, end_ref]
+        return self._parse_name_status(self._git_cmd(git_cmd))
+
+    @staticmethod
+    def _parse_name_status(touched):
+        """Parse the output of `git diff --name-status`."""
         asdict = {'A':set(), 'R':set(), 'M':set(), 'C':set(), 'T':set(),
                   'D':set(),
                   'U':set(), 'X':set(), 'B':set()}
-        touched = self._git_cmd(git_cmd)
         for line in touched:
             if line[0] in ('A', 'M', 'T', 'D'):
                 asdict[line[0]].add(line[2:].strip())
@@ -313,7 +328,11 @@ class GitProxy(object):
         since last commit.
         """
         git_cmd = ['git', 'status', '-s', '--porcelain']
-        touched = self._git_cmd(git_cmd)
+        return self._parse_porcelain(self._git_cmd(git_cmd))
+
+    @staticmethod
+    def _parse_porcelain(touched):
+        """Parse the output of `git status -s --porcelain`."""
         asdict = {'A':set(), 'R':set(), 'M':set(), 'C':set(), 'T':set(),
                   'D':set(),
                   'U':set(), 'X':set(), 'B':set()}
@@ -344,6 +363,11 @@ class GitProxy(object):
             print('Auto-determined common ancestor: {}'.format(common_ancestor))
         touched_in_contrib = self.touched_between(common_ancestor, contrib_ref)
         touched_in_target = self.touched_between(common_ancestor, target_ref)
+        return self._potential_conflicts(touched_in_contrib, touched_in_target)
+
+    @staticmethod
+    def _potential_conflicts(touched_in_contrib, touched_in_target):
+        """Cross touched files in contribution and target to find potential conflicts."""
         potential_conflicts = {'{}/{}'.format(kc, kt):[]
                                for kc in touched_in_contrib.keys()
                                for kt in touched_in_target.keys()}
@@ -381,7 +405,7 @@ class GitProxy(object):
 
         :param filenames: either a filename or a list of
         """
-        if isinstance(filenames, six.string_types):
+        if isinstance(filenames, str):
             filenames = [filenames,]
         for f in filenames:
             git_cmd = ['git', 'add', f]
@@ -403,6 +427,206 @@ class GitProxy(object):
         return len(status) == 0
 
 
+class AsyncGitProxy(object):
+    """
+    Asynchronous counterpart of GitProxy for the query methods, so that
+    independent git queries can be run concurrently, e.g.:
+
+    >>> g = AsyncGitProxy(repository)
+    >>> async def query():
+    ...     return await asyncio.gather(g.tags(), g.latest_commit())
+    >>> tags, commit = g.run(query())
+    """
+
+    def __init__(self, repository='.', max_concurrency=8):
+        """
+        :param max_concurrency: max number of git subprocesses running at once
+        """
+        self.repository = os.path.abspath(repository)
+        assert os.path.exists(os.path.join(self.repository, '.git')), \
+            "This is not a Git **repository** : {}".format(self.repository)
+        self.max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()  # per event loop
+
+    def _semaphore(self):
+        """Semaphore bounding concurrent git subprocesses, for the running event loop."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:  # a semaphore is bound to the loop it is used in
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    @staticmethod
+    def run(coroutine):
+        """Run a **coroutine** (or a gather of) to completion and return its result."""
+        import asyncio
+        return asyncio.run(coroutine)
+
+    async def _git_cmd(self, cmd, check=True):
+        """Wrapper to execute asynchronously a git command."""
+        import asyncio
+        timeout = runner.timeout_for(cmd)
+        async with self._semaphore():
+            start = time.time()
+            proc = await asyncio.create_subprocess_exec(*cmd,
+                                                        cwd=self.repository,
+                                                        stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE)
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                runner.record(cmd, self.repository, start, time.time() - start, 'timeout')
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            runner.record(cmd, self.repository, start, time.time() - start,
+                          proc.returncode, len(stdout))
+        if check and proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd,
+                                                output=stdout, stderr=stderr)
+        return [line.strip() for line in stdout.decode('utf-8').split('\n')
+                if line != '']
+
+    async def _returncode(self, cmd):
+        """Execute asynchronously a git command and return its exit code."""
+        try:
+            await self._git_cmd(cmd)
+            return 0
+        except subprocess.CalledProcessError as e:
+            return e.returncode
+
+    # Repository ---------------------------------------------------------------
+
+    async def current_branch(self):
+        """Currently checkedout branch."""
+        for branch in await self._git_cmd(['git', 'branch']):
+            if branch.startswith('*'):
+                return branch.split()[1]
+
+    async def is_clean(self):
+        """Tell if there are uncommited changes (working, staged)."""
+        return len(await self._git_cmd(['git', 'status', '--porcelain'])) == 0
+
+    # Ref(s) -------------------------------------------------------------------
+
+    async def _refs_get(self):
+        return GitProxy._parse_show_ref(await self._git_cmd(['git', 'show-ref']))
+
+    async def tags(self):
+        """Return list of tags."""
+        return sorted([r['ref'] for r in await self._refs_get()
+                       if r['rtype'] == 'tag'])
+
+    async def local_branches(self):
+        """List of local branches."""
+        return sorted([r['ref'] for r in await self._refs_get()
+                       if r['rtype'] == 'branch' and r['remote'] is None])
+
+    @staticmethod
+    def _ref_is_branch(ref, refs):
+        for r in refs:
+            if r['rtype'] == 'branch':
+                if ref == r['ref']:
+                    return True
+                if r['remote'] is not None and ref == '/'.join([r['remote'], r['ref']]):
+                    return True
+        return False
+
+    async def ref_is_tag(self, ref):
+        """Check whether reference is tag."""
+        return ref in await self.tags()
+
+    async def ref_is_branch(self, ref):
+        """Check whether reference is branch."""
+        return self._ref_is_branch(ref, await self._refs_get())
+
+    async def commit_exists(self, commit):
+        """Check whether commit is existing."""
+        git_cmd = ['git', 'rev-parse', '--verify', commit + '^{commit}']
+        return await self._returncode(git_cmd) == 0
+
+    async def ref_exists(self, ref):
+        """
+        Check whether a ref (tag, branch, commit) exists;
+        refs and commit are looked up concurrently.
+        """
+        import asyncio
+        if ref == 'HEAD':
+            return True
+        refs, is_commit = await asyncio.gather(self._refs_get(),
+                                               self.commit_exists(ref))
+        return (any([r['rtype'] == 'tag' and r['ref'] == ref for r in refs]) or
+                self._ref_is_branch(ref, refs) or
+                is_commit)
+
+    async def refs_common_ancestor(self, ref1, ref2):
+        """Common ancestor commit between 2 references (commits, branches, tags)."""
+        return (await self._git_cmd(['git', 'merge-base', ref1, ref2]))[0]
+
+    async def tag_points_to(self, tag):
+        """Return the associated commit to **tag**."""
+        return (await self._git_cmd(['git', 'rev-list', '-n', '1', tag]))[0]
+
+    async def tags_between(self, start_ref, end_ref):
+        """Get the list of tags between 2 references (commits, branches, tags)."""
+        git_cmd = ['git', 'log', '{}...{}'.format(start_ref, end_ref),
+                   '--decorate', '--simplify-by-decoration']
+        return GitProxy._parse_tags_between(await self._git_cmd(git_cmd))
+
+    # Commit(s) ----------------------------------------------------------------
+
+    async def latest_commit(self):
+        """Latest commit in current history."""
+        return (await self._git_cmd(['git', 'rev-parse', 'HEAD']))[0]
+
+    # Content ------------------------------------------------------------------
+
+    async def touched_between(self, start_ref, end_ref):
+        """
+        Return the lists of Added, Modified, Deleted, Renamed (etc...) files
+        between 2 references (commits, branches, tags).
+        """
+        git_cmd = ['git', 'diff', '--name-status', start_ref, end_ref]
+        return GitProxy._parse_name_status(await self._git_cmd(git_cmd))
+
+    async def touched_since_last_commit(self):
+        """
+        Return the lists of Added, Modified, Deleted, Renamed (etc...) files
+        since last commit.
+        """
+        git_cmd = ['git', 'status', '-s', '--porcelain']
+        return GitProxy._parse_porcelain(await self._git_cmd(git_cmd))
+
+    async def preview_merge(self, contrib_ref, target_ref, common_ancestor=None):
+        """
+        Preview a merge potential conflicts; both sides are diffed concurrently.
+
+        Cf. GitProxy.preview_merge() for arguments.
+        """
+        import asyncio
+        if common_ancestor is None:
+            common_ancestor = await self.refs_common_ancestor(contrib_ref, target_ref)
+            print('Auto-determined common ancestor: {}'.format(common_ancestor))
+        touched_in_contrib, touched_in_target = await asyncio.gather(
+            self.touched_between(common_ancestor, contrib_ref),
+            self.touched_between(common_ancestor, target_ref))
+        return GitProxy._potential_conflicts(touched_in_contrib, touched_in_target)
+
+    async def status(self):
+        """
+        Gather concurrently the state of the working directory, as a dict with
+        keys 'current_branch', 'latest_commit', 'touched_since_last_commit'.
+        """
+        import asyncio
+        current_branch, latest_commit, touched = await asyncio.gather(
+            self.current_branch(),
+            self.latest_commit(),
+            self.touched_since_last_commit())
+        return {'current_branch':current_branch,
+                'latest_commit':latest_commit,
+                'touched_since_last_commit':touched}
+
+
 class IALview(object):
     """Utilities around IAL repository."""
     _re_official_tags = re.compile('(?P<r>CY\d{2}((T|R)\d)?)(_(?P<b>.+)\.(?P<v>\d+))?$')
@@ -549,7 +773,7 @@ class IALview(object):
         else:
             start_commit = '?'
         print("Register branch: '{}' in GCO database, with base commit: '{}'".format(self.git_proxy.current_branch, start_commit))
-        subprocess.check_call(cmd, cwd=self.git_proxy.repository)
+        runner.check_call(cmd, cwd=self.git_proxy.repository)
 
     # History ------------------------------------------------------------------
 
@@ -612,6 +836,29 @@ class IALview(object):
         """Lists touched files since *self.latest_official_tagged_ancestor*."""
         return self.touched_files_since(self.latest_official_tagged_ancestor)
 
+    def dependency_graph(self, threads=8):
+        """
+        Scan the sources of the repository into a dependencies.DependencyGraph,
+        cached in the .git directory.
+        """
+        from .dependencies import DependencyGraph
+        git_dir = os.path.join(self.repository, '.git')
+        cache_file = os.path.join(git_dir, 'ial_build.dependencies.json') if os.path.isdir(git_dir) else None
+        graph = DependencyGraph(self.repository, cache_file=cache_file, threads=threads)
+        return graph.scan()
+
+    def rebuild_impact(self, start_ref=None, out=sys.stdout):
+        """
+        Predict (and print a summary of) the compilation units to be rebuilt
+        in an incremental pack, given files touched since **start_ref**
+        (if None, since latest official tagged ancestor).
+        """
+        if start_ref is None:
+            touched = self.touched_files_since_latest_official_tagged_ancestor
+        else:
+            touched = self.touched_files_since(start_ref)
+        return self.dependency_graph().impact_summary(touched, out=out)
+
     def prep_doc(self, outdir, start_ref=None):
         """
         Pre-fill branch doc template.
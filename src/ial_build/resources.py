@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Resources of the machine available to builds (CPUs, memory, load, cgroup
+limits), and planning of the number of compilation threads (GMK_THREADS)
+and of concurrent builds accordingly.
+
+Builds running concurrently from a same HOMEPACK are accounted for through
+build slots: lock files in HOMEPACK held by each running build, in which
+its number of threads is written. The usable CPUs, net of the load of the
+host which is not theirs, are shared between them.
+"""
+import os
+import io
+import math
+import time
+import uuid
+import fcntl
+from contextlib import contextmanager
+
+from .config import GMK_THREADS_OVERRIDE, MAX_CONCURRENT_BUILDS_OVERRIDE
+
+#: No automatic export
+__all__ = []
+
+#: Estimated memory needed by a compilation thread (GB)
+MEMORY_PER_THREAD = 1.5
+#: Minimum number of threads worth a concurrent build
+MIN_THREADS_PER_BUILD = 4
+#: Maximum number of threads of a build (beyond, gmkpack does not scale)
+MAX_THREADS_PER_BUILD = 64
+#: Directory of build slots, in HOMEPACK
+SLOTS_DIRNAME = '.pygmkpack.builds'
+#: Lock file of the directory of build slots (taking a slot is atomic)
+SLOTS_LOCK_BASENAME = '.lock'
+
+
+def _read(path):
+    try:
+        with io.open(path, 'r') as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _cgroup_dirs(controller):
+    """Candidate directories of **controller** for the current process (v2 if controller is None)."""
+    dirs = []
+    for line in (_read('/proc/self/cgroup') or '').splitlines():
+        hierarchy, controllers, path = line.split(':', 2)
+        path = path.lstrip('/')
+        if controller is None and hierarchy == '0' and controllers == '':
+            dirs.extend([os.path.join('/sys/fs/cgroup', path), '/sys/fs/cgroup'])
+        elif controller is not None and controller in controllers.split(','):
+            for mount in (controllers, controller):
+                dirs.extend([os.path.join('/sys/fs/cgroup', mount, path),
+                             os.path.join('/sys/fs/cgroup', mount)])
+    return dirs
+
+
+def cgroup_cpu_limit():
+    """CPU limit of the cgroup (possibly fractional number of CPUs), or None."""
+    for d in _cgroup_dirs(None):  # v2
+        content = _read(os.path.join(d, 'cpu.max'))
+        if content is not None:
+            quota, period = content.split()[:2]
+            if quota != 'max':
+                return int(quota) / int(period)
+            return None
+    for d in _cgroup_dirs('cpu'):  # v1
+        quota = _read(os.path.join(d, 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(d, 'cpu.cfs_period_us'))
+        if quota is not None and period is not None:
+            if int(quota) > 0:
+                return int(quota) / int(period)
+            return None
+    return None
+
+
+def cgroup_memory_limit():
+    """Memory limit of the cgroup (bytes), or None."""
+    for d in _cgroup_dirs(None):  # v2
+        content = _read(os.path.join(d, 'memory.max'))
+        if content is not None:
+            return None if content == 'max' else int(content)
+    for d in _cgroup_dirs('memory'):  # v1
+        content = _read(os.path.join(d, 'memory.limit_in_bytes'))
+        if content is not None:
+            limit = int(content)
+            return None if limit >= 1 << 60 else limit  # 'unlimited' is a huge number
+    return None
+
+
+def memory_available():
+    """Available memory of the machine (bytes), as of /proc/meminfo, or None."""
+    for line in (_read('/proc/meminfo') or '').splitlines():
+        if line.startswith('MemAvailable:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+class Resources(object):
+    """Snapshot of the resources available to the current process."""
+
+    def __init__(self):
+        self.host_cpus = os.cpu_count() or 1
+        try:
+            self.affinity_cpus = len(os.sched_getaffinity(0))
+        except AttributeError:  # not on Linux
+            self.affinity_cpus = self.host_cpus
+        self.cgroup_cpus = cgroup_cpu_limit()
+        try:
+            self.loadavg = os.getloadavg()[0]
+        except OSError:
+            self.loadavg = 0.
+        self.memory_available = memory_available()
+        self.cgroup_memory = cgroup_memory_limit()
+
+    @property
+    def cpus(self):
+        """CPUs usable by the process: affinity, capped by the cgroup quota."""
+        cpus = self.affinity_cpus
+        if self.cgroup_cpus is not None:
+            cpus = min(cpus, max(1, int(math.ceil(self.cgroup_cpus))))
+        return cpus
+
+    @property
+    def idle_cpus(self):
+        """Usable CPUs, minus their share of the current load of the host."""
+        return self.available_cpus()
+
+    def available_cpus(self, own_load=0.):
+        """
+        Usable CPUs, minus their share of the current load of the host which
+        is not due to **own_load** (e.g. the threads of the builds accounted for).
+        """
+        foreign = max(0., self.loadavg - own_load)
+        busy = min(1., foreign / self.host_cpus)
+        return max(1, int(math.floor(self.cpus * (1. - busy) + 0.5)))
+
+    @property
+    def memory(self):
+        """Memory usable by the process (bytes), or None if unknown."""
+        candidates = [m for m in (self.memory_available, self.cgroup_memory) if m is not None]
+        return min(candidates) if candidates else None
+
+    def as_dict(self):
+        return {'host_cpus':self.host_cpus,
+                'affinity_cpus':self.affinity_cpus,
+                'cgroup_cpus':self.cgroup_cpus,
+                'loadavg':self.loadavg,
+                'cpus':self.cpus,
+                'idle_cpus':self.idle_cpus,
+                'memory_available':self.memory_available,
+                'cgroup_memory':self.cgroup_memory}
+
+
+class ResourcePlan(object):
+    """Number of threads of a build and of concurrent builds, with the reasons of the decision."""
+
+    def __init__(self, gmk_threads, max_concurrent_builds, active_builds, resources, reasons,
+                 active_threads=0):
+        self.gmk_threads = gmk_threads
+        self.max_concurrent_builds = max_concurrent_builds
+        self.active_builds = active_builds
+        self.active_threads = active_threads
+        self.resources = resources
+        self.reasons = reasons
+
+    def as_dict(self):
+        return {'gmk_threads':self.gmk_threads,
+                'max_concurrent_builds':self.max_concurrent_builds,
+                'active_builds':self.active_builds,
+                'active_threads':self.active_threads,
+                'resources':self.resources.as_dict(),
+                'reasons':self.reasons}
+
+    def report(self):
+        r = self.resources
+        memory = 'unknown' if r.memory is None else '{:.1f}GB'.format(r.memory / 1024 ** 3)
+        lines = ["Resources: {} CPUs usable (host: {}, affinity: {}, cgroup: {}), load {:.1f}, memory {}".format(
+                     r.cpus, r.host_cpus, r.affinity_cpus,
+                     'none' if r.cgroup_cpus is None else '{:g}'.format(r.cgroup_cpus),
+                     r.loadavg, memory),
+                 "Plan: GMK_THREADS={}, up to {} concurrent build(s) ({} other(s) running)".format(
+                     self.gmk_threads, self.max_concurrent_builds, self.active_builds)]
+        lines.extend(["  - " + reason for reason in self.reasons])
+        return '\n'.join(lines)
+
+
+def plan_resources(active_builds=0, gmk_threads=None, max_concurrent_builds=None,
+                   active_threads=0):
+    """
+    Plan the number of compilation threads of a build, given the resources
+    of the machine and the number of **active_builds** already running.
+
+    The CPUs shared between the builds are the usable ones, minus their
+    share of the load of the host which is not due to the builds: the
+    load of the **active_threads** (total number of threads of the active
+    builds) is not subtracted, as they are accounted for by the sharing.
+
+    :param gmk_threads: force the number of threads (else $IAL_BUILD_GMK_THREADS if set)
+    :param max_concurrent_builds: force the max number of concurrent builds
+        (else $IAL_BUILD_MAX_CONCURRENT_BUILDS if set)
+    """
+    resources = Resources()
+    reasons = []
+    cpus = resources.available_cpus(own_load=active_threads)
+    reasons.append("{} CPUs available out of {} usable (load {:.1f}, of which builds {:.1f})".format(
+        cpus, resources.cpus, resources.loadavg, min(resources.loadavg, active_threads)))
+    # concurrent builds
+    if max_concurrent_builds is None:
+        max_concurrent_builds = MAX_CONCURRENT_BUILDS_OVERRIDE
+        if max_concurrent_builds is not None:
+            reasons.append("max concurrent builds from $IAL_BUILD_MAX_CONCURRENT_BUILDS")
+    else:
+        reasons.append("max concurrent builds forced")
+    if max_concurrent_builds is None:
+        max_concurrent_builds = max(1, resources.cpus // MIN_THREADS_PER_BUILD)
+        if resources.memory is not None:
+            by_memory = max(1, int(resources.memory / 1024 ** 3 // (MEMORY_PER_THREAD * MIN_THREADS_PER_BUILD)))
+            if by_memory < max_concurrent_builds:
+                max_concurrent_builds = by_memory
+                reasons.append("concurrent builds limited by memory")
+    # threads
+    if gmk_threads is None:
+        gmk_threads = GMK_THREADS_OVERRIDE
+        if gmk_threads is not None:
+            reasons.append("GMK_THREADS from $IAL_BUILD_GMK_THREADS")
+    else:
+        reasons.append("GMK_THREADS forced")
+    if gmk_threads is None:
+        sharing = min(active_builds + 1, max_concurrent_builds)
+        gmk_threads = max(1, cpus // sharing)
+        if sharing > 1:
+            reasons.append("available CPUs shared between {} builds".format(sharing))
+        if resources.memory is not None:
+            by_memory = max(1, int(resources.memory / 1024 ** 3 // MEMORY_PER_THREAD))
+            if by_memory < gmk_threads:
+                gmk_threads = by_memory
+                reasons.append("threads limited by memory ({:g}GB per thread)".format(MEMORY_PER_THREAD))
+        if gmk_threads > MAX_THREADS_PER_BUILD:
+            gmk_threads = MAX_THREADS_PER_BUILD
+            reasons.append("threads capped to {}".format(MAX_THREADS_PER_BUILD))
+    return ResourcePlan(gmk_threads, max_concurrent_builds, active_builds, resources, reasons,
+                        active_threads=active_threads)
+
+
+# Build slots ------------------------------------------------------------------
+
+def _slots_dir(homepack):
+    return os.path.join(homepack, SLOTS_DIRNAME)
+
+
+def active_build_threads(homepack):
+    """
+    Numbers of threads of the builds currently holding a build slot in
+    **homepack** (0 if unknown), as a list; stale slots are removed.
+    """
+    slots = _slots_dir(homepack)
+    if not os.path.isdir(slots):
+        return []
+    active = []
+    for name in os.listdir(slots):
+        if name.endswith('.tmp') or name.startswith('.'):
+            continue
+        path = os.path.join(slots, name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:  # released meanwhile
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            content = os.read(fd, 64).decode('utf-8').strip()
+            active.append(int(content) if content.isdigit() else 0)
+        else:  # not held: stale
+            os.unlink(path)
+        finally:
+            os.close(fd)
+    return active
+
+
+def active_builds(homepack):
+    """Number of builds currently holding a build slot in **homepack**; stale slots are removed."""
+    return len(active_build_threads(homepack))
+
+
+def plan_homepack_resources(homepack, gmk_threads=None, max_concurrent_builds=None):
+    """Plan the resources of a build (cf. plan_resources()), given the builds running from **homepack**."""
+    threads = active_build_threads(homepack)
+    return plan_resources(active_builds=len(threads), active_threads=sum(threads),
+                          gmk_threads=gmk_threads, max_concurrent_builds=max_concurrent_builds)
+
+
+@contextmanager
+def build_slot(homepack, wait=True, poll=10., gmk_threads=None, max_concurrent_builds=None):
+    """
+    Context: hold a build slot in **homepack** and yield the ResourcePlan
+    of the build, accounting for the other builds running from there.
+
+    :param wait: if too many builds are already running (cf. plan), wait
+        for a slot to be released (else, run anyway)
+    :param poll: delay between checks of released slots (s)
+    """
+    slots = _slots_dir(homepack)
+    if not os.path.exists(slots):
+        try:
+            os.makedirs(slots)
+        except OSError:  # concurrently created
+            pass
+    path = os.path.join(slots, '{}.{}'.format(os.getpid(), uuid.uuid4().hex[:8]))
+    waited = False
+    fd = None
+    while fd is None:
+        # counting the slots and taking one are atomic, vs. other builds
+        with io.open(os.path.join(slots, SLOTS_LOCK_BASENAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                plan = plan_homepack_resources(homepack, gmk_threads=gmk_threads,
+                                               max_concurrent_builds=max_concurrent_builds)
+                if not wait or plan.active_builds < plan.max_concurrent_builds:
+                    # locked before being visible, not to be taken for a stale slot
+                    fd = os.open(path + '.tmp', os.O_RDWR | os.O_CREAT, 0o644)
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    os.write(fd, '{}\n'.format(plan.gmk_threads).encode('utf-8'))
+                    os.rename(path + '.tmp', path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        if fd is None:
+            if not waited:
+                print("{} builds running, waiting for a build slot...".format(plan.active_builds))
+                waited = True
+            time.sleep(poll)
+    try:
+        yield plan
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        os.close(fd)
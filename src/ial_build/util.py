@@ -3,17 +3,20 @@
 # Copyright (c) Météo France (2020)
 # This software is governed by the CeCILL-C license under French law.
 # http://www.cecill.info
-from __future__ import print_function, absolute_import, unicode_literals, division
 """
 Utilities for IAL source code management.
 """
 
-import six
 import os
+import io
 import shutil
 import socket
+import hashlib
+import binascii
+from concurrent.futures import ThreadPoolExecutor
 
 from .config import GMKPACK_HUB_PACKAGES, hosts_re
+from .instrumentation import count
 
 
 def host_name():
@@ -23,17 +26,82 @@ def host_name():
             return host
 
 
+def unlink_if_exists(path):
+    """
+    Remove file **path** if it exists, so that writing it afterwards does not
+    write through hard links (e.g. shared with a cloned pack).
+    """
+    if os.path.lexists(path) and not os.path.isdir(path):
+        os.unlink(path)
+
+
 def copy_files_in_cwd(list_of_files, originary_directory_abspath):
     """Copy a bunch of files from an originary directory to the cwd."""
-    symlinks = {}
-    if six.PY3:
-        symlinks['follow_symlinks'] = True
     for f in list_of_files:
         dirpath = os.path.dirname(os.path.abspath(f))
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
+        unlink_if_exists(f)
         shutil.copyfile(os.path.join(originary_directory_abspath, f), f,
-                        **symlinks)
+                        follow_symlinks=True)
+        count('files_copied')
+        count('bytes_copied', os.path.getsize(f))
+
+
+def copy_counted(src, dst, *args, **kwargs):
+    """shutil.copy(), accounting for copied files and bytes in instrumentation."""
+    unlink_if_exists(os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst)
+    dst = shutil.copy(src, dst, *args, **kwargs)
+    count('files_copied')
+    count('bytes_copied', os.path.getsize(dst))
+    return dst
+
+
+def copy2_counted(src, dst, *args, **kwargs):
+    """shutil.copy2(), accounting for copied files and bytes in instrumentation."""
+    unlink_if_exists(os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst)
+    dst = shutil.copy2(src, dst, *args, **kwargs)
+    count('files_copied')
+    count('bytes_copied', os.path.getsize(dst))
+    return dst
+
+
+def copy_files_in_dirs(list_of_files, originary_directory_abspath,
+                       destination_directories, threads=1):
+    """
+    Copy a bunch of files from an originary directory to several destination
+    directories, reading each file only once.
+
+    :param threads: number of files to be copied in parallel
+    """
+    def copy_one(f):
+        src_path = os.path.join(originary_directory_abspath, f)
+        size = os.path.getsize(src_path)
+        outs = []
+        try:
+            for d in destination_directories:
+                dst = os.path.join(d, f)
+                dirpath = os.path.dirname(dst)
+                if not os.path.exists(dirpath):
+                    try:
+                        os.makedirs(dirpath)
+                    except OSError:  # concurrently created
+                        if not os.path.isdir(dirpath):
+                            raise
+                unlink_if_exists(dst)
+                outs.append(io.open(dst, 'wb'))
+            with io.open(src_path, 'rb') as src:  # streamed, read once for all destinations
+                for block in iter(lambda: src.read(1 << 20), b''):
+                    for out in outs:
+                        out.write(block)
+        finally:
+            for out in outs:
+                out.close()
+        count('files_copied', len(destination_directories))
+        count('bytes_copied', size * len(destination_directories))
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        for _ in executor.map(copy_one, list_of_files):
+            pass
 
 
 class DirectoryFiltering(object):
@@ -75,4 +143,78 @@ class DirectoryFiltering(object):
     def copytree(self, dst, symlinks=False):
         shutil.copytree(self.abspath, dst,
                         symlinks=symlinks,
-                        ignore=self._filter_function)
+                        ignore=self._filter_function,
+                        copy_function=copy2_counted)
+
+
+def elf_build_id(path):
+    """
+    Read the GNU build-id of ELF file **path**, as an hexadecimal string,
+    or None if not an ELF file or without build-id.
+    """
+    import struct
+    with io.open(path, 'rb') as f:
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF':
+            return None
+        is64 = ident[4:5] == b'\x02'
+        endian = '<' if ident[5:6] == b'\x01' else '>'
+        if is64:
+            f.seek(32)
+            phoff, = struct.unpack(endian + 'Q', f.read(8))
+            f.seek(54)
+        else:
+            f.seek(28)
+            phoff, = struct.unpack(endian + 'I', f.read(4))
+            f.seek(42)
+        phentsize, phnum = struct.unpack(endian + 'HH', f.read(4))
+        for i in range(phnum):  # program headers: look for PT_NOTE segments
+            f.seek(phoff + i * phentsize)
+            if is64:
+                p_type, _, p_offset, _, _, p_filesz = struct.unpack(endian + 'IIQQQQ', f.read(40))
+            else:
+                p_type, p_offset, _, _, p_filesz = struct.unpack(endian + 'IIIII', f.read(20))
+            if p_type != 4:  # PT_NOTE
+                continue
+            f.seek(p_offset)
+            notes = f.read(p_filesz)
+            pos = 0
+            while pos + 12 <= len(notes):
+                namesz, descsz, n_type = struct.unpack(endian + 'III', notes[pos:pos + 12])
+                name_start = pos + 12
+                desc_start = name_start + ((namesz + 3) & ~3)
+                if n_type == 3 and notes[name_start:name_start + namesz] == b'GNU\x00':  # NT_GNU_BUILD_ID
+                    return binascii.hexlify(notes[desc_start:desc_start + descsz]).decode('ascii')
+                pos = desc_start + ((descsz + 3) & ~3)
+    return None
+
+
+#: Linux ioctl: clone the contents of a file, copy-on-write (btrfs, XFS...)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """
+    Copy-on-write copy of file **src** as **dst** (with its metadata).
+    Raise OSError if not supported by the filesystem.
+    """
+    import fcntl
+    with io.open(src, 'rb') as s:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, s.fileno())
+        except (IOError, OSError):
+            os.close(fd)
+            os.unlink(dst)
+            raise
+        os.close(fd)
+    shutil.copystat(src, dst)
+
+
+def file_sha256(path, blocksize=1 << 20):
+    """sha256 of the contents of file **path**."""
+    h = hashlib.sha256()
+    with io.open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
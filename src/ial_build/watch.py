@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watch mode: continuously synchronise the files edited in a Git worktree into
+the src/local of an incremental pack, and optionally compile it after each
+batch of modifications.
+
+Modifications are detected with inotify (Linux, through ctypes), or by
+polling the worktree if inotify is not available.
+"""
+import os
+import io
+import re
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+
+from .util import unlink_if_exists
+from .registry import registry_update
+
+#: No automatic export
+__all__ = []
+
+#: Files and directories never synchronised (editors temporary files, VCS...)
+DEFAULT_IGNORED = (r'(^|/)\.git(/|$)',
+                   r'(^|/)\.[^/]*\.sw[a-z]$',  # vim
+                   r'(^|/)4913$',  # vim write test
+                   r'~$',
+                   r'(^|/)\.?#[^/]*#?$',  # emacs
+                   r'\.(o|mod|pyc)$',
+                   )
+
+# inotify constants (cf. <sys/inotify.h>)
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+_WATCHED_EVENTS = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+                   _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF)
+_EVENT_HEADER = struct.Struct(str('iIII'))
+
+
+class _Watcher(object):
+    """Common to watchers: filtering of paths."""
+
+    def __init__(self, root, ignored=DEFAULT_IGNORED):
+        self.root = os.path.abspath(root)
+        self._ignored = [re.compile(p) for p in ignored]
+
+    def ignored(self, relpath):
+        return any([p.search(relpath) for p in self._ignored])
+
+    def walk(self):
+        """Yield (relpath, stat) of the files of the tree, not ignored."""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            reldir = os.path.relpath(dirpath, self.root)
+            dirnames[:] = [d for d in dirnames
+                           if not self.ignored(os.path.normpath(os.path.join(reldir, d)))]
+            for f in filenames:
+                relpath = os.path.normpath(os.path.join(reldir, f))
+                if not self.ignored(relpath):
+                    try:
+                        yield relpath, os.stat(os.path.join(dirpath, f))
+                    except OSError:  # removed meanwhile
+                        continue
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(_Watcher):
+    """Detect modifications by comparing snapshots (mtime, size) of the tree."""
+
+    def __init__(self, root, ignored=DEFAULT_IGNORED, interval=1.):
+        """
+        :param root: root directory of the tree to be watched
+        :param ignored: regular expressions of relative paths to be ignored
+        :param interval: delay between snapshots (s)
+        """
+        super(PollingWatcher, self).__init__(root, ignored=ignored)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        return {relpath:(st.st_mtime_ns, st.st_size) for relpath, st in self.walk()}
+
+    def events(self, timeout=None):
+        """
+        Wait for modifications, at most **timeout** seconds (None: forever).
+        Return a dict {relpath: 'changed' or 'deleted'}.
+        """
+        start = time.time()
+        while True:
+            snapshot = self._take_snapshot()
+            events = {}
+            for relpath, sig in snapshot.items():
+                if self._snapshot.get(relpath) != sig:
+                    events[relpath] = 'changed'
+            for relpath in set(self._snapshot.keys()).difference(snapshot.keys()):
+                events[relpath] = 'deleted'
+            self._snapshot = snapshot
+            if events:
+                return events
+            if timeout is not None and time.time() - start >= timeout:
+                return {}
+            time.sleep(self.interval if timeout is None else
+                       max(0., min(self.interval, timeout - (time.time() - start))))
+
+
+class InotifyWatcher(_Watcher):
+    """Detect modifications with inotify, watching recursively the tree."""
+
+    def __init__(self, root, ignored=DEFAULT_IGNORED):
+        """
+        :param root: root directory of the tree to be watched
+        :param ignored: regular expressions of relative paths to be ignored
+        """
+        super(InotifyWatcher, self).__init__(root, ignored=ignored)
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._fd = self._libc.inotify_init1(_IN_CLOEXEC)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self._wds = {}  # wd: relative dirpath
+        self._last_event = time.time()
+        self._add_tree('.')
+
+    def _add_watch(self, reldir):
+        path = os.path.normpath(os.path.join(self.root, reldir))
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCHED_EVENTS)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):  # removed meanwhile
+                return
+            if e == errno.ENOSPC:
+                raise OSError(e, "inotify watches limit reached (cf. /proc/sys/fs/inotify/max_user_watches)")
+            raise OSError(e, os.strerror(e))
+        self._wds[wd] = os.path.normpath(reldir)
+
+    def _add_tree(self, reldir):
+        """Watch directory **reldir** and its subdirectories; return the files found there."""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, reldir)):
+            rel = os.path.relpath(dirpath, self.root)
+            dirnames[:] = [d for d in dirnames
+                           if not self.ignored(os.path.normpath(os.path.join(rel, d)))]
+            self._add_watch(rel)
+            found.extend([os.path.normpath(os.path.join(rel, f)) for f in filenames])
+        return [f for f in found if not self.ignored(f)]
+
+    def _read(self):
+        events = {}
+        data = os.read(self._fd, 1 << 20)
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0').decode('utf-8', errors='surrogateescape')
+            pos += length
+            if mask & _IN_Q_OVERFLOW:  # events lost: look for files modified since latest events
+                print("! inotify queue overflow: rescan")
+                for relpath, st in self.walk():
+                    if st.st_mtime >= self._last_event - 1:
+                        events[relpath] = 'changed'
+                continue
+            if mask & _IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            reldir = self._wds.get(wd)
+            if reldir is None or not name:
+                continue
+            relpath = os.path.normpath(os.path.join(reldir, name))
+            if self.ignored(relpath):
+                continue
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    for f in self._add_tree(relpath):
+                        events[f] = 'changed'
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    prefix = os.path.join(relpath, '')
+                    for w, d in list(self._wds.items()):
+                        if d == relpath or d.startswith(prefix):
+                            self._libc.inotify_rm_watch(self._fd, w)
+                            self._wds.pop(w, None)
+                    events[prefix] = 'deleted'  # whole directory
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                events[relpath] = 'changed'
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                events[relpath] = 'deleted'
+        self._last_event = time.time()
+        return events
+
+    def events(self, timeout=None):
+        """
+        Wait for modifications, at most **timeout** seconds (None: forever).
+        Return a dict {relpath: 'changed' or 'deleted'}; a relpath ending
+        with '/' is a deleted directory.
+        """
+        start = time.time()
+        while True:
+            remaining = None if timeout is None else max(0., timeout - (time.time() - start))
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return {}
+            events = self._read()
+            if events:
+                return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def make_watcher(root, ignored=DEFAULT_IGNORED, polling=False, interval=1.):
+    """Return an InotifyWatcher of **root**, or a PollingWatcher if **polling** or inotify is unavailable."""
+    if not polling:
+        try:
+            return InotifyWatcher(root, ignored=ignored)
+        except (OSError, AttributeError) as e:
+            print("(inotify unavailable: {}; fallback on polling)".format(e))
+    return PollingWatcher(root, ignored=ignored, interval=interval)
+
+
+class PackSync(object):
+    """Apply modifications of a worktree to the src/local of an incremental pack."""
+
+    def __init__(self, pack, worktree):
+        """
+        :param pack: the (incremental) Pack to be synchronised
+        :param worktree: the Git worktree, which relative paths match those of src/local
+        """
+        self.pack = pack
+        self.worktree = os.path.abspath(worktree)
+
+    def apply(self, events):
+        """
+        Apply **events** ({relpath: 'changed' or 'deleted'}) to the pack:
+        changed files are copied to src/local, deleted ones removed from it
+        and ignored at compilation time (to mask the version of the root pack).
+        The sources of the pack then differ from the ones it was populated
+        with: its build key is reset in the pack registry, not to be reused
+        as an equivalent pack.
+
+        Return (changed, deleted) lists of relpaths.
+        """
+        changed = []
+        deleted = []
+        for relpath, kind in sorted(events.items()):
+            if kind == 'deleted' and relpath.endswith('/'):  # directory
+                local_dir = os.path.join(self.pack._local, relpath)
+                if os.path.isdir(local_dir):
+                    for dirpath, _, filenames in os.walk(local_dir):
+                        deleted.extend([os.path.relpath(os.path.join(dirpath, f), self.pack._local)
+                                        for f in filenames])
+                continue
+            src = os.path.join(self.worktree, relpath)
+            if kind == 'changed' and os.path.isfile(src):
+                changed.append(relpath)
+            elif kind == 'deleted' and not os.path.exists(src):
+                deleted.append(relpath)
+        if not changed and not deleted:
+            return changed, deleted
+        with self.pack.lock():
+            for relpath in changed:
+                dst = os.path.join(self.pack._local, relpath)
+                if not os.path.exists(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                unlink_if_exists(dst)
+                with io.open(os.path.join(self.worktree, relpath), 'rb') as fin, io.open(dst, 'wb') as fout:
+                    fout.write(fin.read())
+            for relpath in deleted:
+                unlink_if_exists(os.path.join(self.pack._local, relpath))
+            self.pack.update_ignored_files_at_compiletime(add=deleted, remove=changed)
+            registry_update(self.pack, populated=time.time())
+        return changed, deleted
+
+
+def watch(pack, worktree,
+          programs=None,
+          debounce=2.,
+          polling=False,
+          interval=1.,
+          silent=True,
+          ignored=DEFAULT_IGNORED,
+          max_batches=None):
+    """
+    Watch **worktree** and synchronise its modifications into incremental
+    **pack**, until interrupted (Ctrl-C).
+
+    :param programs: if not None, list of programs to be (re)built after
+        each batch of modifications ([] to compile sources only); the build
+        is incremental (selective clean) and fails fast
+    :param debounce: modifications are applied (and compiled) once the
+        worktree has been quiet for that delay (s)
+    :param polling: use polling instead of inotify
+    :param interval: polling interval (s)
+    :param silent: build output in log files rather than on stdout
+    :param ignored: regular expressions of relative paths not to be synchronised
+    :param max_batches: stop after that many batches of modifications (None: never)
+    """
+    from .algos import pack_build_executables
+    watcher = make_watcher(worktree, ignored=ignored, polling=polling, interval=interval)
+    sync = PackSync(pack, worktree)
+    print("Watching {} ({}) -> {}".format(worktree, type(watcher).__name__, pack._local))
+    batches = 0
+    pending = {}
+    first_event = None
+    try:
+        while max_batches is None or batches < max_batches:
+            events = watcher.events(timeout=debounce if pending else None)
+            if events:
+                if not pending:
+                    first_event = time.time()
+                pending.update(events)
+                continue
+            # quiet for debounce: apply
+            changed, deleted = sync.apply(pending)
+            pending = {}
+            if not changed and not deleted:
+                continue
+            batches += 1
+            print("[{}] synced: {} changed, {} deleted ({:.1f}s after first modification)".format(
+                time.strftime('%H:%M:%S'), len(changed), len(deleted), time.time() - first_event))
+            for f in changed:
+                print("  M {}".format(f))
+            for f in deleted:
+                print("  D {}".format(f))
+            if programs is not None:
+                t0 = time.time()
+                _, report = pack_build_executables(pack,
+                                                   programs=list(programs),
+                                                   silent=silent,
+                                                   regenerate_ics=False,
+                                                   cleanpack='__selective__',
+                                                   fatal_build_failure='__none__',
+                                                   abort_on_fatal=True)
+                status = 'OK' if all([v['OK'] for v in report.values()]) else 'FAILED'
+                print("[{}] build {} in {:.1f}s ({:.1f}s after first modification)".format(
+                    time.strftime('%H:%M:%S'), status, time.time() - t0, time.time() - first_event))
+    except KeyboardInterrupt:
+        print("Stop watching.")
+    finally:
+        watcher.close()
+    return batches
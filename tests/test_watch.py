@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the watch mode.
+"""
+import os
+import io
+
+from ial_build import config
+from ial_build.pygmkpack import Pack
+from ial_build.registry import PackRegistry, registry_update, build_key
+from ial_build.watch import PackSync
+
+
+def _incremental_pack(homepack, packname='mary_CY47_dev.gnu.2y'):
+    """A minimal incremental pack, as created by gmkpack."""
+    os.makedirs(os.path.join(homepack, packname, 'src', 'local'))
+    with io.open(os.path.join(homepack, packname, '.genesis'), 'w') as f:
+        f.write('gmkpack -r 47 -b main -l gnu -o 2y -u {}\n'.format(packname))
+    return Pack(packname, homepack=homepack)
+
+
+def test_sync_invalidates_build_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'PACK_REGISTRY', True)
+    homepack = str(tmp_path / 'homepack')
+    worktree = tmp_path / 'worktree'
+    pack = _incremental_pack(homepack)
+    key = build_key('0' * 40, 'touched', {'release':'CY47'})
+    registry_update(pack, populated=1., build_key=key, touched_hash='touched')
+    registry_update(pack, build_status='OK', binaries=['masterodb'])
+    registry = PackRegistry(homepack)
+    assert registry.lookup_build(key)[0] is not None
+    (worktree / 'arpifs' / 'phys').mkdir(parents=True)
+    (worktree / 'arpifs' / 'phys' / 'a.F90').write_text('subroutine a\nend subroutine\n')
+    changed, deleted = PackSync(pack, str(worktree)).apply({'arpifs/phys/a.F90':'changed'})
+    assert changed == ['arpifs/phys/a.F90'] and deleted == []
+    assert os.path.exists(os.path.join(pack._local, 'arpifs', 'phys', 'a.F90'))
+    assert registry.lookup_build(key)[0] is None
+    record = registry.get(pack.packname)
+    assert record['build_key'] is None and record['build_status'] is None
+    assert record['populated'] > 1.